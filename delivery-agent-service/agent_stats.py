@@ -0,0 +1,121 @@
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from agent_load import FINAL_STATUSES
+from models import AgentDailyStats, DeliveryAgent, Order
+
+# Days covered by the "last_7_days" window, today included
+WEEK_DAYS = 7
+
+
+async def lock_assignments(db, order_ids):
+    """{order_id: (agent_id, status)} of the local copies, locked until commit"""
+    if not order_ids:
+        return {}
+    rows = (await db.execute(
+        select(Order.id, Order.delivery_agent_id, Order.status)
+        .where(Order.id.in_(list(order_ids)))
+        .with_for_update()
+    )).all()
+    return {row.id: (row.delivery_agent_id, row.status) for row in rows}
+
+
+async def record_outcome(db, agent_id, status, when=None):
+    """Count a finished order into the agent's lifetime total and today's rollup"""
+    delivered = int(status == "delivered")
+    if delivered:
+        await db.execute(
+            update(DeliveryAgent)
+            .where(DeliveryAgent.id == agent_id)
+            .values(total_deliveries=DeliveryAgent.total_deliveries + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    stmt = pg_insert(AgentDailyStats).values(
+        agent_id=agent_id,
+        day=(when or datetime.utcnow()).date(),
+        deliveries=delivered,
+        cancellations=1 - delivered
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[AgentDailyStats.agent_id, AgentDailyStats.day],
+        set_={
+            "deliveries": AgentDailyStats.deliveries + stmt.excluded.deliveries,
+            "cancellations": AgentDailyStats.cancellations + stmt.excluded.cancellations
+        }
+    ))
+
+
+def _stats(agent, total_deliveries, active_orders, today, week):
+    return {
+        "agent_id": agent.id,
+        "total_deliveries": total_deliveries,
+        "active_orders": active_orders,
+        "today": {"deliveries": int(today[0] or 0), "cancellations": int(today[1] or 0)},
+        "last_7_days": {"deliveries": int(week[0] or 0), "cancellations": int(week[1] or 0)},
+        "rating": float(agent.rating) if agent.rating else 0.0,
+        "is_available": agent.is_available,
+        "capacity": agent.capacity,
+        "current_load": agent.current_load
+    }
+
+
+async def rollup_stats(db, agent):
+    """Stats from the agent's counters and daily rollups (one small range read)"""
+    today = datetime.utcnow().date()
+    is_today = AgentDailyStats.day == today
+    row = (await db.execute(
+        select(
+            func.sum(case((is_today, AgentDailyStats.deliveries), else_=0)),
+            func.sum(case((is_today, AgentDailyStats.cancellations), else_=0)),
+            func.sum(AgentDailyStats.deliveries),
+            func.sum(AgentDailyStats.cancellations)
+        ).where(
+            AgentDailyStats.agent_id == agent.id,
+            AgentDailyStats.day > today - timedelta(days=WEEK_DAYS)
+        )
+    )).one()
+    return _stats(agent, agent.total_deliveries, agent.current_load, row[0:2], row[2:4])
+
+
+async def aggregate_stats(db, agent):
+    """Stats computed from the agent's orders in a single aggregate query"""
+    midnight = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    week_start = midnight - timedelta(days=WEEK_DAYS - 1)
+    delivered = Order.status == "delivered"
+    cancelled = Order.status == "cancelled"
+    row = (await db.execute(
+        select(
+            func.count().filter(delivered),
+            func.count().filter(Order.status.notin_(FINAL_STATUSES)),
+            func.count().filter(delivered, Order.updated_at >= midnight),
+            func.count().filter(cancelled, Order.updated_at >= midnight),
+            func.count().filter(delivered, Order.updated_at >= week_start),
+            func.count().filter(cancelled, Order.updated_at >= week_start)
+        ).where(Order.delivery_agent_id == agent.id)
+    )).one()
+    return _stats(agent, row[0], row[1], row[2:4], row[4:6])
+
+
+class AgentStatsCache:
+    """Per-agent stats kept for `ttl_seconds` and dropped when this worker changes them"""
+
+    def __init__(self, ttl_seconds=5.0):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+
+    def get(self, agent_id):
+        entry = self._entries.get(agent_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, agent_id, stats):
+        self._entries[agent_id] = (time.monotonic() + self.ttl_seconds, stats)
+
+    def invalidate(self, *agent_ids):
+        for agent_id in agent_ids:
+            self._entries.pop(agent_id, None)
@@ -0,0 +1,264 @@
+import asyncio
+import time
+from array import array
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, or_, select, update
+
+from database import AsyncSessionLocal
+from log import get_logger
+from models import AgentLocation, DeliveryAgent
+from outbox import enqueue
+
+log = get_logger("locations")
+
+# Doubles per point: latitude, longitude, unix time
+_POINT = 3
+
+_agents = DeliveryAgent.__table__
+
+
+class _Trail:
+    """Fixed-size ring of an agent's recent points in one flat array"""
+
+    __slots__ = ("points", "head", "size", "unflushed", "known", "seen")
+
+    def __init__(self, length):
+        self.points = array("d", bytes(8 * _POINT * length))
+        # Slot the next point goes into
+        self.head = 0
+        self.size = 0
+        # Points recorded since the last flush, newest last
+        self.unflushed = 0
+        # Whether a flush has found the agent in the database
+        self.known = False
+        # time.monotonic() of the last ping
+        self.seen = 0.0
+
+
+class LocationBuffer:
+    """In-memory latest position and short trail per agent, flushed in bulk.
+
+    A ping only writes three doubles into the agent's ring, so ingestion
+    never touches the database. Every `flush_seconds` the latest position of
+    each agent that moved is written with one executemany UPDATE (guarded by
+    timestamp, so a late flush never moves an agent backwards) and the new
+    trail points with one multi-row INSERT. The same transaction adds one
+    outbox event with the positions for restaurant service, whose dispatch
+    index reads its own copy of the agents. Points that fall off the ring
+    before a flush are counted as dropped. Each worker buffers its own
+    pings; the trail endpoint only sees this worker's.
+
+    The first flush of a new trail checks the id against delivery_agents;
+    pings for ids that are not agents are discarded with their trail, so
+    they never reach the tables or restaurant service. Trails without a
+    ping for `idle_seconds` are forgotten.
+    """
+
+    def __init__(self, outbox, trail_length=32, flush_seconds=2.0, idle_seconds=900.0):
+        # Outbox dispatcher to wake after a flush commits
+        self.outbox = outbox
+        self.trail_length = trail_length
+        self.flush_seconds = flush_seconds
+        self.idle_seconds = idle_seconds
+        self.received = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.evicted = 0
+        self.flushed_at = None
+        self._trails = {}
+        self._dirty = set()
+        self._task = None
+
+    def __len__(self):
+        return len(self._trails)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            log.error("Failed to flush locations on shutdown", error=str(e))
+
+    def record(self, agent_id, latitude, longitude, timestamp=None):
+        """Store one ping; pings older than the agent's latest are ignored"""
+        now = time.time()
+        timestamp = now if timestamp is None else min(timestamp, now)
+        trail = self._trails.get(agent_id)
+        if trail is None:
+            trail = self._trails[agent_id] = _Trail(self.trail_length)
+        elif trail.points[self._slot(trail, 1) + 2] > timestamp:
+            return False
+
+        offset = trail.head * _POINT
+        trail.points[offset] = latitude
+        trail.points[offset + 1] = longitude
+        trail.points[offset + 2] = timestamp
+        trail.head = (trail.head + 1) % self.trail_length
+        trail.size = min(trail.size + 1, self.trail_length)
+        trail.seen = time.monotonic()
+        if trail.unflushed == self.trail_length:
+            self.dropped += 1
+        else:
+            trail.unflushed += 1
+        self._dirty.add(agent_id)
+        self.received += 1
+        return True
+
+    def _slot(self, trail, back):
+        """Array offset of the point `back` steps before head (1 = newest)"""
+        return ((trail.head - back) % self.trail_length) * _POINT
+
+    def _points(self, trail, count):
+        """The newest `count` points as (latitude, longitude, timestamp), oldest first"""
+        points = trail.points
+        result = []
+        for back in range(count, 0, -1):
+            offset = self._slot(trail, back)
+            result.append((points[offset], points[offset + 1], points[offset + 2]))
+        return result
+
+    def latest(self, agent_id):
+        trail = self._trails.get(agent_id)
+        if trail is None or trail.size == 0:
+            return None
+        return self._points(trail, 1)[0]
+
+    def trail(self, agent_id):
+        trail = self._trails.get(agent_id)
+        if trail is None:
+            return []
+        return self._points(trail, trail.size)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Failed to flush agent locations", error=str(e))
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Forget trails with nothing to flush and no ping for idle_seconds"""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [
+            agent_id for agent_id, trail in self._trails.items()
+            if trail.seen < cutoff and agent_id not in self._dirty
+        ]
+        for agent_id in idle:
+            del self._trails[agent_id]
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def _check_agents(self, agent_ids):
+        """Drop the trails of ids that are not agents; return the ids that are"""
+        unchecked = [agent_id for agent_id in agent_ids if not self._trails[agent_id].known]
+        if not unchecked:
+            return agent_ids
+        async with AsyncSessionLocal() as db:
+            known = set((await db.execute(
+                select(DeliveryAgent.id).where(DeliveryAgent.id.in_(unchecked))
+            )).scalars())
+
+        unknown = [agent_id for agent_id in unchecked if agent_id not in known]
+        for agent_id in unchecked:
+            if agent_id in known:
+                self._trails[agent_id].known = True
+            else:
+                # Pings that arrived meanwhile go with it
+                self.rejected += self._trails.pop(agent_id).unflushed
+                self._dirty.discard(agent_id)
+        if unknown:
+            log.warning("Dropped pings for unknown agents", agent_ids=sorted(unknown)[:20], count=len(unknown))
+        return agent_ids - set(unknown)
+
+    async def flush(self):
+        """Write latest positions and new trail points of agents that moved"""
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        try:
+            dirty = await self._check_agents(dirty)
+        except Exception:
+            self._dirty |= dirty
+            raise
+        if not dirty:
+            return 0
+
+        positions = []
+        history = []
+        taken = {}
+        for agent_id in dirty:
+            trail = self._trails[agent_id]
+            taken[agent_id] = trail.unflushed
+            points = self._points(trail, trail.unflushed)
+            trail.unflushed = 0
+            latitude, longitude, timestamp = points[-1]
+            positions.append({
+                "agent_id": agent_id,
+                "new_latitude": latitude,
+                "new_longitude": longitude,
+                "new_recorded_at": datetime.utcfromtimestamp(timestamp)
+            })
+            history.extend(
+                {
+                    "agent_id": agent_id,
+                    "latitude": point_latitude,
+                    "longitude": point_longitude,
+                    "recorded_at": datetime.utcfromtimestamp(point_timestamp)
+                }
+                for point_latitude, point_longitude, point_timestamp in points
+            )
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(_agents)
+                    .where(
+                        _agents.c.id == bindparam("agent_id"),
+                        or_(
+                            _agents.c.location_updated_at.is_(None),
+                            _agents.c.location_updated_at < bindparam("new_recorded_at")
+                        )
+                    )
+                    .values(
+                        latitude=bindparam("new_latitude"),
+                        longitude=bindparam("new_longitude"),
+                        location_updated_at=bindparam("new_recorded_at")
+                    ),
+                    positions
+                )
+                await db.execute(insert(AgentLocation), history)
+                enqueue(db, "restaurant", "/agents/locations", {
+                    "positions": [
+                        {
+                            "agent_id": position["agent_id"],
+                            "latitude": position["new_latitude"],
+                            "longitude": position["new_longitude"],
+                            "recorded_at": position["new_recorded_at"].isoformat()
+                        }
+                        for position in positions
+                    ]
+                })
+                await db.commit()
+        except Exception:
+            # Put the points back for the next attempt (the ring may have moved on)
+            for agent_id, count in taken.items():
+                trail = self._trails[agent_id]
+                trail.unflushed = min(trail.unflushed + count, trail.size)
+            self._dirty |= dirty
+            raise
+
+        self.outbox.notify()
+        self.flushed_at = time.time()
+        return len(history)
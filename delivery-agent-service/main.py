@@ -1,26 +1,227 @@
-from fastapi import FastAPI, Depends, HTTPException
+import os
+import sys
+
+# Modules shared by the three services (metrics, tracing, logging, ...) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-from datetime import datetime
-import httpx
+from datetime import datetime, timezone
 
-from database import get_db
+from config import (
+    USER_SERVICE_URL,
+    USER_SERVICE_DOCKER_URL,
+    RESTAURANT_SERVICE_URL,
+    RESTAURANT_SERVICE_DOCKER_URL,
+    OFFER_ACCEPT_SECONDS,
+    OFFER_MAX_ATTEMPTS,
+    OFFER_SWEEP_SECONDS,
+    OFFER_PERSIST_SECONDS,
+    LOCATION_TRAIL_LENGTH,
+    LOCATION_FLUSH_SECONDS,
+    LOCATION_BATCH_MAX_PINGS,
+    LOCATION_IDLE_SECONDS,
+    AGENT_STATS_CACHE_SECONDS,
+    AGENT_STATS_FROM_ROLLUPS,
+    DB_POOL_WARM_CONNECTIONS,
+    STARTUP_BUDGET_SECONDS,
+    READINESS_PROBE_SECONDS,
+    READINESS_PROBE_TIMEOUT,
+    READINESS_MAX_POOL_USAGE,
+    METRICS_ENABLED,
+    QUERY_STATS_ENABLED,
+    QUERY_STATS_HEADERS,
+    QUERY_BUDGET,
+    QUERY_REPEAT_THRESHOLD,
+    TRACING_ENABLED,
+    TRACING_DB_SPANS,
+    PROFILER_MAX_SECONDS,
+    PROFILER_ROLLING_ENABLED,
+    PROFILER_ROLLING_INTERVAL_MS,
+    PROFILER_ROLLING_WINDOW_SECONDS
+)
+from agent_load import adjust_loads, is_active, load_changes
+from agent_stats import AgentStatsCache, aggregate_stats, lock_assignments, record_outcome, rollup_stats
+from database import get_db, get_async_db, dispose_engines, engine, async_engine
+from health import ServiceHealth
+from http_clients import open_clients, close_clients
+from location_buffer import LocationBuffer
+from log import RequestContextMiddleware, bind, get_logger, start_logging, stop_logging
+from metrics import CONTENT_TYPE, MetricsMiddleware, instrument_engines, render as render_metrics
 from models import DeliveryAgent, Order
+from offers import OfferManager
+from order_sync import upsert_order, status_event
+from outbox import OutboxDispatcher, enqueue
+from profiler import Profiler, RollingProfiler, render_profile, require_admin
+from query_stats import QueryStatsMiddleware, instrument_engines as instrument_queries
+from rating_sync import apply_ratings
 from schemas import (
     AgentCreate, 
     AgentResponse, 
     AgentStatusUpdate, 
+    AgentLocationUpdate,
+    LocationPing,
+    LocationPingBatch,
+    RatingSyncBatch,
     OrderStatusUpdate,
     OrderAssignment,
+    BulkOrderAssignment,
     OrderResponse
 )
+from tracing import TracingMiddleware, instrument_engines as instrument_tracing, tracer
+
+log = get_logger("api")
+
+outbox_dispatcher = OutboxDispatcher({
+    "user": (USER_SERVICE_URL, USER_SERVICE_DOCKER_URL),
+    "restaurant": (RESTAURANT_SERVICE_URL, RESTAURANT_SERVICE_DOCKER_URL)
+})
+offer_manager = OfferManager(
+    outbox_dispatcher,
+    accept_seconds=OFFER_ACCEPT_SECONDS,
+    max_attempts=OFFER_MAX_ATTEMPTS,
+    sweep_seconds=OFFER_SWEEP_SECONDS,
+    persist_seconds=OFFER_PERSIST_SECONDS
+)
+location_buffer = LocationBuffer(
+    outbox_dispatcher,
+    trail_length=LOCATION_TRAIL_LENGTH,
+    flush_seconds=LOCATION_FLUSH_SECONDS,
+    idle_seconds=LOCATION_IDLE_SECONDS
+)
+agent_stats = AgentStatsCache(ttl_seconds=AGENT_STATS_CACHE_SECONDS)
+
+profiler = Profiler(max_seconds=PROFILER_MAX_SECONDS)
+rolling_profiler = RollingProfiler(
+    interval=PROFILER_ROLLING_INTERVAL_MS / 1000,
+    window_seconds=PROFILER_ROLLING_WINDOW_SECONDS
+) if PROFILER_ROLLING_ENABLED else None
+
+service_health = ServiceHealth(
+    startup_budget=STARTUP_BUDGET_SECONDS,
+    warm_connections=DB_POOL_WARM_CONNECTIONS,
+    probe_seconds=READINESS_PROBE_SECONDS,
+    probe_timeout=READINESS_PROBE_TIMEOUT,
+    max_pool_usage=READINESS_MAX_POOL_USAGE
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    service_health.start()
+    tracer.start()
+    if rolling_profiler is not None:
+        rolling_profiler.start()
+    open_clients(["user", "restaurant"])
+    outbox_dispatcher.start()
+    offer_manager.start()
+    location_buffer.start()
+    yield
+    await location_buffer.stop()
+    await offer_manager.stop()
+    await outbox_dispatcher.stop()
+    await close_clients()
+    await service_health.stop()
+    await dispose_engines()
+    if rolling_profiler is not None:
+        rolling_profiler.stop()
+    tracer.stop()
+    stop_logging()
 
-app = FastAPI(title="Delivery Agent Service", description="Food Delivery Agent Service API", version="1.0.0")
+app = FastAPI(title="Delivery Agent Service", description="Food Delivery Agent Service API", version="1.0.0", lifespan=lifespan)
+
+if QUERY_STATS_ENABLED:
+    app.add_middleware(
+        QueryStatsMiddleware,
+        budget=QUERY_BUDGET,
+        repeat_threshold=QUERY_REPEAT_THRESHOLD,
+        headers=QUERY_STATS_HEADERS
+    )
+    instrument_queries([engine, async_engine])
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engines({"sync": engine, "async": async_engine})
+if TRACING_ENABLED:
+    # Added last so it is outermost and every other layer runs inside the request's span
+    app.add_middleware(TracingMiddleware)
+    if TRACING_DB_SPANS:
+        instrument_tracing([engine, async_engine])
+# Outermost, so every layer below logs with the request's id
+app.add_middleware(RequestContextMiddleware)
 
 @app.get("/", tags=["Health"])
 def health_check():
     return {"status": "Delivery Agent Service is running"}
 
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """Liveness: the process is up and its event loop answers"""
+    return service_health.live()
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """Readiness: warmed up, database reachable (cached probe) and pools not saturated"""
+    ready, details = await service_health.ready()
+    return JSONResponse(status_code=200 if ready else 503, content=details)
+
+@app.get("/metrics", tags=["Health"])
+def get_metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/traces", tags=["Health"])
+def get_traces(limit: int = 20):
+    """Most recent traces this worker took part in"""
+    return {"traces": tracer.recent(limit), "dropped_spans": tracer.dropped}
+
+@app.get("/traces/{trace_id}", tags=["Health"])
+def get_trace(trace_id: str):
+    """Spans this worker recorded for one trace, in start order"""
+    spans = tracer.trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "spans": sorted(spans, key=lambda span: span["start"])}
+
+@app.get("/debug/profile", tags=["Debug"], dependencies=[Depends(require_admin)])
+async def get_profile(seconds: float = 10.0, interval_ms: float = 10.0, format: str = "collapsed", idle: bool = False):
+    """Sample this worker's threads and event loop for a few seconds (admin only)"""
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    counts, samples, interval = await profiler.profile(seconds, interval_ms / 1000, idle)
+    response = render_profile(counts, interval, format, f"delivery-agent-service {seconds:g}s")
+    response.headers["X-Profile-Samples"] = str(samples)
+    return response
+
+@app.get("/debug/profile/rolling", tags=["Debug"], dependencies=[Depends(require_admin)])
+def get_rolling_profile(format: str = "collapsed"):
+    """Always-on low-rate profile of the last few minutes (admin only)"""
+    if rolling_profiler is None:
+        raise HTTPException(status_code=404, detail="Rolling profile is off (PROFILER_ROLLING_ENABLED)")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    counts, covered = rolling_profiler.snapshot()
+    return render_profile(counts, rolling_profiler.interval, format, f"delivery-agent-service last {covered}s")
+
+def _agent_profile(agent):
+    """Agent payload for restaurant service's copy of the agent"""
+    return {
+        "id": agent.id,
+        "name": agent.name,
+        "email": agent.email,
+        "phone": agent.phone,
+        "vehicle_type": agent.vehicle_type,
+        "capacity": agent.capacity,
+        "on_shift": agent.on_shift,
+        "is_available": agent.is_available
+    }
+
 @app.post("/agents", response_model=AgentResponse, tags=["Agents"])
 def register_agent(agent_data: AgentCreate, db: Session = Depends(get_db)):
     """Register a new delivery agent"""
@@ -34,10 +235,15 @@ def register_agent(agent_data: AgentCreate, db: Session = Depends(get_db)):
         name=agent_data.name,
         email=agent_data.email,
         phone=agent_data.phone,
-        vehicle_type=agent_data.vehicle_type
+        vehicle_type=agent_data.vehicle_type,
+        capacity=agent_data.capacity
     )
     
     db.add(new_agent)
+    db.flush()
+    # Restaurant service dispatches from its own copy of the agents. The event goes out on
+    # the outbox's next poll: sync endpoints run in a thread and must not touch its loop
+    enqueue(db, "restaurant", "/agents/sync", {"agents": [_agent_profile(new_agent)]})
     db.commit()
     db.refresh(new_agent)
     
@@ -65,94 +271,228 @@ def update_agent_status(agent_id: int, status_data: AgentStatusUpdate, db: Sessi
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    agent.is_available = status_data.is_available
+    # The agent's own switch; while on shift they stay unavailable if full
+    agent.on_shift = status_data.is_available
+    agent.is_available = agent.on_shift and agent.current_load < agent.capacity
+    enqueue(db, "restaurant", "/agents/sync", {"agents": [_agent_profile(agent)]})
+    db.commit()
+    db.refresh(agent)
+    
+    return agent
+
+@app.put("/agents/{agent_id}/location", response_model=AgentResponse, tags=["Agents"])
+def update_agent_location(agent_id: int, location: AgentLocationUpdate, db: Session = Depends(get_db)):
+    """Update the current location of a delivery agent"""
+    agent = db.query(DeliveryAgent).filter(DeliveryAgent.id == agent_id).first()
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    
+    agent.latitude = location.latitude
+    agent.longitude = location.longitude
+    agent.location_updated_at = datetime.utcnow()
+    # Restaurant service's dispatch index reads positions from its own copy
+    enqueue(db, "restaurant", "/agents/locations", {"positions": [{
+        "agent_id": agent.id,
+        "latitude": agent.latitude,
+        "longitude": agent.longitude,
+        "recorded_at": agent.location_updated_at.isoformat()
+    }]})
     db.commit()
     db.refresh(agent)
     
     return agent
 
+def _ping_time(ping):
+    if ping.recorded_at is None:
+        return None
+    recorded_at = ping.recorded_at
+    if recorded_at.tzinfo is None:
+        recorded_at = recorded_at.replace(tzinfo=timezone.utc)
+    return recorded_at.timestamp()
+
+@app.post("/agents/{agent_id}/pings", status_code=202, tags=["Locations"])
+async def record_location_ping(agent_id: int, ping: LocationPing):
+    """Record one location ping; written to the database in the next bulk flush"""
+    recorded = location_buffer.record(agent_id, ping.latitude, ping.longitude, _ping_time(ping))
+    return {"accepted": int(recorded)}
+
+@app.post("/agents/pings", status_code=202, tags=["Locations"])
+async def record_location_pings(batch: LocationPingBatch):
+    """Record a batch of location pings from one or more agents"""
+    if len(batch.pings) > LOCATION_BATCH_MAX_PINGS:
+        raise HTTPException(status_code=400, detail=f"At most {LOCATION_BATCH_MAX_PINGS} pings per batch")
+    
+    accepted = 0
+    for ping in batch.pings:
+        accepted += location_buffer.record(ping.agent_id, ping.latitude, ping.longitude, _ping_time(ping))
+    return {"accepted": accepted}
+
+@app.get("/agents/{agent_id}/trail", tags=["Locations"])
+async def get_agent_trail(agent_id: int):
+    """Get the recent trail of an agent as buffered by this worker, oldest first"""
+    return {
+        "agent_id": agent_id,
+        "points": [
+            {
+                "latitude": latitude,
+                "longitude": longitude,
+                "recorded_at": datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+            }
+            for latitude, longitude, timestamp in location_buffer.trail(agent_id)
+        ]
+    }
+
+@app.get("/locations/stats", tags=["Locations"])
+def get_location_stats():
+    """Get location ingestion counters for this worker"""
+    return {
+        "tracked_agents": len(location_buffer),
+        "received": location_buffer.received,
+        "dropped": location_buffer.dropped,
+        "rejected": location_buffer.rejected,
+        "evicted": location_buffer.evicted,
+        "flushed_at": location_buffer.flushed_at
+    }
+
 @app.get("/agents/available", response_model=List[AgentResponse], tags=["Agents"])
 def get_available_agents(db: Session = Depends(get_db)):
     """Get all available delivery agents"""
     agents = db.query(DeliveryAgent).filter(DeliveryAgent.is_available == True).all()
     return agents
 
+@app.post("/ratings/sync", tags=["Ratings"])
+async def receive_ratings(batch: RatingSyncBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive agents' rating aggregates from user service"""
+    await apply_ratings(db, DeliveryAgent, batch.agents)
+    await db.commit()
+    agent_stats.invalidate(*(aggregate.id for aggregate in batch.agents))
+    return {"message": f"{len(batch.agents)} ratings synchronized"}
+
 @app.post("/orders/assign", tags=["Orders"])
-async def receive_order_assignment(assignment: OrderAssignment, db: Session = Depends(get_db)):
+async def receive_order_assignment(assignment: OrderAssignment, db: AsyncSession = Depends(get_async_db)):
     """Receive order assignment from restaurant service"""
+    bind(order_id=assignment.order_id)
     
-    # Check if order already exists
-    order = db.query(Order).filter(Order.id == assignment.order_id).first()
-    if not order:        # Fetch order details from restaurant service
-        try:
-            async with httpx.AsyncClient() as client:
-                # Import config here to avoid circular imports
-                import sys
-                sys.path.append('..') 
-                try:
-                    from config import RESTAURANT_SERVICE_URL, RESTAURANT_SERVICE_DOCKER_URL
-                except ImportError:
-                    # Default URLs if config can't be imported
-                    RESTAURANT_SERVICE_URL = "http://localhost:8002"
-                    RESTAURANT_SERVICE_DOCKER_URL = "http://restaurant-service:8000"
-                
-                try:
-                    # Try configured URL first (from environment or localhost)
-                    restaurant_url = f"{RESTAURANT_SERVICE_URL}/orders/{assignment.order_id}"
-                    print(f"DELIVERY: Trying to fetch order from: {restaurant_url}")
-                    response = await client.get(restaurant_url, timeout=5.0)
-                    print(f"DELIVERY: Fetched order from restaurant service: {response.status_code}")
-                except Exception as primary_e:
-                    print(f"DELIVERY: Failed to fetch order from primary service, trying fallback: {primary_e}")
-                    # Fallback to Docker service name
-                    response = await client.get(f"{RESTAURANT_SERVICE_DOCKER_URL}/orders/{assignment.order_id}")
-                
-                if response.status_code == 200:
-                    order_data = response.json()
-                    
-                    # Create order in delivery service database
-                    order = Order(
-                        id=order_data["id"],
-                        user_id=order_data["user_id"],
-                        restaurant_id=order_data["restaurant_id"],
-                        delivery_agent_id=assignment.agent_id,
-                        status=order_data["status"],
-                        total_amount=order_data["total_amount"],
-                        delivery_address=order_data["delivery_address"],
-                        special_instructions=order_data.get("special_instructions"),
-                        created_at=datetime.fromisoformat(order_data["created_at"]),
-                        updated_at=datetime.utcnow()
-                    )
-                    
-                    db.add(order)
-                    db.commit()
-                    db.refresh(order)
-                else:
-                    raise HTTPException(status_code=400, detail="Failed to fetch order details")
-        except Exception as e:
-            print(f"Failed to sync order: {e}")
-            raise HTTPException(status_code=400, detail="Failed to synchronize order")
-    else:
-        # Update existing order with agent assignment
-        order.delivery_agent_id = assignment.agent_id
-        order.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(order)
+    # An unknown agent is reported rather than failing the event, which would only be
+    # redelivered; nothing is written for it
+    if await db.get(DeliveryAgent, assignment.agent_id) is None:
+        log.warning("Assignment references an unknown agent", agent_id=assignment.agent_id)
+        return {
+            "message": f"Order {assignment.order_id} not assigned: agent {assignment.agent_id} not found",
+            "unknown_agents": [assignment.agent_id]
+        }
     
-    agent = db.query(DeliveryAgent).filter(DeliveryAgent.id == assignment.agent_id).first()
-    if not agent:
-        raise HTTPException(status_code=404, detail="Agent not found")
+    # The event carries the full order, so no call back to restaurant service
+    before = await lock_assignments(db, [assignment.order_id])
+    applied = await upsert_order(db, assignment.order, delivery_agent_id=assignment.agent_id)
+    deltas = {}
+    if applied:
+        # Keep the agents' active-order counters in step with the new assignment
+        deltas = load_changes(before, {assignment.order_id: (assignment.agent_id, assignment.order.status)})
+        await adjust_loads(db, deltas)
+    await db.commit()
+    agent_stats.invalidate(*deltas)
+    
+    # Push the offer to the agent now; redeliveries are not offered twice
+    if applied:
+        await offer_manager.offer(
+            assignment.order_id,
+            assignment.agent_id,
+            assignment.order.restaurant_id,
+            assignment.order.model_dump(mode="json")
+        )
+    
+    return {
+        "message": f"Order {assignment.order_id} assigned to agent {assignment.agent_id}",
+        "unknown_agents": []
+    }
+
+@app.post("/orders/assign/bulk", tags=["Orders"])
+async def receive_bulk_order_assignment(bulk: BulkOrderAssignment, db: AsyncSession = Depends(get_async_db)):
+    """Receive a batch of order assignments from restaurant service"""
+    
+    # Unknown agents are reported rather than failing the batch, which would only be
+    # redelivered; their assignments are left out before anything is written
+    agent_ids = {assignment.agent_id for assignment in bulk.assignments}
+    known = set((await db.execute(
+        select(DeliveryAgent.id).where(DeliveryAgent.id.in_(agent_ids))
+    )).scalars().all()) if agent_ids else set()
+    missing = sorted(agent_ids - known)
+    if missing:
+        log.warning("Bulk assignment references unknown agents", agent_ids=missing)
+    assignments = [assignment for assignment in bulk.assignments if assignment.agent_id in known]
+    
+    before = await lock_assignments(db, [assignment.order_id for assignment in assignments])
+    applied = []
+    for assignment in assignments:
+        if await upsert_order(db, assignment.order, delivery_agent_id=assignment.agent_id):
+            applied.append(assignment)
+    deltas = load_changes(before, {
+        assignment.order_id: (assignment.agent_id, assignment.order.status) for assignment in applied
+    })
+    await adjust_loads(db, deltas)
+    await db.commit()
+    agent_stats.invalidate(*deltas)
+    
+    for assignment in applied:
+        await offer_manager.offer(
+            assignment.order_id,
+            assignment.agent_id,
+            assignment.order.restaurant_id,
+            assignment.order.model_dump(mode="json")
+        )
     
-    return {"message": f"Order {assignment.order_id} assigned to agent {assignment.agent_id}"}
+    return {
+        "message": f"{len(assignments)} orders assigned",
+        "unknown_agents": missing
+    }
+
+@app.websocket("/agents/{agent_id}/offers")
+async def agent_offers(websocket: WebSocket, agent_id: int):
+    """Push assignment offers to a connected agent and take accept/decline answers"""
+    await websocket.accept()
+    await offer_manager.connect(agent_id, websocket)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("type")
+            order_id = message.get("order_id")
+            if action == "accept":
+                ok = await offer_manager.accept(order_id, agent_id)
+            elif action == "decline":
+                ok = await offer_manager.decline(order_id, agent_id)
+            else:
+                ok = False
+            await websocket.send_json({"type": action, "order_id": order_id, "ok": ok})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        offer_manager.disconnect(agent_id, websocket)
+
+@app.put("/offers/{order_id}/accept", tags=["Offers"])
+async def accept_offer(order_id: int, agent_id: int):
+    """Accept an assignment offer (for clients without a WebSocket)"""
+    if not await offer_manager.accept(order_id, agent_id):
+        raise HTTPException(status_code=409, detail="No open offer for this agent")
+    return {"message": f"Order {order_id} accepted by agent {agent_id}"}
+
+@app.put("/offers/{order_id}/decline", tags=["Offers"])
+async def decline_offer(order_id: int, agent_id: int):
+    """Decline an assignment offer so it moves on to another agent"""
+    if not await offer_manager.decline(order_id, agent_id):
+        raise HTTPException(status_code=409, detail="No open offer for this agent")
+    return {"message": f"Order {order_id} declined by agent {agent_id}"}
 
 @app.put("/orders/{order_id}/status", response_model=OrderResponse, tags=["Orders"])
-def update_order_status(order_id: int, status_data: OrderStatusUpdate, agent_id: int, db: Session = Depends(get_db)):
+async def update_order_status(order_id: int, status_data: OrderStatusUpdate, agent_id: int, db: AsyncSession = Depends(get_async_db)):
     """Update delivery status of an order"""
     
-    order = db.query(Order).filter(
-        Order.id == order_id,
-        Order.delivery_agent_id == agent_id
-    ).first()
+    order = (await db.execute(
+        select(Order).where(
+            Order.id == order_id,
+            Order.delivery_agent_id == agent_id
+        ).with_for_update()
+    )).scalar_one_or_none()
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found or not assigned to this agent")
@@ -166,23 +506,34 @@ def update_order_status(order_id: int, status_data: OrderStatusUpdate, agent_id:
     if status_data.status not in valid_statuses:
         raise HTTPException(status_code=400, detail="Invalid status")
     
+    previous_status = order.status
     order.status = status_data.status
+    order.version += 1
     order.updated_at = datetime.utcnow()
     
-    # If order is delivered or cancelled, make agent available again
-    if status_data.status in ["delivered", "cancelled"]:
-        agent = db.query(DeliveryAgent).filter(DeliveryAgent.id == agent_id).first()
-        if agent:
-            agent.is_available = True
+    # If order is delivered or cancelled, free its slot on the agent and count the outcome (once)
+    await adjust_loads(db, load_changes(
+        {order_id: (agent_id, previous_status)},
+        {order_id: (agent_id, order.status)}
+    ))
+    if is_active(previous_status) and not is_active(order.status):
+        await record_outcome(db, agent_id, order.status, order.updated_at)
     
-    db.commit()
-    db.refresh(order)
+    # Push the change to the customer's order stream, and to restaurant service so it
+    # releases the agent's load there too, once this transaction commits
+    event = status_event(order)
+    enqueue(db, "user", "/orders/status", {"events": [event]})
+    enqueue(db, "restaurant", "/orders/status", {"events": [event]})
+    
+    await db.commit()
+    outbox_dispatcher.notify()
+    agent_stats.invalidate(agent_id)
     
     return order
 
 @app.get("/orders/assigned/{agent_id}", response_model=List[OrderResponse], tags=["Orders"])
 def get_assigned_orders(agent_id: int, db: Session = Depends(get_db)):
-    """Get all orders assigned to a delivery agent"""
+    """Get the batch of orders an agent is carrying, grouped by pickup"""
     
     # Verify agent exists
     agent = db.query(DeliveryAgent).filter(DeliveryAgent.id == agent_id).first()
@@ -192,7 +543,7 @@ def get_assigned_orders(agent_id: int, db: Session = Depends(get_db)):
     orders = db.query(Order).filter(
         Order.delivery_agent_id == agent_id,
         Order.status.notin_(["delivered", "cancelled"])
-    ).all()
+    ).order_by(Order.restaurant_id, Order.created_at, Order.id).all()
     
     return orders
 
@@ -211,30 +562,24 @@ def get_order_details(order_id: int, agent_id: int, db: Session = Depends(get_db
     return order
 
 @app.get("/agents/{agent_id}/stats", tags=["Stats"])
-def get_agent_stats(agent_id: int, db: Session = Depends(get_db)):
-    """Get delivery statistics for an agent"""
+async def get_agent_stats(agent_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get delivery statistics for an agent, overall and for today and the last 7 days"""
     
-    agent = db.query(DeliveryAgent).filter(DeliveryAgent.id == agent_id).first()
+    stats = agent_stats.get(agent_id)
+    if stats is not None:
+        return stats
+    
+    agent = await db.get(DeliveryAgent, agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    total_deliveries = db.query(Order).filter(
-        Order.delivery_agent_id == agent_id,
-        Order.status == "delivered"
-    ).count()
-    
-    active_orders = db.query(Order).filter(
-        Order.delivery_agent_id == agent_id,
-        Order.status.notin_(["delivered", "cancelled"])
-    ).count()
+    if AGENT_STATS_FROM_ROLLUPS:
+        stats = await rollup_stats(db, agent)
+    else:
+        stats = await aggregate_stats(db, agent)
+    agent_stats.put(agent_id, stats)
     
-    return {
-        "agent_id": agent_id,
-        "total_deliveries": total_deliveries,
-        "active_orders": active_orders,
-        "rating": float(agent.rating) if agent.rating else 0.0,
-        "is_available": agent.is_available
-    }
+    return stats
 
 @app.get("/orders", response_model=List[OrderResponse], tags=["Orders"])
 def get_all_orders(db: Session = Depends(get_db)):
@@ -262,9 +607,10 @@ def debug_get_all_orders(db: Session = Depends(get_db)):
 @app.get("/debug/order/{order_id}", tags=["Debug"])
 def debug_get_order(order_id: int, db: Session = Depends(get_db)):
     """Debug endpoint to get detailed order information by ID"""
+    bind(order_id=order_id)
     # Check if order exists in db
     order = db.query(Order).filter(Order.id == order_id).first()
-    print(f"DEBUG: Looking for order {order_id}, found: {order is not None}")
+    log.debug("Looked up order", found=order is not None)
     
     if not order:
         return {
@@ -326,7 +672,7 @@ def debug_create_order(order_data: dict, db: Session = Depends(get_db)):
         
         return order
     except Exception as e:
-        print(f"Error creating debug order: {e}")
+        log.exception("Failed to create debug order")
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
 
 @app.post("/debug_create_order")
@@ -356,7 +702,7 @@ def debug_create_order_no_tags(order_data: dict, db: Session = Depends(get_db)):
         
         return order
     except Exception as e:
-        print(f"Error creating debug order: {e}")
+        log.exception("Failed to create debug order")
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
 
 @app.get("/debug_order/{order_id}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, Float, ForeignKey, JSON, Date
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -23,6 +23,8 @@ class Restaurant(Base):
     cuisine_type = Column(String(100))
     is_online = Column(Boolean, default=True)
     rating = Column(DECIMAL(3,2), default=0.0)
+    latitude = Column(Float)
+    longitude = Column(Float)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
 class DeliveryAgent(Base):
@@ -33,8 +35,21 @@ class DeliveryAgent(Base):
     email = Column(String(255), unique=True, nullable=False)
     phone = Column(String(20))
     vehicle_type = Column(String(50))
+    # Available means on shift (the agent's own switch) and below capacity
     is_available = Column(Boolean, default=True)
+    on_shift = Column(Boolean, default=True, nullable=False)
+    # Orders the agent can carry at once and how many it carries now
+    capacity = Column(Integer, default=1, nullable=False)
+    current_load = Column(Integer, default=0, nullable=False)
+    # Lifetime delivered orders, counted as each delivery completes
+    total_deliveries = Column(Integer, default=0, nullable=False)
     rating = Column(DECIMAL(3,2), default=0.0)
+    # Running totals behind rating, copied from user service (rating_sync)
+    rating_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    location_updated_at = Column(TIMESTAMP)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
 class Order(Base):
@@ -45,8 +60,61 @@ class Order(Base):
     restaurant_id = Column(Integer)
     delivery_agent_id = Column(Integer)
     status = Column(String(50), default="pending")
+    version = Column(Integer, default=1, nullable=False)
     total_amount = Column(DECIMAL(10,2), nullable=False)
     delivery_address = Column(Text)
     special_instructions = Column(Text)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer)
+    menu_item_id = Column(Integer)
+    quantity = Column(Integer, nullable=False)
+    price = Column(DECIMAL(10,2), nullable=False)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(50), nullable=False)
+    target = Column(String(50), nullable=False)
+    path = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(TIMESTAMP, default=datetime.utcnow)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    delivered_at = Column(TIMESTAMP)
+    # W3C trace context of the request that wrote the event
+    traceparent = Column(String(55))
+
+class AgentLocation(Base):
+    __tablename__ = "agent_locations"
+    
+    id = Column(Integer, primary_key=True)
+    agent_id = Column(Integer, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    recorded_at = Column(TIMESTAMP, nullable=False)
+
+class DispatchOffer(Base):
+    __tablename__ = "dispatch_offers"
+    
+    order_id = Column(Integer, primary_key=True)
+    agent_id = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False)
+    attempts = Column(Integer, default=1, nullable=False)
+    expires_at = Column(TIMESTAMP, nullable=False)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+class AgentDailyStats(Base):
+    __tablename__ = "agent_daily_stats"
+    
+    agent_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    deliveries = Column(Integer, default=0, nullable=False)
+    cancellations = Column(Integer, default=0, nullable=False)
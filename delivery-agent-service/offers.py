@@ -0,0 +1,402 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from agent_load import adjust_loads
+from database import AsyncSessionLocal
+from geo import haversine_km
+from log import get_logger
+from models import DeliveryAgent, DispatchOffer, Order, Restaurant
+from order_sync import build_snapshot, build_snapshots, status_event
+from outbox import enqueue
+
+OFFERED = "offered"
+ACCEPTED = "accepted"
+DECLINED = "declined"
+# Nobody else could take it; the assignment stays with the last agent
+UNANSWERED = "unanswered"
+# The order moved on (another agent, or no longer waiting for pickup)
+CLOSED = "closed"
+
+log = get_logger("dispatch")
+
+
+class Offer:
+    __slots__ = ("order_id", "agent_id", "restaurant_id", "order", "expires_at", "attempts", "passed", "status", "dirty")
+
+    def __init__(self, order_id, agent_id, restaurant_id, order, expires_at, attempts=1, passed=()):
+        self.order_id = order_id
+        self.agent_id = agent_id
+        self.restaurant_id = restaurant_id
+        self.order = order
+        self.expires_at = expires_at
+        self.attempts = attempts
+        # Agents that already let this order go
+        self.passed = set(passed)
+        self.status = OFFERED
+        self.dirty = True
+
+    def message(self):
+        return {
+            "type": "offer",
+            "order_id": self.order_id,
+            "expires_at": self.expires_at.isoformat(),
+            "order": self.order
+        }
+
+
+class OfferManager:
+    """Pushes assignment offers to agents and moves them on when unanswered.
+
+    Offers live in memory on the worker that received the assignment and are
+    pushed at once to the agent's open WebSockets. An agent has
+    `accept_seconds` to accept; a declined or expired offer is handed to the
+    next-best agent with spare capacity (nearest to the restaurant, then
+    highest rated) by releasing the old claim and claiming the new agent in
+    one transaction; restaurant service gets the same move as a status
+    event through the outbox. State is written to dispatch_offers every
+    `persist_seconds`; that table is also how workers cooperate: an agent
+    connected to another worker is pushed the offer from there, answers
+    through the table, and the owning worker picks the answer up on its
+    next pass. The row is locked before any fallback, so an accept that won
+    the race is never undone.
+    """
+
+    def __init__(self, outbox, accept_seconds=30.0, max_attempts=5, sweep_seconds=0.5, persist_seconds=2.0, candidate_limit=20):
+        # Outbox dispatcher to wake after a reassignment commits
+        self.outbox = outbox
+        self.accept_seconds = accept_seconds
+        self.max_attempts = max_attempts
+        self.sweep_seconds = sweep_seconds
+        self.persist_seconds = persist_seconds
+        self.candidate_limit = candidate_limit
+        self._offers = {}
+        self._sockets = {}
+        self._resolving = set()
+        # (order_id, agent_id) of offers owned elsewhere already pushed from here
+        self._pushed = set()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._every(self.sweep_seconds, self.sweep)),
+            asyncio.create_task(self._every(self.persist_seconds, self.persist))
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        try:
+            await self.persist()
+        except Exception as e:
+            log.error("Failed to persist offers on shutdown", error=str(e))
+
+    async def _every(self, seconds, job):
+        while True:
+            await asyncio.sleep(seconds)
+            try:
+                await job()
+            except Exception as e:
+                log.error("Offer job failed", job=job.__name__, error=str(e))
+
+    def open_offers(self, agent_id):
+        return [
+            offer for offer in self._offers.values()
+            if offer.agent_id == agent_id and offer.status == OFFERED
+        ]
+
+    async def connect(self, agent_id, websocket):
+        """Register an agent's socket and replay its open offers"""
+        self._sockets.setdefault(agent_id, set()).add(websocket)
+        for offer in self.open_offers(agent_id):
+            await self._send(agent_id, websocket, offer.message())
+
+    def disconnect(self, agent_id, websocket):
+        sockets = self._sockets.get(agent_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._sockets[agent_id]
+
+    async def offer(self, order_id, agent_id, restaurant_id, order, attempts=1, passed=()):
+        """Offer an order (already claimed for the agent) and push it right away"""
+        offer = Offer(
+            order_id,
+            agent_id,
+            restaurant_id,
+            order,
+            datetime.utcnow() + timedelta(seconds=self.accept_seconds),
+            attempts,
+            passed
+        )
+        self._offers[order_id] = offer
+        await self._push(agent_id, offer.message())
+        return offer
+
+    async def accept(self, order_id, agent_id):
+        """Accept an open offer; return False if it is not this agent's or has expired"""
+        offer = self._offers.get(order_id)
+        if offer is not None:
+            if offer.agent_id != agent_id or offer.status != OFFERED or offer.expires_at <= datetime.utcnow():
+                return False
+            offer.status = ACCEPTED
+            offer.dirty = True
+            return True
+        return await self._answer_elsewhere(order_id, agent_id, ACCEPTED)
+
+    async def decline(self, order_id, agent_id):
+        """Decline an open offer; it moves on to the next-best agent"""
+        offer = self._offers.get(order_id)
+        if offer is None:
+            return await self._answer_elsewhere(order_id, agent_id, DECLINED)
+        if offer.agent_id != agent_id or offer.status != OFFERED or order_id in self._resolving:
+            return False
+        await self._fall_back(offer)
+        return True
+
+    async def _answer_elsewhere(self, order_id, agent_id, status):
+        """Answer an offer owned by another worker through its table row"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(DispatchOffer)
+                .where(
+                    DispatchOffer.order_id == order_id,
+                    DispatchOffer.agent_id == agent_id,
+                    DispatchOffer.status == OFFERED,
+                    DispatchOffer.expires_at > datetime.utcnow()
+                )
+                .values(status=status, updated_at=datetime.utcnow())
+                .returning(DispatchOffer.order_id)
+            )
+            answered = result.first() is not None
+            await db.commit()
+        return answered
+
+    async def sweep(self):
+        """Move every expired offer on to the next-best agent"""
+        now = datetime.utcnow()
+        for offer in list(self._offers.values()):
+            if offer.status == OFFERED and offer.expires_at <= now and offer.order_id not in self._resolving:
+                await self._fall_back(offer)
+
+    async def _fall_back(self, offer):
+        self._resolving.add(offer.order_id)
+        try:
+            replacement = await self._reassign(offer)
+        finally:
+            self._resolving.discard(offer.order_id)
+
+        if replacement is None:
+            return
+        self.outbox.notify()
+        await self._push(offer.agent_id, {"type": "offer_withdrawn", "order_id": offer.order_id})
+        self._offers[offer.order_id] = replacement
+        await self._push(replacement.agent_id, replacement.message())
+
+    async def _reassign(self, offer):
+        """Hand the order to the next-best agent in one transaction; return the new Offer or None"""
+        async with AsyncSessionLocal() as db:
+            row = await db.get(DispatchOffer, offer.order_id, with_for_update=True)
+            if row is not None and row.agent_id == offer.agent_id and row.status == ACCEPTED:
+                # Accepted through another worker just in time
+                offer.status = ACCEPTED
+                offer.dirty = False
+                return None
+
+            order = await db.get(Order, offer.order_id, with_for_update=True)
+            if order is None or order.delivery_agent_id != offer.agent_id or order.status != "accepted":
+                # Reassigned elsewhere, or the agent is already working on it
+                offer.status = CLOSED
+                offer.dirty = True
+                return None
+
+            passed = offer.passed | {offer.agent_id}
+            new_agent_id = None
+            if offer.attempts < self.max_attempts:
+                new_agent_id = await self._claim_next(db, offer.restaurant_id, passed)
+            if new_agent_id is None:
+                log.warning("Nobody else can take the order; it stays with its agent", order_id=offer.order_id, agent_id=offer.agent_id)
+                offer.status = UNANSWERED
+                offer.dirty = True
+                return None
+
+            # Free the slot on the agent that let the order go
+            await adjust_loads(db, {offer.agent_id: -1})
+
+            order.delivery_agent_id = new_agent_id
+            order.version += 1
+            order.updated_at = datetime.utcnow()
+
+            # Restaurant service moves the load from the old agent to the new one when it applies this
+            event = status_event(order)
+            enqueue(db, "user", "/orders/status", {"events": [event]})
+            enqueue(db, "restaurant", "/orders/status", {"events": [event]})
+            snapshot = await build_snapshot(db, order)
+
+            replacement = Offer(
+                order.id,
+                new_agent_id,
+                offer.restaurant_id,
+                snapshot.model_dump(mode="json"),
+                datetime.utcnow() + timedelta(seconds=self.accept_seconds),
+                offer.attempts + 1,
+                passed
+            )
+            await self._upsert(db, [replacement], only_open=False)
+            replacement.dirty = False
+            await db.commit()
+
+        log.info("Order reassigned", order_id=offer.order_id, from_agent_id=offer.agent_id, to_agent_id=new_agent_id)
+        return replacement
+
+    async def _claim_next(self, db, restaurant_id, passed):
+        """Claim the best agent with spare capacity who has not passed on the order"""
+        restaurant = (await db.execute(
+            select(Restaurant.latitude, Restaurant.longitude).where(Restaurant.id == restaurant_id)
+        )).first()
+        candidates = (await db.execute(
+            select(DeliveryAgent.id, DeliveryAgent.rating, DeliveryAgent.latitude, DeliveryAgent.longitude)
+            .where(
+                DeliveryAgent.is_available == True,
+                DeliveryAgent.current_load < DeliveryAgent.capacity,
+                DeliveryAgent.id.notin_(list(passed))
+            )
+            .order_by(DeliveryAgent.rating.desc().nullslast(), DeliveryAgent.id)
+            .limit(self.candidate_limit)
+        )).all()
+
+        def rank(agent):
+            if restaurant is None or None in (restaurant.latitude, restaurant.longitude, agent.latitude, agent.longitude):
+                return (1, 0.0, -float(agent.rating or 0))
+            distance = haversine_km(restaurant.latitude, restaurant.longitude, agent.latitude, agent.longitude)
+            return (0, distance, -float(agent.rating or 0))
+
+        for agent in sorted(candidates, key=rank):
+            has_room = select(DeliveryAgent.id).where(
+                DeliveryAgent.id == agent.id,
+                DeliveryAgent.is_available == True,
+                DeliveryAgent.current_load < DeliveryAgent.capacity
+            ).with_for_update(skip_locked=True).scalar_subquery()
+            claimed_id = (await db.execute(
+                update(DeliveryAgent)
+                .where(DeliveryAgent.id == has_room)
+                .values(
+                    current_load=DeliveryAgent.current_load + 1,
+                    is_available=DeliveryAgent.current_load + 1 < DeliveryAgent.capacity
+                )
+                .returning(DeliveryAgent.id)
+                .execution_options(synchronize_session=False)
+            )).scalar_one_or_none()
+            if claimed_id is not None:
+                return claimed_id
+        return None
+
+    async def persist(self):
+        """Write changed offers, pick up answers given elsewhere and push foreign offers"""
+        dirty = [offer for offer in self._offers.values() if offer.dirty]
+        async with AsyncSessionLocal() as db:
+            if dirty:
+                await self._upsert(db, dirty, only_open=True)
+                await db.commit()
+                for offer in dirty:
+                    offer.dirty = False
+
+            # Answers given through another worker
+            open_ids = [offer.order_id for offer in self._offers.values() if offer.status == OFFERED]
+            answered = []
+            if open_ids:
+                answered = (await db.execute(
+                    select(DispatchOffer.order_id, DispatchOffer.agent_id, DispatchOffer.status).where(
+                        DispatchOffer.order_id.in_(open_ids),
+                        DispatchOffer.status != OFFERED
+                    )
+                )).all()
+
+            foreign = []
+            if self._sockets:
+                foreign = (await db.execute(
+                    select(DispatchOffer).where(
+                        DispatchOffer.agent_id.in_(list(self._sockets)),
+                        DispatchOffer.status == OFFERED,
+                        DispatchOffer.expires_at > datetime.utcnow()
+                    )
+                )).scalars().all()
+                foreign = [row for row in foreign if row.order_id not in self._offers]
+            orders = {}
+            fresh = [row for row in foreign if (row.order_id, row.agent_id) not in self._pushed]
+            if fresh:
+                rows = (await db.execute(
+                    select(Order).where(Order.id.in_([row.order_id for row in fresh]))
+                )).scalars().all()
+                orders = await build_snapshots(db, rows)
+
+        for order_id, agent_id, status in answered:
+            offer = self._offers.get(order_id)
+            if offer is None or offer.agent_id != agent_id or offer.status != OFFERED:
+                continue
+            if status == ACCEPTED:
+                offer.status = ACCEPTED
+            elif status == DECLINED and order_id not in self._resolving:
+                await self._fall_back(offer)
+
+        still_open = {(row.order_id, row.agent_id) for row in foreign}
+        self._pushed &= still_open
+        for row in fresh:
+            snapshot = orders.get(row.order_id)
+            if snapshot is None:
+                continue
+            self._pushed.add((row.order_id, row.agent_id))
+            await self._push(row.agent_id, {
+                "type": "offer",
+                "order_id": row.order_id,
+                "expires_at": row.expires_at.isoformat(),
+                "order": snapshot.model_dump(mode="json")
+            })
+
+        # Settled offers have been written; forget them
+        for order_id, offer in list(self._offers.items()):
+            if offer.status != OFFERED and not offer.dirty:
+                del self._offers[order_id]
+
+    async def _upsert(self, db, offers, only_open):
+        stmt = pg_insert(DispatchOffer).values([
+            {
+                "order_id": offer.order_id,
+                "agent_id": offer.agent_id,
+                "status": offer.status,
+                "attempts": offer.attempts,
+                "expires_at": offer.expires_at,
+                "updated_at": datetime.utcnow()
+            }
+            for offer in offers
+        ])
+        # Never overwrite an answer recorded by another worker
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DispatchOffer.order_id],
+            set_={
+                key: stmt.excluded[key]
+                for key in ("agent_id", "status", "attempts", "expires_at", "updated_at")
+            },
+            where=(DispatchOffer.status == OFFERED) if only_open else None
+        )
+        await db.execute(stmt)
+
+    async def _push(self, agent_id, message):
+        for websocket in list(self._sockets.get(agent_id, ())):
+            await self._send(agent_id, websocket, message)
+
+    async def _send(self, agent_id, websocket, message):
+        try:
+            await asyncio.wait_for(websocket.send_json(message), timeout=1.0)
+        except Exception:
+            # Dead or stuck connection; the agent gets open offers again on reconnect
+            self.disconnect(agent_id, websocket)
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import Order, OrderItem
+from schemas import OrderItemSnapshot, OrderSnapshot
+
+
+async def build_snapshot(db, order):
+    """Build the event snapshot of a local order, including its items"""
+    return (await build_snapshots(db, [order]))[order.id]
+
+
+async def build_snapshots(db, orders):
+    """Build {order_id: snapshot} for several orders with one item query"""
+    snapshots = {}
+    for order in orders:
+        snapshots[order.id] = OrderSnapshot.model_validate(order, from_attributes=True)
+    if not snapshots:
+        return snapshots
+
+    items = (await db.execute(
+        select(OrderItem).where(OrderItem.order_id.in_(list(snapshots))).order_by(OrderItem.id)
+    )).scalars().all()
+    for item in items:
+        snapshots[item.order_id].items.append(OrderItemSnapshot.model_validate(item, from_attributes=True))
+    return snapshots
+
+
+def status_event(order):
+    """Status change payload for user service's order streams and restaurant service's copy"""
+    return {
+        "order_id": order.id,
+        "version": order.version,
+        "status": order.status,
+        "delivery_agent_id": order.delivery_agent_id,
+        "updated_at": order.updated_at.isoformat() if order.updated_at else None
+    }
+
+
+async def upsert_order(db, snapshot, **overrides):
+    """Apply an order snapshot to the local copy of the order.
+
+    The row is inserted, or updated when the snapshot is newer than what we
+    hold, in one INSERT ... ON CONFLICT statement. Returns False when the
+    local copy is already at this version or later (e.g. a redelivery).
+    """
+    values = {
+        "id": snapshot.id,
+        "version": snapshot.version,
+        "user_id": snapshot.user_id,
+        "restaurant_id": snapshot.restaurant_id,
+        "delivery_agent_id": snapshot.delivery_agent_id,
+        "status": snapshot.status,
+        "total_amount": snapshot.total_amount,
+        "delivery_address": snapshot.delivery_address,
+        "special_instructions": snapshot.special_instructions,
+        "created_at": snapshot.created_at,
+        "updated_at": datetime.utcnow()
+    }
+    values.update(overrides)
+
+    stmt = pg_insert(Order).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Order.id],
+        set_={key: stmt.excluded[key] for key in values if key not in ("id", "created_at")},
+        where=Order.version < stmt.excluded.version
+    ).returning(Order.id)
+    applied = (await db.execute(stmt)).first() is not None
+
+    if applied and snapshot.items:
+        await db.execute(delete(OrderItem).where(OrderItem.order_id == snapshot.id))
+        await db.execute(insert(OrderItem), [
+            {
+                "order_id": snapshot.id,
+                "menu_item_id": item.menu_item_id,
+                "quantity": item.quantity,
+                "price": item.price
+            }
+            for item in snapshot.items
+        ])
+
+    return applied
@@ -0,0 +1,119 @@
+"""Recompute agents' delivery counters and daily rollups from the orders table.
+
+Fills total_deliveries, current_load (and is_available, which follows it)
+and agent_daily_stats, which migrations 0001 and 0003 start empty on an
+existing database. Walks agents in primary-key order, a batch at a time
+(keyset pagination). Each batch locks its agents, recounts their orders
+with grouped queries over just those ids, rewrites the counters and the
+rollups and commits; status changes update the same agent rows, so they
+are either counted here or applied after the batch, never lost.
+
+Run it once after migrating, then set AGENT_STATS_FROM_ROLLUPS=true.
+
+Usage: python rebuild_agent_stats.py [--batch-size 500]
+"""
+import argparse
+import os
+import sys
+
+# Modules shared by the three services (metrics, tracing, logging, ...) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+
+from sqlalchemy import Date, and_, bindparam, delete, func, insert, select, update
+
+from agent_load import FINAL_STATUSES
+from database import SessionLocal
+from models import AgentDailyStats, DeliveryAgent, Order
+
+
+def _counters(db, agent_ids):
+    """{agent_id: (delivered, active)} over all of the agents' orders"""
+    return {
+        agent_id: (delivered, active)
+        for agent_id, delivered, active in db.execute(
+            select(
+                Order.delivery_agent_id,
+                func.count().filter(Order.status == "delivered"),
+                func.count().filter(Order.status.notin_(FINAL_STATUSES))
+            )
+            .where(Order.delivery_agent_id.in_(agent_ids))
+            .group_by(Order.delivery_agent_id)
+        )
+    }
+
+
+def _daily(db, agent_ids):
+    """Rollup rows of the agents' finished orders, per agent and day"""
+    day = func.date(Order.updated_at, type_=Date)
+    return [
+        {"agent_id": agent_id, "day": finished_on, "deliveries": delivered, "cancellations": cancelled}
+        for agent_id, finished_on, delivered, cancelled in db.execute(
+            select(
+                Order.delivery_agent_id,
+                day,
+                func.count().filter(Order.status == "delivered"),
+                func.count().filter(Order.status == "cancelled")
+            )
+            .where(Order.delivery_agent_id.in_(agent_ids), Order.status.in_(FINAL_STATUSES))
+            .group_by(Order.delivery_agent_id, day)
+        )
+    ]
+
+
+def rebuild(batch_size):
+    """Recompute every agent's counters and rollups batch by batch; return the agents updated"""
+    agents = DeliveryAgent.__table__
+    last_id = 0
+    updated = 0
+    while True:
+        db = SessionLocal()
+        try:
+            ids = db.execute(
+                select(DeliveryAgent.id)
+                .where(DeliveryAgent.id > last_id)
+                .order_by(DeliveryAgent.id)
+                .limit(batch_size)
+                .with_for_update()
+            ).scalars().all()
+            if not ids:
+                return updated
+
+            counters = _counters(db, ids)
+            rows = []
+            for agent_id in ids:
+                delivered, active = counters.get(agent_id, (0, 0))
+                rows.append({"agent_id": agent_id, "new_total": delivered, "new_load": active})
+            db.execute(
+                update(agents)
+                .where(agents.c.id == bindparam("agent_id"))
+                .values(
+                    total_deliveries=bindparam("new_total"),
+                    current_load=bindparam("new_load"),
+                    is_available=and_(agents.c.on_shift, bindparam("new_load") < agents.c.capacity)
+                ),
+                rows
+            )
+
+            db.execute(delete(AgentDailyStats).where(AgentDailyStats.agent_id.in_(ids)))
+            daily = _daily(db, ids)
+            if daily:
+                db.execute(insert(AgentDailyStats), daily)
+            db.commit()
+        finally:
+            db.close()
+
+        updated += len(ids)
+        last_id = ids[-1]
+        print(f"REBUILD: delivery_agents up to id {last_id} ({updated} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute agent counters and daily rollups in keyset-batched passes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    rebuild(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime
 
@@ -8,6 +8,7 @@ class AgentCreate(BaseModel):
     email: EmailStr
     phone: Optional[str] = None
     vehicle_type: str
+    capacity: int = Field(1, ge=1, le=10)
 
 class AgentResponse(BaseModel):
     id: int
@@ -16,7 +17,14 @@ class AgentResponse(BaseModel):
     phone: Optional[str]
     vehicle_type: str
     is_available: bool
+    on_shift: bool = True
+    capacity: int = 1
+    current_load: int = 0
+    total_deliveries: int = 0
     rating: Optional[Decimal]
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    location_updated_at: Optional[datetime] = None
     created_at: datetime
     
     class Config:
@@ -25,12 +33,61 @@ class AgentResponse(BaseModel):
 class AgentStatusUpdate(BaseModel):
     is_available: bool
 
+class AgentLocationUpdate(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+class LocationPing(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    # Device time of the fix; defaults to when the ping arrives
+    recorded_at: Optional[datetime] = None
+
+class AgentLocationPing(LocationPing):
+    agent_id: int
+
+class LocationPingBatch(BaseModel):
+    pings: List[AgentLocationPing]
+
+# Rating aggregates owned by user service
+class RatingAggregate(BaseModel):
+    id: int
+    rating_count: int
+    rating_sum: int
+    rating: Decimal
+
+class RatingSyncBatch(BaseModel):
+    agents: List[RatingAggregate] = []
+
 class OrderStatusUpdate(BaseModel):
     status: str
 
+class OrderItemSnapshot(BaseModel):
+    menu_item_id: int
+    quantity: int
+    price: Decimal
+
+# Full copy of an order carried by hand-off events; newer versions win
+class OrderSnapshot(BaseModel):
+    id: int
+    version: int
+    user_id: int
+    restaurant_id: int
+    delivery_agent_id: Optional[int] = None
+    status: str
+    total_amount: Decimal
+    delivery_address: Optional[str] = None
+    special_instructions: Optional[str] = None
+    created_at: datetime
+    items: List[OrderItemSnapshot] = []
+
 class OrderAssignment(BaseModel):
     order_id: int
     agent_id: int
+    order: OrderSnapshot
+
+class BulkOrderAssignment(BaseModel):
+    assignments: List[OrderAssignment]
 
 class OrderResponse(BaseModel):
     id: int
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The service's modules are imported flat, as uvicorn runs them from the service directory;
+# main.py adds the modules shared by all services the same way
+_service = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _service)
+sys.path.append(os.path.join(_service, os.pardir, "shared"))
@@ -0,0 +1,90 @@
+import asyncio
+from decimal import Decimal
+from types import SimpleNamespace
+
+import agent_stats
+from agent_stats import AgentStatsCache, aggregate_stats, rollup_stats
+
+
+class _Result:
+    def __init__(self, row):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+
+class _Session:
+    """Answers every query with one row and keeps the statements"""
+
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        return _Result(self.row)
+
+
+def _agent(**fields):
+    agent = dict(id=7, total_deliveries=40, current_load=1, capacity=2, is_available=True, rating=Decimal("4.50"))
+    agent.update(fields)
+    return SimpleNamespace(**agent)
+
+
+def test_rollup_stats_use_the_agent_counters():
+    db = _Session((2, 1, 9, 3))
+    stats = asyncio.run(rollup_stats(db, _agent()))
+
+    assert len(db.statements) == 1
+    assert stats == {
+        "agent_id": 7,
+        "total_deliveries": 40,
+        "active_orders": 1,
+        "today": {"deliveries": 2, "cancellations": 1},
+        "last_7_days": {"deliveries": 9, "cancellations": 3},
+        "rating": 4.5,
+        "is_available": True,
+        "capacity": 2,
+        "current_load": 1
+    }
+
+
+def test_rollup_stats_without_rollups_count_zero():
+    stats = asyncio.run(rollup_stats(_Session((None, None, None, None)), _agent(rating=None)))
+    assert stats["today"] == {"deliveries": 0, "cancellations": 0}
+    assert stats["last_7_days"] == {"deliveries": 0, "cancellations": 0}
+    assert stats["rating"] == 0.0
+
+
+def test_aggregate_stats_count_the_orders():
+    db = _Session((38, 2, 1, 0, 6, 1))
+    stats = asyncio.run(aggregate_stats(db, _agent()))
+
+    assert (stats["total_deliveries"], stats["active_orders"]) == (38, 2)
+    assert stats["today"] == {"deliveries": 1, "cancellations": 0}
+    assert stats["last_7_days"] == {"deliveries": 6, "cancellations": 1}
+    # Load and capacity are still the agent's own
+    assert (stats["current_load"], stats["capacity"]) == (1, 2)
+
+
+def test_cache_expires_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(agent_stats.time, "monotonic", lambda: now[0])
+    cache = AgentStatsCache(ttl_seconds=5.0)
+    cache.put(7, {"agent_id": 7})
+
+    now[0] += 4.9
+    assert cache.get(7) == {"agent_id": 7}
+    now[0] += 0.2
+    assert cache.get(7) is None
+
+
+def test_cache_invalidate_drops_only_named_agents():
+    cache = AgentStatsCache()
+    cache.put(7, {"agent_id": 7})
+    cache.put(8, {"agent_id": 8})
+
+    cache.invalidate(7, 9)
+    assert cache.get(7) is None
+    assert cache.get(8) == {"agent_id": 8}
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from sqlalchemy.sql import Select
+
+import location_buffer
+from location_buffer import LocationBuffer
+
+
+class _Outbox:
+    def __init__(self):
+        self.notified = 0
+
+    def notify(self):
+        self.notified += 1
+
+
+class _Result:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def scalars(self):
+        return iter(self.ids)
+
+
+class _Session:
+    """Stands in for AsyncSessionLocal(): knows some agent ids and records what is written"""
+
+    def __init__(self, agent_ids):
+        self.agent_ids = agent_ids
+        self.lookups = 0
+        self.writes = []
+        self.events = []
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, params=None):
+        if isinstance(statement, Select):
+            self.lookups += 1
+            return _Result(self.agent_ids)
+        self.writes.append(params)
+
+    def add(self, event):
+        self.events.append(event)
+
+    async def commit(self):
+        pass
+
+
+def _buffer(monkeypatch, agent_ids=(1, 2), **options):
+    session = _Session(list(agent_ids))
+    monkeypatch.setattr(location_buffer, "AsyncSessionLocal", session)
+    return LocationBuffer(_Outbox(), **options), session
+
+
+def test_ring_keeps_the_newest_points(monkeypatch):
+    buffer, _ = _buffer(monkeypatch, trail_length=3)
+    now = time.time()
+    for second in range(5):
+        assert buffer.record(1, 10.0 + second, 20.0, now - 10 + second)
+    assert [point[0] for point in buffer.trail(1)] == [12.0, 13.0, 14.0]
+    assert buffer.latest(1)[0] == 14.0
+    # Two points fell off the ring before any flush
+    assert buffer.dropped == 2
+    # Older than the latest point: ignored
+    assert not buffer.record(1, 0.0, 0.0, now - 20)
+    assert buffer.received == 5
+
+
+def test_flush_writes_known_agents_and_drops_unknown_ids(monkeypatch):
+    buffer, session = _buffer(monkeypatch, agent_ids=(1,))
+    now = time.time()
+    buffer.record(1, 12.9, 77.5, now - 2)
+    buffer.record(1, 13.0, 77.6, now - 1)
+    buffer.record(99, 1.0, 1.0, now - 1)
+
+    assert asyncio.run(buffer.flush()) == 2
+    positions, history = session.writes
+    assert [position["agent_id"] for position in positions] == [1]
+    assert positions[0]["new_latitude"] == 13.0
+    assert [point["agent_id"] for point in history] == [1, 1]
+    [event] = session.events
+    assert [position["agent_id"] for position in event.payload["positions"]] == [1]
+    assert buffer.outbox.notified == 1
+
+    assert 99 not in buffer._trails and len(buffer) == 1
+    assert buffer.rejected == 1
+
+
+def test_known_agents_are_looked_up_once(monkeypatch):
+    buffer, session = _buffer(monkeypatch)
+    buffer.record(1, 12.9, 77.5)
+    asyncio.run(buffer.flush())
+    buffer.record(1, 13.0, 77.6)
+    asyncio.run(buffer.flush())
+    assert session.lookups == 1
+    assert asyncio.run(buffer.flush()) == 0
+
+
+def test_idle_trails_are_evicted(monkeypatch):
+    buffer, _ = _buffer(monkeypatch, idle_seconds=60)
+    buffer.record(1, 12.9, 77.5)
+    buffer.record(2, 12.9, 77.5)
+    asyncio.run(buffer.flush())
+    buffer._trails[1].seen -= 120
+    buffer._trails[2].seen -= 120
+    # Unflushed points keep a trail until they are written
+    buffer.record(2, 13.0, 77.6)
+    buffer._trails[2].seen -= 120
+    assert buffer.evict_idle() == 1
+    assert 1 not in buffer._trails and 2 in buffer._trails
+    assert buffer.latest(1) is None
+    assert buffer.evicted == 1
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from offers import ACCEPTED, DECLINED, OFFERED, Offer, OfferManager
+
+
+class _Outbox:
+    def __init__(self):
+        self.notified = 0
+
+    def notify(self):
+        self.notified += 1
+
+
+class _Socket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def send_json(self, message):
+        if self.fail:
+            raise ConnectionError("gone")
+        self.sent.append(message)
+
+
+def _manager(monkeypatch, replacement_agent=None):
+    """An OfferManager whose database steps are replaced by the given outcome"""
+    manager = OfferManager(_Outbox(), accept_seconds=30)
+    manager.reassigned = []
+
+    async def reassign(offer):
+        manager.reassigned.append(offer.order_id)
+        if replacement_agent is None:
+            return None
+        return Offer(offer.order_id, replacement_agent, offer.restaurant_id, offer.order,
+                     datetime.utcnow() + timedelta(seconds=30), offer.attempts + 1, offer.passed | {offer.agent_id})
+
+    async def answer_elsewhere(order_id, agent_id, status):
+        manager.answered = (order_id, agent_id, status)
+        return True
+
+    monkeypatch.setattr(manager, "_reassign", reassign)
+    monkeypatch.setattr(manager, "_answer_elsewhere", answer_elsewhere)
+    return manager
+
+
+def test_offers_are_pushed_and_replayed_on_connect(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch)
+        early = _Socket()
+        await manager.connect(7, early)
+        await manager.offer(1, 7, 3, {"id": 1})
+        assert [message["type"] for message in early.sent] == ["offer"]
+
+        late = _Socket()
+        await manager.connect(7, late)
+        assert [message["order_id"] for message in late.sent] == [1]
+
+    asyncio.run(run())
+
+
+def test_dead_sockets_are_dropped(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch)
+        await manager.connect(7, _Socket(fail=True))
+        await manager.offer(1, 7, 3, {"id": 1})
+        assert 7 not in manager._sockets
+
+    asyncio.run(run())
+
+
+def test_accept_checks_agent_and_deadline(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch)
+        offer = await manager.offer(1, 7, 3, {"id": 1})
+        assert not await manager.accept(1, 8)
+        offer.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        assert not await manager.accept(1, 7)
+        offer.expires_at = datetime.utcnow() + timedelta(seconds=30)
+        assert await manager.accept(1, 7)
+        assert offer.status == ACCEPTED and offer.dirty
+        # Answering twice does not count
+        assert not await manager.accept(1, 7)
+
+    asyncio.run(run())
+
+
+def test_offers_owned_elsewhere_are_answered_through_the_table(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch)
+        assert await manager.accept(5, 7)
+        assert manager.answered == (5, 7, ACCEPTED)
+        assert await manager.decline(6, 7)
+        assert manager.answered == (6, 7, DECLINED)
+
+    asyncio.run(run())
+
+
+def test_decline_moves_the_offer_to_the_next_agent(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch, replacement_agent=9)
+        old, new = _Socket(), _Socket()
+        await manager.connect(7, old)
+        await manager.connect(9, new)
+        await manager.offer(1, 7, 3, {"id": 1})
+
+        assert not await manager.decline(1, 9)
+        assert await manager.decline(1, 7)
+        assert manager._offers[1].agent_id == 9
+        assert manager._offers[1].passed == {7}
+        assert old.sent[-1] == {"type": "offer_withdrawn", "order_id": 1}
+        assert new.sent[-1]["type"] == "offer" and new.sent[-1]["order_id"] == 1
+        assert manager.outbox.notified == 1
+        assert manager._resolving == set()
+
+    asyncio.run(run())
+
+
+def test_sweep_only_moves_expired_offers(monkeypatch):
+    async def run():
+        manager = _manager(monkeypatch)
+        expired = await manager.offer(1, 7, 3, {"id": 1})
+        await manager.offer(2, 7, 3, {"id": 2})
+        expired.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        await manager.sweep()
+        assert manager.reassigned == [1]
+        # Nobody else could take it: the offer stays where it was and nothing is sent
+        assert manager._offers[1].agent_id == 7
+        assert manager.outbox.notified == 0
+        assert [offer.order_id for offer in manager.open_offers(7)] == [1, 2]
+        assert all(offer.status == OFFERED for offer in manager.open_offers(7))
+
+    asyncio.run(run())
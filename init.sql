@@ -19,6 +19,10 @@ CREATE TABLE IF NOT EXISTS restaurants (
     cuisine_type VARCHAR(100),
     is_online BOOLEAN DEFAULT true,
     rating DECIMAL(3,2) DEFAULT 0.0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -42,7 +46,16 @@ CREATE TABLE IF NOT EXISTS delivery_agents (
     phone VARCHAR(20),
     vehicle_type VARCHAR(50),
     is_available BOOLEAN DEFAULT true,
+    on_shift BOOLEAN NOT NULL DEFAULT true,
+    capacity INTEGER NOT NULL DEFAULT 1,
+    current_load INTEGER NOT NULL DEFAULT 0,
+    total_deliveries INTEGER NOT NULL DEFAULT 0,
     rating DECIMAL(3,2) DEFAULT 0.0,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    location_updated_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -53,6 +66,7 @@ CREATE TABLE IF NOT EXISTS orders (
     restaurant_id INTEGER REFERENCES restaurants(id),
     delivery_agent_id INTEGER REFERENCES delivery_agents(id),
     status VARCHAR(50) DEFAULT 'pending',
+    version INTEGER NOT NULL DEFAULT 1,
     total_amount DECIMAL(10,2) NOT NULL,
     delivery_address TEXT,
     special_instructions TEXT,
@@ -76,7 +90,8 @@ CREATE TABLE IF NOT EXISTS order_ratings (
     user_id INTEGER REFERENCES users(id),
     rating INTEGER CHECK (rating >= 1 AND rating <= 5),
     comment TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_order_ratings_order_user UNIQUE (order_id, user_id)
 );
 
 -- Agent ratings table
@@ -87,9 +102,70 @@ CREATE TABLE IF NOT EXISTS agent_ratings (
     order_id INTEGER REFERENCES orders(id),
     rating INTEGER CHECK (rating >= 1 AND rating <= 5),
     comment TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_agent_ratings_agent_user_order UNIQUE (delivery_agent_id, user_id, order_id)
+);
+
+-- Outbox of inter-service hand-offs, written in the same transaction as the order change
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id SERIAL PRIMARY KEY,
+    source VARCHAR(50) NOT NULL,
+    target VARCHAR(50) NOT NULL,
+    path VARCHAR(255) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP,
+    traceparent VARCHAR(55)
 );
 
+-- Lets each dispatcher find its due events without scanning delivered ones
+CREATE INDEX IF NOT EXISTS idx_outbox_events_pending
+    ON outbox_events (source, next_attempt_at)
+    WHERE delivered_at IS NULL;
+
+-- Location trail of delivery agents, written in bulk from memory
+CREATE TABLE IF NOT EXISTS agent_locations (
+    id BIGSERIAL PRIMARY KEY,
+    agent_id INTEGER NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    recorded_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_locations_agent_time
+    ON agent_locations (agent_id, recorded_at);
+
+-- Assignment offers waiting for an agent's answer, persisted from memory
+CREATE TABLE IF NOT EXISTS dispatch_offers (
+    order_id INTEGER PRIMARY KEY,
+    agent_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_dispatch_offers_open
+    ON dispatch_offers (agent_id)
+    WHERE status = 'offered';
+
+-- Per-agent daily delivery counts behind the windowed agent stats
+CREATE TABLE IF NOT EXISTS agent_daily_stats (
+    agent_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    cancellations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (agent_id, day)
+);
+
+-- Hot-path filters (existing databases get these from migrations/, built concurrently)
+CREATE INDEX IF NOT EXISTS idx_orders_agent_status ON orders (delivery_agent_id, status);
+CREATE INDEX IF NOT EXISTS idx_orders_restaurant_status ON orders (restaurant_id, status);
+CREATE INDEX IF NOT EXISTS idx_menu_items_restaurant_available ON menu_items (restaurant_id, is_available);
+
 -- Insert sample data
 INSERT INTO users (name, email, phone, address) VALUES
 ('John Doe', 'john@example.com', '+1234567890', '123 Main St, City'),
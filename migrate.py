@@ -0,0 +1,175 @@
+"""Apply the versioned SQL migrations in migrations/ to one service's schema.
+
+Migrations are files named NNNN_description.sql, applied in order and
+recorded in the schema's schema_migrations table. A leading
+`-- services: a, b` line limits a file to those services. A file that
+builds indexes CONCURRENTLY runs statement by statement outside a
+transaction, so the tables stay writable; everything else runs in one
+transaction. Statements are split on `;` at the end of a line, so keep
+one statement per `;` and avoid function bodies.
+
+Instances starting together serialize on an advisory lock, and DDL gives
+up after --lock-timeout instead of queueing traffic behind it; the
+migration is then retried.
+
+Usage: python migrate.py --service user-service [--schema user_service] [--dry-run]
+"""
+import argparse
+import os
+import re
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+from config import DATABASE_URL
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Schema each service uses when DB_SCHEMA is not set (see each service's config.py)
+SERVICE_SCHEMAS = {
+    "user-service": "user_service",
+    "restaurant-service": "restaurant_service",
+    "delivery-agent-service": "delivery_service"
+}
+
+LOCK_NOT_AVAILABLE = "55P03"
+
+_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+_SERVICES = re.compile(r"^--\s*services:(.*)$", re.MULTILINE)
+_CONCURRENTLY = re.compile(r"\bCONCURRENTLY\b", re.IGNORECASE)
+_INDEX_NAME = re.compile(r"INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path) as f:
+            self.sql = f.read()
+        header = _SERVICES.search(self.sql)
+        self.services = {s.strip() for s in header.group(1).split(",")} if header else None
+        self.concurrent = bool(_CONCURRENTLY.search(self.sql))
+
+    def applies_to(self, service):
+        return self.services is None or service in self.services
+
+    def statements(self):
+        body = "\n".join(line for line in self.sql.splitlines() if not line.lstrip().startswith("--"))
+        return [statement.strip() for statement in re.split(r";\s*$", body, flags=re.MULTILINE) if statement.strip()]
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise SystemExit("MIGRATE: Duplicate migration numbers in migrations/")
+    return migrations
+
+
+def _apply(conn, migration):
+    if migration.concurrent:
+        # CREATE INDEX CONCURRENTLY cannot run in a transaction; files like this must be idempotent
+        for statement in migration.statements():
+            try:
+                conn.exec_driver_sql(statement)
+            except DBAPIError:
+                # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would skip
+                name = _INDEX_NAME.search(statement)
+                if name:
+                    conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name.group(1)}")
+                raise
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+            {"version": migration.version, "name": migration.name}
+        )
+        return
+
+    conn.exec_driver_sql("BEGIN")
+    try:
+        for statement in migration.statements():
+            conn.exec_driver_sql(statement)
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+            {"version": migration.version, "name": migration.name}
+        )
+        conn.exec_driver_sql("COMMIT")
+    except Exception:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+
+
+def migrate(service, schema, lock_timeout="5s", retries=5, dry_run=False):
+    """Apply pending migrations for `service` to `schema`; return the versions applied"""
+    url = DATABASE_URL
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    migrations = [migration for migration in load_migrations() if migration.applies_to(service)]
+    lock_key = f"migrations:{schema}"
+    applied_now = []
+
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        conn.exec_driver_sql(f'SET search_path TO "{schema}"')
+        conn.execute(text("SELECT pg_advisory_lock(hashtext(:key))"), {"key": lock_key})
+        try:
+            conn.exec_driver_sql(f"SET lock_timeout = '{lock_timeout}'")
+            conn.exec_driver_sql("SET statement_timeout = 0")
+            conn.exec_driver_sql(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, "
+                "name VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+            )
+            done = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+            for migration in migrations:
+                if migration.version in done:
+                    continue
+                label = f"{migration.version:04d}_{migration.name}"
+                if dry_run:
+                    print(f"MIGRATE: {schema}: would apply {label}")
+                    continue
+                for attempt in range(1, retries + 1):
+                    try:
+                        started = time.monotonic()
+                        _apply(conn, migration)
+                        break
+                    except DBAPIError as e:
+                        busy = getattr(e.orig, "pgcode", None) == LOCK_NOT_AVAILABLE
+                        if not busy or attempt == retries:
+                            raise
+                        print(f"MIGRATE: {schema}: {label} waited too long for a lock, retrying ({attempt}/{retries})")
+                        time.sleep(min(2 ** attempt, 30))
+                print(f"MIGRATE: {schema}: applied {label} in {time.monotonic() - started:.1f}s")
+                applied_now.append(migration.version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": lock_key})
+
+    engine.dispose()
+    return applied_now
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending SQL migrations to a service's schema")
+    parser.add_argument("--service", required=True, choices=sorted(SERVICE_SCHEMAS))
+    parser.add_argument("--schema", help="defaults to DB_SCHEMA, then the service's default schema")
+    parser.add_argument("--lock-timeout", default="5s")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    schema = args.schema or os.environ.get("DB_SCHEMA") or SERVICE_SCHEMAS[args.service]
+    applied = migrate(args.service, schema, args.lock_timeout, args.retries, args.dry_run)
+    if not args.dry_run:
+        print(f"MIGRATE: {schema}: {len(applied)} migration(s) applied, schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+-- Columns added to existing tables since the initial schema.
+-- Adding a column with a constant default only touches the catalog (PostgreSQL 11+),
+-- so these are quick even on large tables. Tables a service does not have are skipped.
+-- Rating aggregates start at zero: run user-service/rebuild_ratings.py once afterwards.
+
+ALTER TABLE IF EXISTS restaurants
+    ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+
+ALTER TABLE IF EXISTS delivery_agents
+    ADD COLUMN IF NOT EXISTS capacity INTEGER NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS current_load INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS total_deliveries INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating_sum INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS location_updated_at TIMESTAMP;
+
+ALTER TABLE IF EXISTS orders
+    ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
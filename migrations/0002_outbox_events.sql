@@ -0,0 +1,18 @@
+-- Outbox of inter-service hand-offs, written in the same transaction as the order change
+
+CREATE TABLE IF NOT EXISTS outbox_events (
+    id SERIAL PRIMARY KEY,
+    source VARCHAR(50) NOT NULL,
+    target VARCHAR(50) NOT NULL,
+    path VARCHAR(255) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_events_pending
+    ON outbox_events (source, next_attempt_at)
+    WHERE delivered_at IS NULL;
@@ -0,0 +1,34 @@
+-- services: delivery-agent-service
+-- Location trail, assignment offers and daily stats kept by the delivery service
+
+CREATE TABLE IF NOT EXISTS agent_locations (
+    id BIGSERIAL PRIMARY KEY,
+    agent_id INTEGER NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    recorded_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_locations_agent_time
+    ON agent_locations (agent_id, recorded_at);
+
+CREATE TABLE IF NOT EXISTS dispatch_offers (
+    order_id INTEGER PRIMARY KEY,
+    agent_id INTEGER NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_dispatch_offers_open
+    ON dispatch_offers (agent_id)
+    WHERE status = 'offered';
+
+CREATE TABLE IF NOT EXISTS agent_daily_stats (
+    agent_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    deliveries INTEGER NOT NULL DEFAULT 0,
+    cancellations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (agent_id, day)
+);
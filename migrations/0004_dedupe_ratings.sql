@@ -0,0 +1,16 @@
+-- services: user-service
+-- Drop duplicate ratings left by racing double-submits (keeping the first) so the
+-- unique indexes in 0008 can be built. Run user-service/rebuild_ratings.py afterwards.
+
+DELETE FROM order_ratings a
+    USING order_ratings b
+    WHERE a.order_id = b.order_id
+      AND a.user_id = b.user_id
+      AND a.id > b.id;
+
+DELETE FROM agent_ratings a
+    USING agent_ratings b
+    WHERE a.delivery_agent_id = b.delivery_agent_id
+      AND a.user_id = b.user_id
+      AND a.order_id = b.order_id
+      AND a.id > b.id;
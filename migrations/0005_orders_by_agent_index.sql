@@ -0,0 +1,5 @@
+-- services: restaurant-service, delivery-agent-service
+-- Assigned orders, agent stats and the dispatcher's pending pickups filter on agent and status
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_agent_status
+    ON orders (delivery_agent_id, status);
@@ -0,0 +1,5 @@
+-- services: restaurant-service
+-- Pending orders per restaurant (listing, long-poll queue loads)
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_restaurant_status
+    ON orders (restaurant_id, status);
@@ -0,0 +1,5 @@
+-- services: user-service, restaurant-service
+-- Menus and order placement read a restaurant's available items
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_menu_items_restaurant_available
+    ON menu_items (restaurant_id, is_available);
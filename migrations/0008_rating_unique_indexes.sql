@@ -0,0 +1,9 @@
+-- services: user-service
+-- One rating per user per order (and per agent); rating inserts use ON CONFLICT DO NOTHING
+-- against these, and they also serve the per-order and per-agent rating lookups.
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_order_ratings_order_user
+    ON order_ratings (order_id, user_id);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_agent_ratings_agent_user_order
+    ON agent_ratings (delivery_agent_id, user_id, order_id);
@@ -0,0 +1,4 @@
+-- Trace context of the request that wrote each hand-off, so its delivery joins the same trace
+
+ALTER TABLE IF EXISTS outbox_events
+    ADD COLUMN IF NOT EXISTS traceparent VARCHAR(55);
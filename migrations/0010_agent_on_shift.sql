@@ -0,0 +1,11 @@
+-- services: restaurant-service, delivery-agent-service
+-- Whether the agent is working, as set through /agents/status. is_available is
+-- derived from it and the load, so freeing a slot no longer puts an agent who
+-- went off shift back on. Agents unavailable with room to spare had switched off.
+
+ALTER TABLE IF EXISTS delivery_agents
+    ADD COLUMN IF NOT EXISTS on_shift BOOLEAN NOT NULL DEFAULT TRUE;
+
+UPDATE delivery_agents
+    SET on_shift = FALSE
+    WHERE is_available = FALSE AND current_load < capacity;
@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from agent_load import adjust_loads, load_changes
+from models import DeliveryAgent, Order
+
+_agents = DeliveryAgent.__table__
+
+
+async def apply_status_events(db, events):
+    """Apply status changes made by delivery agent service to the local orders.
+
+    The orders are locked first so the load each event frees or moves
+    (delivered, cancelled, handed to another agent) is read and written
+    in the caller's transaction, together with the order. Older versions
+    are skipped. Returns how many events were applied.
+    """
+    rows = (await db.execute(
+        select(Order.id, Order.version, Order.delivery_agent_id, Order.status)
+        .where(Order.id.in_({event.order_id for event in events}))
+        .order_by(Order.id)
+        .with_for_update()
+    )).all()
+    current = {row.id: (row.version, row.delivery_agent_id, row.status) for row in rows}
+
+    before, after = {}, {}
+    applied = 0
+    for event in sorted(events, key=lambda event: event.version):
+        if event.order_id not in current or current[event.order_id][0] >= event.version:
+            continue
+        # The agent is recorded only if this service knows it (foreign key)
+        agent_id = (await db.execute(
+            select(DeliveryAgent.id).where(DeliveryAgent.id == event.delivery_agent_id)
+        )).scalar_one_or_none() if event.delivery_agent_id is not None else None
+        await db.execute(
+            update(Order)
+            .where(Order.id == event.order_id)
+            .values(
+                status=event.status,
+                version=event.version,
+                delivery_agent_id=agent_id,
+                updated_at=event.updated_at or datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+        before.setdefault(event.order_id, current[event.order_id][1:])
+        after[event.order_id] = (agent_id, event.status)
+        current[event.order_id] = (event.version, agent_id, event.status)
+        applied += 1
+
+    await adjust_loads(db, load_changes(before, after))
+    return applied
+
+
+async def upsert_agents(db, agents):
+    """Apply agent profiles from delivery agent service to the local copies.
+
+    Load and location are kept here and left alone; an agent on shift
+    stays unavailable while its local load is at capacity.
+    """
+    stmt = pg_insert(DeliveryAgent).values([
+        {
+            "id": agent.id,
+            "name": agent.name,
+            "email": agent.email,
+            "phone": agent.phone,
+            "vehicle_type": agent.vehicle_type,
+            "capacity": agent.capacity,
+            "on_shift": agent.working,
+            "is_available": agent.working
+        }
+        for agent in agents
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[DeliveryAgent.id],
+        set_={
+            "name": stmt.excluded.name,
+            "email": stmt.excluded.email,
+            "phone": stmt.excluded.phone,
+            "vehicle_type": stmt.excluded.vehicle_type,
+            "capacity": stmt.excluded.capacity,
+            "on_shift": stmt.excluded.on_shift,
+            "is_available": and_(stmt.excluded.on_shift, DeliveryAgent.current_load < stmt.excluded.capacity)
+        }
+    ))
+
+
+async def apply_positions(db, positions):
+    """Write agents' latest positions with one executemany UPDATE.
+
+    Guarded by timestamp like delivery agent service's own flush, so a
+    late or redelivered batch never moves an agent backwards.
+    """
+    await db.execute(
+        update(_agents)
+        .where(
+            _agents.c.id == bindparam("agent_id"),
+            or_(
+                _agents.c.location_updated_at.is_(None),
+                _agents.c.location_updated_at < bindparam("new_recorded_at")
+            )
+        )
+        .values(
+            latitude=bindparam("new_latitude"),
+            longitude=bindparam("new_longitude"),
+            location_updated_at=bindparam("new_recorded_at")
+        ),
+        [
+            {
+                "agent_id": position.agent_id,
+                "new_latitude": position.latitude,
+                "new_longitude": position.longitude,
+                "new_recorded_at": position.recorded_at
+            }
+            for position in positions
+        ]
+    )
@@ -0,0 +1,469 @@
+import asyncio
+import time
+from collections import deque, namedtuple
+
+from sqlalchemy import select, update
+
+from database import AsyncSessionLocal
+from geo import haversine_km
+from geo_index import GridIndex
+from log import get_logger
+from matching import INFEASIBLE, solve_assignment
+from models import DeliveryAgent, Order, Restaurant
+
+log = get_logger("dispatch")
+
+# Relative preference per vehicle type; unknown types get no bonus
+VEHICLE_SCORES = {
+    "motorcycle": 1.0,
+    "car": 0.8,
+    "bicycle": 0.6
+}
+
+
+# Score lost per kilometre between agent and restaurant (about one rating star)
+DISTANCE_PENALTY_PER_KM = 0.15
+
+# Batching onto an agent that already carries orders: full bonus for the same
+# restaurant, shrinking to nothing at BATCH_RADIUS_KM between pickups, and a
+# detour penalty beyond it
+BATCH_BONUS = 0.3
+BATCH_RADIUS_KM = 2.0
+DETOUR_PENALTY_PER_KM = 0.1
+
+# Order states in which the agent still has to go to the restaurant
+PICKUP_PENDING_STATUSES = ("accepted", "preparing", "ready_for_pickup")
+
+# distance_km is None when the agent or the restaurant has no known location;
+# batch_km is the distance to the agent's nearest pending pickup, None when
+# it has none (or none with a known location)
+Candidate = namedtuple(
+    "Candidate",
+    ["id", "rating", "vehicle_type", "distance_km", "load", "batch_km"],
+    defaults=(0, None)
+)
+
+# Agent in a batch matching pool; spare is how many more orders it can take
+PoolAgent = namedtuple("PoolAgent", ["id", "rating", "vehicle_type", "position", "load", "spare"])
+
+
+def default_score(agent, order):
+    """Rank an agent for an order: distance first, then rating and vehicle type"""
+    rating = float(agent.rating or 0) / 5.0
+    score = 0.7 * rating + 0.3 * VEHICLE_SCORES.get(agent.vehicle_type, 0.0)
+    if agent.distance_km is not None:
+        score -= DISTANCE_PENALTY_PER_KM * agent.distance_km
+    if agent.batch_km is not None:
+        if agent.batch_km <= BATCH_RADIUS_KM:
+            score += BATCH_BONUS * (1 - agent.batch_km / BATCH_RADIUS_KM)
+        else:
+            score -= DETOUR_PENALTY_PER_KM * agent.batch_km
+    return score
+
+
+def batch_distance(pickups, restaurant_id, location):
+    """Distance from a pickup to the closest of an agent's pending pickups, or None"""
+    best = None
+    for pickup_restaurant_id, latitude, longitude in pickups:
+        if pickup_restaurant_id == restaurant_id:
+            return 0.0
+        if location is None or latitude is None or longitude is None:
+            continue
+        distance = haversine_km(location[0], location[1], latitude, longitude)
+        if best is None or distance < best:
+            best = distance
+    return best
+
+
+class DispatchMetrics:
+    """Counters and a window of recent assignment latencies"""
+
+    def __init__(self, window=1000):
+        self.assigned = 0
+        self.no_agent = 0
+        self.conflicts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._recent = deque(maxlen=window)
+
+    def record(self, seconds, assigned, conflicts):
+        self.conflicts += conflicts
+        if assigned:
+            self.assigned += 1
+        else:
+            self.no_agent += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self._recent.append(seconds)
+
+    def snapshot(self):
+        recent = sorted(self._recent)
+
+        def percentile(p):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p * len(recent)))] * 1000
+
+        attempts = self.assigned + self.no_agent
+        return {
+            "assigned": self.assigned,
+            "no_agent": self.no_agent,
+            "conflicts": self.conflicts,
+            "avg_ms": (self.total_seconds / attempts * 1000) if attempts else 0.0,
+            "max_ms": self.max_seconds * 1000,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99)
+        }
+
+
+class AvailableAgentIndex:
+    """In-memory spatial index of available agents with a known location.
+
+    Agents report their location to delivery-agent-service, which forwards
+    the latest positions (and agent profiles) to this service's own
+    delivery_agents table through its outbox. The index is rebuilt from that
+    table by a background task every few seconds and swapped in atomically. Between rebuilds it is kept current for claims
+    made by this worker. Each point carries (rating, vehicle_type, load,
+    capacity).
+    """
+
+    def __init__(self, refresh_seconds=5.0, cell_degrees=0.02):
+        self.refresh_seconds = refresh_seconds
+        self.cell_degrees = cell_degrees
+        self.grid = GridIndex(cell_degrees)
+        self.refreshed_at = None
+        self._task = None
+
+    def __len__(self):
+        return len(self.grid)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                log.error("Failed to refresh agent index", error=str(e))
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def refresh(self):
+        """Rebuild the grid from available agents with coordinates"""
+        async with AsyncSessionLocal() as db:
+            agents = (await db.execute(
+                select(
+                    DeliveryAgent.id,
+                    DeliveryAgent.latitude,
+                    DeliveryAgent.longitude,
+                    DeliveryAgent.rating,
+                    DeliveryAgent.vehicle_type,
+                    DeliveryAgent.current_load,
+                    DeliveryAgent.capacity
+                ).where(
+                    DeliveryAgent.is_available == True,
+                    DeliveryAgent.latitude.isnot(None),
+                    DeliveryAgent.longitude.isnot(None)
+                )
+            )).all()
+
+        grid = GridIndex(self.cell_degrees)
+        for agent in agents:
+            grid.upsert(
+                agent.id,
+                agent.latitude,
+                agent.longitude,
+                (agent.rating, agent.vehicle_type, agent.current_load, agent.capacity)
+            )
+        self.grid = grid
+        self.refreshed_at = time.time()
+
+    def nearest(self, latitude, longitude, k, max_km=None):
+        """Return up to k candidates closest to a point"""
+        return [
+            Candidate(agent_id, data[0], data[1], distance, data[2])
+            for distance, agent_id, data in self.grid.nearest(latitude, longitude, k, max_km)
+        ]
+
+    def position(self, agent_id):
+        """Return the indexed (latitude, longitude) of an agent, or None"""
+        point = self.grid.get(agent_id)
+        return None if point is None else (point[0], point[1])
+
+    def spare_capacity(self, agent_id):
+        """Return how many more orders an indexed agent can take"""
+        point = self.grid.get(agent_id)
+        return 0 if point is None else point[2][3] - point[2][2]
+
+    def claimed(self, agent_id, still_available):
+        """Record one more order on an agent, dropping it once it is full"""
+        point = self.grid.get(agent_id)
+        if point is None:
+            return
+        if not still_available:
+            self.grid.remove(agent_id)
+            return
+        latitude, longitude, (rating, vehicle_type, load, capacity) = point
+        self.grid.upsert(agent_id, latitude, longitude, (rating, vehicle_type, load + 1, capacity))
+
+    def discard(self, agent_id):
+        """Drop an agent that is no longer available"""
+        self.grid.remove(agent_id)
+
+
+class AgentDispatcher:
+    """Picks and atomically claims the best available delivery agent.
+
+    When the restaurant's location is known, candidates are the nearest
+    agents from the in-memory spatial index; otherwise (or if nobody is in
+    range) they are read from the table. Candidates are ranked by a
+    pluggable score, which also sees how close the order is to pickups the
+    agent already has, so orders from one restaurant or nearby ones batch
+    onto the same agent. The best one is then claimed with a compare-and-swap
+    UPDATE that only matches while the agent still has spare capacity and is
+    not locked by another transaction (FOR UPDATE SKIP LOCKED), so concurrent
+    accepts never overload an agent and never wait on each other; a lost race
+    just moves on to the next candidate.
+    """
+
+    def __init__(self, score=default_score, candidate_limit=20, index=None, max_distance_km=None):
+        self.score = score
+        self.candidate_limit = candidate_limit
+        self.index = index
+        self.max_distance_km = max_distance_km
+        self.metrics = DispatchMetrics()
+
+    async def claim_agent(self, db, order, location=None):
+        """Claim an agent for the order inside the caller's transaction; return its id or None.
+
+        `location` is the (latitude, longitude) of the pickup, if known.
+        """
+        start = time.perf_counter()
+        conflicts = 0
+
+        candidates = []
+        if location is not None and self.index is not None:
+            candidates = self.index.nearest(location[0], location[1], self.candidate_limit, self.max_distance_km)
+        if not candidates:
+            candidates = [
+                Candidate(agent.id, agent.rating, agent.vehicle_type, None, agent.current_load)
+                for agent in (await db.execute(
+                    select(
+                        DeliveryAgent.id,
+                        DeliveryAgent.rating,
+                        DeliveryAgent.vehicle_type,
+                        DeliveryAgent.current_load
+                    )
+                    .where(DeliveryAgent.is_available == True)
+                    .order_by(DeliveryAgent.rating.desc().nullslast(), DeliveryAgent.id)
+                    .limit(self.candidate_limit)
+                )).all()
+            ]
+
+        pickups = await self._pending_pickups(db, [agent.id for agent in candidates if agent.load])
+        if pickups:
+            candidates = [
+                agent._replace(batch_km=batch_distance(pickups.get(agent.id, ()), order.restaurant_id, location))
+                for agent in candidates
+            ]
+        ranked = sorted(candidates, key=lambda agent: self.score(agent, order), reverse=True)
+
+        claimed_id = None
+        for agent in ranked:
+            claimed = await self._claim(db, agent.id)
+            if claimed is None:
+                await self._lost(db, agent.id)
+                conflicts += 1
+                continue
+            claimed_id = claimed.id
+            if self.index is not None:
+                self.index.claimed(claimed_id, claimed.is_available)
+            break
+
+        self.metrics.record(time.perf_counter() - start, claimed_id is not None, conflicts)
+        return claimed_id
+
+    async def claim_agents(self, db, orders, locations):
+        """Claim agents for many orders at once; return {order_id: agent_id}.
+
+        `locations` maps restaurant id to a (latitude, longitude) pickup. The
+        candidate pool is the union of each pickup's nearest agents, topped
+        up from the table when it is smaller than the batch, and orders are
+        matched to agents by one minimum-cost assignment over the negated
+        scores. An agent with spare capacity appears once per free slot, so
+        it can take several orders of the batch. Claims then run best pair
+        first; an order whose agent was taken meanwhile (or that had nobody
+        in range) falls back to claim_agent. Orders missing from the result
+        got no agent.
+        """
+        start = time.perf_counter()
+        conflicts = 0
+
+        pool = await self._candidate_pool(db, orders, locations)
+        pickups = await self._pending_pickups(db, [agent.id for agent in pool if agent.load])
+        slots = [agent for agent in pool for _ in range(min(agent.spare, len(orders)))]
+
+        cost = []
+        for order in orders:
+            location = locations.get(order.restaurant_id)
+            row = []
+            for agent in slots:
+                distance = None
+                if location is not None and agent.position is not None:
+                    distance = haversine_km(location[0], location[1], agent.position[0], agent.position[1])
+                if distance is not None and self.max_distance_km is not None and distance > self.max_distance_km:
+                    row.append(INFEASIBLE)
+                    continue
+                candidate = Candidate(
+                    agent.id,
+                    agent.rating,
+                    agent.vehicle_type,
+                    distance,
+                    agent.load,
+                    batch_distance(pickups.get(agent.id, ()), order.restaurant_id, location)
+                )
+                row.append(-self.score(candidate, order))
+            cost.append(row)
+
+        # Solving is pure CPU; keep the event loop responsive meanwhile
+        pairs = await asyncio.to_thread(solve_assignment, cost) if slots else []
+
+        assignments = {}
+        for row, column in sorted(pairs, key=lambda pair: cost[pair[0]][pair[1]]):
+            agent_id = slots[column].id
+            claimed = await self._claim(db, agent_id)
+            if claimed is None:
+                await self._lost(db, agent_id)
+                conflicts += 1
+                continue
+            if self.index is not None:
+                self.index.claimed(agent_id, claimed.is_available)
+            assignments[orders[row].id] = agent_id
+
+        # Every matched order waited for the whole batch
+        elapsed = time.perf_counter() - start
+        for _ in assignments:
+            self.metrics.record(elapsed, True, 0)
+        self.metrics.conflicts += conflicts
+
+        leftovers = [order for order in orders if order.id not in assignments]
+        for attempted, order in enumerate(leftovers, 1):
+            agent_id = await self.claim_agent(db, order, locations.get(order.restaurant_id))
+            if agent_id is None:
+                # Nobody left anywhere; the rest would only repeat the same query
+                for _ in leftovers[attempted:]:
+                    self.metrics.record(elapsed, False, 0)
+                break
+            assignments[order.id] = agent_id
+
+        return assignments
+
+    async def _candidate_pool(self, db, orders, locations):
+        """Distinct PoolAgents worth matching the batch against"""
+        pool = {}
+        if self.index is not None:
+            for latitude, longitude in set(locations.values()):
+                for agent in self.index.nearest(latitude, longitude, self.candidate_limit, self.max_distance_km):
+                    pool[agent.id] = PoolAgent(
+                        agent.id,
+                        agent.rating,
+                        agent.vehicle_type,
+                        self.index.position(agent.id),
+                        agent.load,
+                        self.index.spare_capacity(agent.id)
+                    )
+
+        if len(pool) < len(orders):
+            query = (
+                select(
+                    DeliveryAgent.id,
+                    DeliveryAgent.rating,
+                    DeliveryAgent.vehicle_type,
+                    DeliveryAgent.latitude,
+                    DeliveryAgent.longitude,
+                    DeliveryAgent.current_load,
+                    DeliveryAgent.capacity
+                )
+                .where(DeliveryAgent.is_available == True)
+                .order_by(DeliveryAgent.rating.desc().nullslast(), DeliveryAgent.id)
+                .limit(len(orders) + self.candidate_limit)
+            )
+            if pool:
+                query = query.where(DeliveryAgent.id.notin_(list(pool)))
+            for agent in (await db.execute(query)).all():
+                position = None
+                if agent.latitude is not None and agent.longitude is not None:
+                    position = (agent.latitude, agent.longitude)
+                pool[agent.id] = PoolAgent(
+                    agent.id,
+                    agent.rating,
+                    agent.vehicle_type,
+                    position,
+                    agent.current_load,
+                    agent.capacity - agent.current_load
+                )
+
+        return list(pool.values())
+
+    async def _pending_pickups(self, db, agent_ids):
+        """Map agent id to the (restaurant_id, latitude, longitude) pickups it still has to make"""
+        if not agent_ids:
+            return {}
+        rows = (await db.execute(
+            select(Order.delivery_agent_id, Order.restaurant_id, Restaurant.latitude, Restaurant.longitude)
+            .outerjoin(Restaurant, Restaurant.id == Order.restaurant_id)
+            .where(
+                Order.delivery_agent_id.in_(agent_ids),
+                Order.status.in_(PICKUP_PENDING_STATUSES)
+            )
+        )).all()
+        pickups = {}
+        for row in rows:
+            pickups.setdefault(row.delivery_agent_id, []).append((row.restaurant_id, row.latitude, row.longitude))
+        return pickups
+
+    async def _claim(self, db, agent_id):
+        """Take one slot of the agent's capacity; return (id, is_available) or None"""
+        has_room = select(DeliveryAgent.id).where(
+            DeliveryAgent.id == agent_id,
+            DeliveryAgent.is_available == True,
+            DeliveryAgent.current_load < DeliveryAgent.capacity
+        ).with_for_update(skip_locked=True).scalar_subquery()
+
+        # SET expressions see the old row, so is_available mirrors the new load
+        return (await db.execute(
+            update(DeliveryAgent)
+            .where(DeliveryAgent.id == has_room)
+            .values(
+                current_load=DeliveryAgent.current_load + 1,
+                is_available=DeliveryAgent.current_load + 1 < DeliveryAgent.capacity
+            )
+            .returning(DeliveryAgent.id, DeliveryAgent.is_available)
+            .execution_options(synchronize_session=False)
+        )).first()
+
+    async def _lost(self, db, agent_id):
+        """After a failed claim, drop the agent from the index only if it is really out.
+
+        The claim also fails when another transaction holds the row (SKIP
+        LOCKED); such an agent may still have room, so it stays indexed and
+        the caller just moves on to the next candidate.
+        """
+        if self.index is None:
+            return
+        agent = (await db.execute(
+            select(DeliveryAgent.is_available, DeliveryAgent.current_load, DeliveryAgent.capacity)
+            .where(DeliveryAgent.id == agent_id)
+        )).first()
+        if agent is None or not agent.is_available or agent.current_load >= agent.capacity:
+            self.index.discard(agent_id)
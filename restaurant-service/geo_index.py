@@ -0,0 +1,112 @@
+import math
+
+from geo import EARTH_RADIUS_KM, haversine_km
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class GridIndex:
+    """Uniform latitude/longitude grid for k-nearest queries over points.
+
+    Points are bucketed into square cells of `cell_degrees`; a query walks
+    rings of cells outward from the query cell and stops as soon as no
+    unvisited cell can hold anything closer than the k-th best match. With
+    cells sized near the typical search radius a query touches a handful of
+    cells, independent of the total number of points. Meant for city-scale
+    data: longitude wrap-around at the antimeridian is not handled.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._points = {}
+        # Row/column bounds of every cell ever occupied; only ever grows
+        self._bounds = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees))
+
+    def upsert(self, key, lat, lon, data=None):
+        """Insert or move a point, with optional payload returned by queries"""
+        self.remove(key)
+        cell = self._cell(lat, lon)
+        self._cells.setdefault(cell, set()).add(key)
+        self._points[key] = (lat, lon, cell, data)
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            bounds = self._bounds
+            bounds[0] = min(bounds[0], cell[0])
+            bounds[1] = max(bounds[1], cell[0])
+            bounds[2] = min(bounds[2], cell[1])
+            bounds[3] = max(bounds[3], cell[1])
+
+    def get(self, key):
+        """Return (lat, lon, data) for a point, or None"""
+        point = self._points.get(key)
+        if point is None:
+            return None
+        return point[0], point[1], point[3]
+
+    def remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        members = self._cells.get(point[2])
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[point[2]]
+
+    def nearest(self, lat, lon, k, max_km=None):
+        """Return up to k (distance_km, key, data) tuples, closest first"""
+        if not self._points or k <= 0:
+            return []
+
+        row, col = self._cell(lat, lon)
+        # Smallest distance covered by one ring of cells at this latitude
+        ring_km = self.cell_degrees * KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+        max_ring = self._max_ring(row, col)
+        if max_km is not None:
+            max_ring = min(max_ring, int(max_km / ring_km) + 1)
+
+        found = []
+        for ring in range(max_ring + 1):
+            for cell in self._ring_cells(row, col, ring):
+                for key in self._cells.get(cell, ()):
+                    point_lat, point_lon, _, data = self._points[key]
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if max_km is None or distance <= max_km:
+                        found.append((distance, key, data))
+
+            # Anything in ring + 1 or beyond is at least ring * ring_km away
+            if len(found) >= k:
+                found.sort(key=lambda match: match[0])
+                if found[k - 1][0] <= ring * ring_km:
+                    break
+
+        found.sort(key=lambda match: match[0])
+        return found[:k]
+
+    def _max_ring(self, row, col):
+        """Ring count that is guaranteed to cover every occupied cell"""
+        min_row, max_row, min_col, max_col = self._bounds
+        return max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            yield (row, col)
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield (row - ring, c)
+            yield (row + ring, c)
+        for r in range(row - ring + 1, row + ring):
+            yield (r, col - ring)
+            yield (r, col + ring)
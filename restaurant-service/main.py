@@ -1,11 +1,65 @@
-from fastapi import FastAPI, Depends, HTTPException
+import os
+import sys
+
+# Modules shared by the three services (metrics, tracing, logging, ...) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
-import httpx
 from datetime import datetime
 
-from database import get_db
-from models import Restaurant, MenuItem, Order, DeliveryAgent
+from config import (
+    USER_SERVICE_URL,
+    USER_SERVICE_DOCKER_URL,
+    DELIVERY_SERVICE_URL,
+    DELIVERY_SERVICE_DOCKER_URL,
+    MENU_CACHE_TTL_SECONDS,
+    DISPATCH_CANDIDATE_LIMIT,
+    DISPATCH_MAX_DISTANCE_KM,
+    BATCH_ACCEPT_MAX_ORDERS,
+    AGENT_INDEX_REFRESH_SECONDS,
+    AGENT_INDEX_CELL_DEGREES,
+    PENDING_WAIT_MAX_SECONDS,
+    PENDING_QUEUE_RESYNC_SECONDS,
+    PENDING_QUEUE_IDLE_SECONDS,
+    DB_POOL_WARM_CONNECTIONS,
+    STARTUP_BUDGET_SECONDS,
+    READINESS_PROBE_SECONDS,
+    READINESS_PROBE_TIMEOUT,
+    READINESS_MAX_POOL_USAGE,
+    METRICS_ENABLED,
+    QUERY_STATS_ENABLED,
+    QUERY_STATS_HEADERS,
+    QUERY_BUDGET,
+    QUERY_REPEAT_THRESHOLD,
+    TRACING_ENABLED,
+    TRACING_DB_SPANS,
+    LOG_HOT_PATH_SAMPLE_RATE,
+    PROFILER_MAX_SECONDS,
+    PROFILER_ROLLING_ENABLED,
+    PROFILER_ROLLING_INTERVAL_MS,
+    PROFILER_ROLLING_WINDOW_SECONDS
+)
+from database import get_db, get_async_db, dispose_engines, engine, async_engine
+from agent_sync import apply_positions, apply_status_events, upsert_agents
+from dispatcher import AgentDispatcher, AvailableAgentIndex
+from health import ServiceHealth
+from http_clients import open_clients, close_clients
+from log import RequestContextMiddleware, bind, get_logger, start_logging, stop_logging
+from menu_cache import MenuCache
+from metrics import CONTENT_TYPE, MetricsMiddleware, instrument_engines, render as render_metrics
+from models import DeliveryAgent, Restaurant, MenuItem, Order
+from order_sync import upsert_order, build_snapshot, build_snapshots, status_event
+from outbox import OutboxDispatcher, enqueue
+from profiler import Profiler, RollingProfiler, render_profile, require_admin
+from pending_queue import PendingOrderQueue
+from query_stats import QueryStatsMiddleware, instrument_engines as instrument_queries
+from rating_sync import apply_ratings
 from schemas import (
     RestaurantCreate, 
     RestaurantResponse, 
@@ -15,29 +69,179 @@ from schemas import (
     MenuUpdate, 
     StatusUpdate, 
     OrderNotification,
+    OrderStatusBatch,
+    AgentProfileBatch,
+    AgentPositionBatch,
+    RatingSyncBatch,
     OrderAction,
-    OrderResponse
+    OrderResponse,
+    PendingOrders,
+    BatchAccept,
+    BatchAcceptResponse
+)
+from tracing import TracingMiddleware, instrument_engines as instrument_tracing, tracer
+
+log = get_logger("api")
+
+outbox_dispatcher = OutboxDispatcher({
+    "user": (USER_SERVICE_URL, USER_SERVICE_DOCKER_URL),
+    "delivery": (DELIVERY_SERVICE_URL, DELIVERY_SERVICE_DOCKER_URL)
+})
+agent_index = AvailableAgentIndex(
+    refresh_seconds=AGENT_INDEX_REFRESH_SECONDS,
+    cell_degrees=AGENT_INDEX_CELL_DEGREES
 )
+pending_queue = PendingOrderQueue(
+    resync_seconds=PENDING_QUEUE_RESYNC_SECONDS,
+    idle_seconds=PENDING_QUEUE_IDLE_SECONDS
+)
+
+profiler = Profiler(max_seconds=PROFILER_MAX_SECONDS)
+rolling_profiler = RollingProfiler(
+    interval=PROFILER_ROLLING_INTERVAL_MS / 1000,
+    window_seconds=PROFILER_ROLLING_WINDOW_SECONDS
+) if PROFILER_ROLLING_ENABLED else None
+
+service_health = ServiceHealth(
+    startup_budget=STARTUP_BUDGET_SECONDS,
+    warm_connections=DB_POOL_WARM_CONNECTIONS,
+    probe_seconds=READINESS_PROBE_SECONDS,
+    probe_timeout=READINESS_PROBE_TIMEOUT,
+    max_pool_usage=READINESS_MAX_POOL_USAGE
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    service_health.start()
+    tracer.start()
+    if rolling_profiler is not None:
+        rolling_profiler.start()
+    open_clients(["user", "delivery"])
+    outbox_dispatcher.start()
+    agent_index.start()
+    pending_queue.start()
+    yield
+    await pending_queue.stop()
+    await agent_index.stop()
+    await outbox_dispatcher.stop()
+    await close_clients()
+    await service_health.stop()
+    await dispose_engines()
+    if rolling_profiler is not None:
+        rolling_profiler.stop()
+    tracer.stop()
+    stop_logging()
 
-app = FastAPI(title="Restaurant Service", description="Food Delivery Restaurant Service API", version="1.0.0")
+app = FastAPI(title="Restaurant Service", description="Food Delivery Restaurant Service API", version="1.0.0", lifespan=lifespan)
+
+if QUERY_STATS_ENABLED:
+    app.add_middleware(
+        QueryStatsMiddleware,
+        budget=QUERY_BUDGET,
+        repeat_threshold=QUERY_REPEAT_THRESHOLD,
+        headers=QUERY_STATS_HEADERS
+    )
+    instrument_queries([engine, async_engine])
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engines({"sync": engine, "async": async_engine})
+if TRACING_ENABLED:
+    # Added last so it is outermost and every other layer runs inside the request's span
+    app.add_middleware(TracingMiddleware)
+    if TRACING_DB_SPANS:
+        instrument_tracing([engine, async_engine])
+# Outermost, so every layer below logs with the request's id
+app.add_middleware(RequestContextMiddleware)
+
+menu_cache = MenuCache(ttl_seconds=MENU_CACHE_TTL_SECONDS)
+agent_dispatcher = AgentDispatcher(
+    candidate_limit=DISPATCH_CANDIDATE_LIMIT,
+    index=agent_index,
+    max_distance_km=DISPATCH_MAX_DISTANCE_KM
+)
 
 @app.get("/", tags=["Health"])
 def health_check():
     return {"status": "Restaurant Service is running"}
 
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """Liveness: the process is up and its event loop answers"""
+    return service_health.live()
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """Readiness: warmed up, database reachable (cached probe) and pools not saturated"""
+    ready, details = await service_health.ready()
+    return JSONResponse(status_code=200 if ready else 503, content=details)
+
+@app.get("/metrics", tags=["Health"])
+def get_metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/traces", tags=["Health"])
+def get_traces(limit: int = 20):
+    """Most recent traces this worker took part in"""
+    return {"traces": tracer.recent(limit), "dropped_spans": tracer.dropped}
+
+@app.get("/traces/{trace_id}", tags=["Health"])
+def get_trace(trace_id: str):
+    """Spans this worker recorded for one trace, in start order"""
+    spans = tracer.trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "spans": sorted(spans, key=lambda span: span["start"])}
+
+@app.get("/debug/profile", tags=["Debug"], dependencies=[Depends(require_admin)])
+async def get_profile(seconds: float = 10.0, interval_ms: float = 10.0, format: str = "collapsed", idle: bool = False):
+    """Sample this worker's threads and event loop for a few seconds (admin only)"""
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    counts, samples, interval = await profiler.profile(seconds, interval_ms / 1000, idle)
+    response = render_profile(counts, interval, format, f"restaurant-service {seconds:g}s")
+    response.headers["X-Profile-Samples"] = str(samples)
+    return response
+
+@app.get("/debug/profile/rolling", tags=["Debug"], dependencies=[Depends(require_admin)])
+def get_rolling_profile(format: str = "collapsed"):
+    """Always-on low-rate profile of the last few minutes (admin only)"""
+    if rolling_profiler is None:
+        raise HTTPException(status_code=404, detail="Rolling profile is off (PROFILER_ROLLING_ENABLED)")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    counts, covered = rolling_profiler.snapshot()
+    return render_profile(counts, rolling_profiler.interval, format, f"restaurant-service last {covered}s")
+
+def notify_catalog_change(db, restaurant_id: int):
+    """Have user service drop its cached catalog entry, in the caller's transaction"""
+    enqueue(db, "user", "/catalog/invalidate", {"restaurant_id": restaurant_id})
+
+async def wake_outbox():
+    """Send what a sync endpoint committed now rather than at the outbox's next poll"""
+    outbox_dispatcher.notify()
+
 @app.post("/restaurants", response_model=RestaurantResponse, tags=["Restaurants"])
-def create_restaurant(restaurant_data: RestaurantCreate, db: Session = Depends(get_db)):
+def create_restaurant(restaurant_data: RestaurantCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Create a new restaurant"""
     new_restaurant = Restaurant(
         name=restaurant_data.name,
         address=restaurant_data.address,
         phone=restaurant_data.phone,
-        cuisine_type=restaurant_data.cuisine_type
+        cuisine_type=restaurant_data.cuisine_type,
+        latitude=restaurant_data.latitude,
+        longitude=restaurant_data.longitude
     )
     
     db.add(new_restaurant)
+    db.flush()
+    notify_catalog_change(db, new_restaurant.id)
     db.commit()
     db.refresh(new_restaurant)
+    background_tasks.add_task(wake_outbox)
     
     return new_restaurant
 
@@ -51,20 +255,22 @@ def get_restaurant(restaurant_id: int, db: Session = Depends(get_db)):
     return restaurant
 
 @app.put("/restaurants/{restaurant_id}/status", response_model=RestaurantResponse, tags=["Restaurants"])
-def update_restaurant_status(restaurant_id: int, status_data: StatusUpdate, db: Session = Depends(get_db)):
+def update_restaurant_status(restaurant_id: int, status_data: StatusUpdate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Update restaurant online/offline status"""
     restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
     if not restaurant:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
     restaurant.is_online = status_data.is_online
+    notify_catalog_change(db, restaurant_id)
     db.commit()
     db.refresh(restaurant)
+    background_tasks.add_task(wake_outbox)
     
     return restaurant
 
 @app.post("/restaurants/{restaurant_id}/menu", response_model=List[MenuItemResponse], tags=["Menu"])
-def add_menu_items(restaurant_id: int, menu_data: MenuUpdate, db: Session = Depends(get_db)):
+def add_menu_items(restaurant_id: int, menu_data: MenuUpdate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Add menu items to a restaurant"""
     
     # Verify restaurant exists
@@ -85,14 +291,17 @@ def add_menu_items(restaurant_id: int, menu_data: MenuUpdate, db: Session = Depe
         db.add(new_item)
         created_items.append(new_item)
     
+    notify_catalog_change(db, restaurant_id)
     db.commit()
     for item in created_items:
         db.refresh(item)
+    menu_cache.invalidate(restaurant_id)
+    background_tasks.add_task(wake_outbox)
     
     return created_items
 
 @app.put("/restaurants/{restaurant_id}/menu/{item_id}", response_model=MenuItemResponse, tags=["Menu"])
-def update_menu_item(restaurant_id: int, item_id: int, item_data: MenuItemUpdate, db: Session = Depends(get_db)):
+def update_menu_item(restaurant_id: int, item_id: int, item_data: MenuItemUpdate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     """Update a menu item"""
     
     menu_item = db.query(MenuItem).filter(
@@ -115,8 +324,11 @@ def update_menu_item(restaurant_id: int, item_id: int, item_data: MenuItemUpdate
     if item_data.is_available is not None:
         menu_item.is_available = item_data.is_available
     
+    notify_catalog_change(db, restaurant_id)
     db.commit()
     db.refresh(menu_item)
+    menu_cache.invalidate(restaurant_id)
+    background_tasks.add_task(wake_outbox)
     
     return menu_item
 
@@ -124,137 +336,185 @@ def update_menu_item(restaurant_id: int, item_id: int, item_data: MenuItemUpdate
 def get_restaurant_menu(restaurant_id: int, db: Session = Depends(get_db)):
     """Get all menu items for a restaurant"""
     
-    # Verify restaurant exists
-    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
-    if not restaurant:
+    body = menu_cache.get(db, restaurant_id)
+    if body is None:
         raise HTTPException(status_code=404, detail="Restaurant not found")
     
-    menu_items = db.query(MenuItem).filter(MenuItem.restaurant_id == restaurant_id).all()
-    return menu_items
+    return Response(content=body, media_type="application/json")
+
+@app.post("/agents/sync", tags=["Agents"])
+async def receive_agent_profiles(batch: AgentProfileBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive registered or changed agents from delivery agent service"""
+    if batch.agents:
+        await upsert_agents(db, batch.agents)
+        await db.commit()
+    return {"message": f"{len(batch.agents)} agents synchronized"}
+
+@app.post("/agents/locations", tags=["Agents"])
+async def receive_agent_locations(batch: AgentPositionBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive agents' latest positions from delivery agent service for the dispatch index"""
+    if batch.positions:
+        await apply_positions(db, batch.positions)
+        await db.commit()
+    return {"message": f"{len(batch.positions)} positions received"}
+
+@app.post("/ratings/sync", tags=["Ratings"])
+async def receive_ratings(batch: RatingSyncBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive restaurants' and agents' rating aggregates from user service"""
+    await apply_ratings(db, Restaurant, batch.restaurants)
+    await apply_ratings(db, DeliveryAgent, batch.agents)
+    await db.commit()
+    return {"message": f"{len(batch.restaurants) + len(batch.agents)} ratings synchronized"}
 
 @app.post("/orders/notify", tags=["Orders"])
-async def receive_order_notification(notification: OrderNotification, db: Session = Depends(get_db)):
+async def receive_order_notification(notification: OrderNotification, db: AsyncSession = Depends(get_async_db)):
     """Receive notification about new order"""
+    bind(order_id=notification.order_id)
+    
+    # The event carries the full order, so no call back to user service
+    applied = await upsert_order(db, notification.order)
+    await db.commit()
+    
+    # Wake tablets long-polling this restaurant's queue
+    if applied and notification.order.status == "pending":
+        pending_queue.add(notification.order)
     
-    # Check if order already exists
-    existing_order = db.query(Order).filter(Order.id == notification.order_id).first()
-    if existing_order:
+    if not applied:
         return {"message": f"Order {notification.order_id} already exists"}
+    return {"message": f"Order {notification.order_id} synchronized successfully"}
+
+@app.post("/orders/status", tags=["Orders"])
+async def receive_order_status(batch: OrderStatusBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive order status changes and reassignments from delivery agent service"""
+    
+    # Agents' loads move with the orders, in the same transaction
+    applied = await apply_status_events(db, batch.events)
+    await db.commit()
     
-    # Fetch order details from user service
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"http://user-service:8000/orders/{notification.order_id}")
-            if response.status_code == 200:
-                order_data = response.json()
-                  # Create order in restaurant service database
-                new_order = Order(
-                    id=order_data["id"],
-                    user_id=order_data["user_id"],
-                    restaurant_id=order_data["restaurant_id"],
-                    status=order_data["status"],
-                    total_amount=order_data["total_amount"],
-                    delivery_address=order_data["delivery_address"],
-                    special_instructions=order_data.get("special_instructions"),
-                    created_at=datetime.fromisoformat(order_data["created_at"]),
-                    updated_at=datetime.utcnow()
-                )
-                
-                db.add(new_order)
-                db.commit()
-                db.refresh(new_order)
-                
-                return {"message": f"Order {notification.order_id} synchronized successfully"}
-            else:
-                raise HTTPException(status_code=400, detail="Failed to fetch order details")
-    except Exception as e:
-        print(f"Failed to sync order: {e}")
-        raise HTTPException(status_code=400, detail="Failed to synchronize order")
-    
-    return {"message": f"Order {notification.order_id} notification received"}
+    return {"message": f"{applied} of {len(batch.events)} status changes applied"}
+
+@app.put("/orders/accept", response_model=BatchAcceptResponse, tags=["Orders"])
+async def accept_orders(batch: BatchAccept, db: AsyncSession = Depends(get_async_db)):
+    """Accept many pending orders and assign delivery agents in one transaction"""
+    
+    order_ids = list(dict.fromkeys(batch.order_ids))
+    if len(order_ids) > BATCH_ACCEPT_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_ACCEPT_MAX_ORDERS} orders per batch")
+    
+    # Lock what is still pending; orders another accept holds are skipped, not waited on
+    orders = (await db.execute(
+        select(Order)
+        .where(Order.id.in_(order_ids), Order.status == "pending")
+        .order_by(Order.id)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+    if not orders:
+        return {"accepted": [], "unassigned": [], "skipped": order_ids}
+    
+    locations = {
+        restaurant.id: (restaurant.latitude, restaurant.longitude)
+        for restaurant in (await db.execute(
+            select(Restaurant.id, Restaurant.latitude, Restaurant.longitude).where(
+                Restaurant.id.in_({order.restaurant_id for order in orders}),
+                Restaurant.latitude.isnot(None),
+                Restaurant.longitude.isnot(None)
+            )
+        )).all()
+    }
+    
+    # Match the whole batch against nearby agents at once instead of greedily
+    assignments = await agent_dispatcher.claim_agents(db, orders, locations)
+    
+    accepted = [order for order in orders if order.id in assignments]
+    now = datetime.utcnow()
+    for order in accepted:
+        order.status = "accepted"
+        order.delivery_agent_id = assignments[order.id]
+        order.version += 1
+        order.updated_at = now
+    
+    # One bulk message to delivery agent service, sent once this transaction commits
+    if accepted:
+        log.info("Assigning orders in one batch", orders=len(accepted), sample=LOG_HOT_PATH_SAMPLE_RATE)
+        snapshots = await build_snapshots(db, accepted)
+        enqueue(db, "delivery", "/orders/assign/bulk", {
+            "assignments": [
+                {
+                    "order_id": order.id,
+                    "agent_id": order.delivery_agent_id,
+                    "order": snapshots[order.id].model_dump(mode="json")
+                }
+                for order in accepted
+            ]
+        })
+        enqueue(db, "user", "/orders/status", {
+            "events": [status_event(order) for order in accepted]
+        })
+    
+    await db.commit()
+    if accepted:
+        outbox_dispatcher.notify()
+    for order in accepted:
+        pending_queue.remove(order.restaurant_id, order.id)
+    
+    locked_ids = {order.id for order in orders}
+    return {
+        "accepted": accepted,
+        "unassigned": [order.id for order in orders if order.id not in assignments],
+        "skipped": [order_id for order_id in order_ids if order_id not in locked_ids]
+    }
 
 @app.put("/orders/{order_id}/accept", response_model=OrderResponse, tags=["Orders"])
-async def accept_order(order_id: int, db: Session = Depends(get_db)):
+async def accept_order(order_id: int, db: AsyncSession = Depends(get_async_db)):
     """Accept an order and assign delivery agent"""
+    bind(order_id=order_id)
     
-    order = db.query(Order).filter(Order.id == order_id).first()
+    # Lock the order so concurrent accepts of it are serialized
+    order = await db.get(Order, order_id, with_for_update=True)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     if order.status != "pending":
         raise HTTPException(status_code=400, detail="Order cannot be accepted")
     
-    # Find available delivery agent
-    available_agent = db.query(DeliveryAgent).filter(
-        DeliveryAgent.is_available == True
-    ).first()
-    
-    if not available_agent:
+    # Atomically claim the best available delivery agent, nearest first
+    restaurant = (await db.execute(
+        select(Restaurant.latitude, Restaurant.longitude).where(Restaurant.id == order.restaurant_id)
+    )).first()
+    location = None
+    if restaurant and restaurant.latitude is not None and restaurant.longitude is not None:
+        location = (restaurant.latitude, restaurant.longitude)
+    agent_id = await agent_dispatcher.claim_agent(db, order, location)
+    if agent_id is None:
         raise HTTPException(status_code=400, detail="No delivery agents available")
     
     # Update order status and assign agent
     order.status = "accepted"
-    order.delivery_agent_id = available_agent.id
+    order.delivery_agent_id = agent_id
+    order.version += 1
     order.updated_at = datetime.utcnow()
     
-    # Mark agent as unavailable
-    available_agent.is_available = False
+    # Notify delivery agent service once this transaction commits
+    log.info("Assigning order to agent", agent_id=agent_id, sample=LOG_HOT_PATH_SAMPLE_RATE)
+    snapshot = await build_snapshot(db, order)
+    enqueue(db, "delivery", "/orders/assign", {
+        "order_id": order_id,
+        "agent_id": agent_id,
+        "order": snapshot.model_dump(mode="json")
+    })
+    enqueue(db, "user", "/orders/status", {"events": [status_event(order)]})
     
-    db.commit()
-    db.refresh(order)
-    
-    # Notify delivery agent service
-    try:
-        print(f"RESTAURANT: Assigning order {order_id} to agent {available_agent.id}")
-        assignment_data = {
-            "order_id": order_id,
-            "agent_id": available_agent.id
-        }
-        print(f"RESTAURANT: Assignment data: {assignment_data}")
-        
-        async with httpx.AsyncClient() as client:
-            # Import config here to avoid circular imports
-            import sys
-            sys.path.append('..') 
-            try:
-                from config import DELIVERY_SERVICE_URL, DELIVERY_SERVICE_DOCKER_URL
-            except ImportError:
-                # Default URLs if config can't be imported
-                DELIVERY_SERVICE_URL = "http://localhost:8003"
-                DELIVERY_SERVICE_DOCKER_URL = "http://delivery-agent-service:8000"
-                
-            # Try primary URL first (from environment or localhost)
-            try:
-                delivery_url = f"{DELIVERY_SERVICE_URL}/orders/assign"
-                print(f"RESTAURANT: Trying to notify delivery service at: {delivery_url}")
-                response = await client.post(
-                    delivery_url,
-                    json=assignment_data,
-                    timeout=5.0
-                )
-                print(f"RESTAURANT: Notified delivery service: {response.status_code}")
-                print(f"RESTAURANT: Response: {response.text}")
-            except Exception as primary_e:
-                print(f"RESTAURANT: Failed to notify primary delivery service: {primary_e}")
-                # Fallback to Docker service name
-                try:
-                    response = await client.post(
-                        f"{DELIVERY_SERVICE_DOCKER_URL}/orders/assign",
-                        json=assignment_data
-                    )
-                    print(f"RESTAURANT: Notified Docker delivery service: {response.status_code}")
-                except Exception as docker_e:
-                    print(f"RESTAURANT: Failed to notify Docker delivery service: {docker_e}")
-    except Exception as e:
-        print(f"RESTAURANT: Failed to notify any delivery agent service: {e}")
+    await db.commit()
+    outbox_dispatcher.notify()
+    pending_queue.remove(order.restaurant_id, order_id)
     
     return order
 
 @app.put("/orders/{order_id}/reject", response_model=OrderResponse, tags=["Orders"])
-def reject_order(order_id: int, db: Session = Depends(get_db)):
+async def reject_order(order_id: int, db: AsyncSession = Depends(get_async_db)):
     """Reject an order"""
     
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.get(Order, order_id, with_for_update=True)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -262,10 +522,15 @@ def reject_order(order_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Order cannot be rejected")
     
     order.status = "rejected"
+    order.version += 1
     order.updated_at = datetime.utcnow()
     
-    db.commit()
-    db.refresh(order)
+    # Let the customer's order stream know once this transaction commits
+    enqueue(db, "user", "/orders/status", {"events": [status_event(order)]})
+    
+    await db.commit()
+    outbox_dispatcher.notify()
+    pending_queue.remove(order.restaurant_id, order_id)
     
     return order
 
@@ -280,6 +545,23 @@ def get_pending_orders(restaurant_id: int, db: Session = Depends(get_db)):
     
     return orders
 
+@app.get("/orders/pending/wait", response_model=PendingOrders, tags=["Orders"])
+async def wait_for_pending_orders(restaurant_id: int, cursor: str = "", timeout: float = 25.0):
+    """Long-poll a restaurant's pending orders: returns when they change or on timeout"""
+    
+    timeout = min(max(timeout, 0.0), PENDING_WAIT_MAX_SECONDS)
+    cursor, orders = await pending_queue.wait(restaurant_id, cursor, timeout)
+    
+    return {"cursor": cursor, "orders": orders}
+
+@app.get("/dispatch/metrics", tags=["Dispatch"])
+def get_dispatch_metrics():
+    """Get agent assignment counters and latency percentiles for this worker"""
+    metrics = agent_dispatcher.metrics.snapshot()
+    metrics["indexed_agents"] = len(agent_index)
+    metrics["index_refreshed_at"] = agent_index.refreshed_at
+    return metrics
+
 @app.get("/orders/{order_id}", response_model=OrderResponse, tags=["Orders"])
 def get_order(order_id: int, db: Session = Depends(get_db)):
     """Get order details"""
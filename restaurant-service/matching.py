@@ -0,0 +1,66 @@
+INFEASIBLE = 1e9
+
+
+def solve_assignment(cost):
+    """Minimum-cost assignment over a rectangular cost matrix.
+
+    Hungarian algorithm (potentials / shortest augmenting path), O(n^2 * m)
+    for n rows and m >= n columns. Returns (row, column) pairs; when there
+    are more rows than columns the matrix is transposed, so every column is
+    assigned instead. Pairs costing INFEASIBLE or more are left out.
+    """
+    n = len(cost)
+    if n == 0 or not cost[0]:
+        return []
+    m = len(cost[0])
+    if n > m:
+        transposed = [list(column) for column in zip(*cost)]
+        return [(row, column) for column, row in solve_assignment(transposed)]
+
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    # p[j] is the row matched to column j (1-based, 0 = free)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = row[j - 1] - u[i0] - v[j]
+                    if current < minv[j]:
+                        minv[j] = current
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return [
+        (p[j] - 1, j - 1)
+        for j in range(1, m + 1)
+        if p[j] != 0 and cost[p[j] - 1][j - 1] < INFEASIBLE
+    ]
@@ -0,0 +1,58 @@
+import threading
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+
+from models import Restaurant, MenuItem
+from schemas import MenuItemResponse
+
+_menu_adapter = TypeAdapter(List[MenuItemResponse])
+
+
+class MenuCache:
+    """Pre-rendered JSON menu per restaurant.
+
+    A restaurant's menu is rendered once and kept as bytes until one of its
+    items changes, so reads skip both the query and response validation. The
+    TTL bounds staleness for writes handled by another worker. Each
+    invalidation bumps the restaurant's generation, and a menu loaded under
+    an older generation is served but not stored, so a read that raced a
+    write cannot put the old menu back.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._fragments = {}
+        self._generations = {}
+        # Guards generations and the store that checks them; held only for a few instructions
+        self._lock = threading.Lock()
+
+    def invalidate(self, restaurant_id):
+        """Drop the rendered menu for a restaurant"""
+        with self._lock:
+            self._generations[restaurant_id] = self._generations.get(restaurant_id, 0) + 1
+            self._fragments.pop(restaurant_id, None)
+
+    def get(self, db, restaurant_id):
+        """Return the menu of a restaurant as a JSON array, or None if it does not exist"""
+        cached = self._fragments.get(restaurant_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl_seconds:
+            return cached[1]
+
+        # Taken before loading, so an invalidation during the load is noticed
+        generation = self._generations.get(restaurant_id, 0)
+        restaurant = db.query(Restaurant.id).filter(Restaurant.id == restaurant_id).first()
+        if not restaurant:
+            return None
+
+        menu_items = db.query(MenuItem).filter(
+            MenuItem.restaurant_id == restaurant_id
+        ).order_by(MenuItem.id).all()
+        body = _menu_adapter.dump_json(
+            _menu_adapter.validate_python(menu_items, from_attributes=True)
+        )
+        with self._lock:
+            if self._generations.get(restaurant_id, 0) == generation:
+                self._fragments[restaurant_id] = (time.monotonic(), body)
+        return body
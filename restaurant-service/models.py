@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, Float, ForeignKey, JSON
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -23,6 +23,11 @@ class Restaurant(Base):
     cuisine_type = Column(String(100))
     is_online = Column(Boolean, default=True)
     rating = Column(DECIMAL(3,2), default=0.0)
+    # Running totals behind rating, copied from user service (rating_sync)
+    rating_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
 
 class MenuItem(Base):
@@ -45,12 +50,22 @@ class Order(Base):
     restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
     delivery_agent_id = Column(Integer, ForeignKey("delivery_agents.id"))
     status = Column(String(50), default="pending")
+    version = Column(Integer, default=1, nullable=False)
     total_amount = Column(DECIMAL(10,2), nullable=False)
     delivery_address = Column(Text)
     special_instructions = Column(Text)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     updated_at = Column(TIMESTAMP, default=datetime.utcnow)
 
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"))
+    menu_item_id = Column(Integer, ForeignKey("menu_items.id"))
+    quantity = Column(Integer, nullable=False)
+    price = Column(DECIMAL(10,2), nullable=False)
+
 class DeliveryAgent(Base):
     __tablename__ = "delivery_agents"
     
@@ -59,6 +74,35 @@ class DeliveryAgent(Base):
     email = Column(String(255), unique=True, nullable=False)
     phone = Column(String(20))
     vehicle_type = Column(String(50))
+    # Available means on shift (the agent's own switch) and below capacity
     is_available = Column(Boolean, default=True)
+    on_shift = Column(Boolean, default=True, nullable=False)
+    # Orders the agent can carry at once and how many it carries now
+    capacity = Column(Integer, default=1, nullable=False)
+    current_load = Column(Integer, default=0, nullable=False)
+    # Lifetime delivered orders, counted as each delivery completes
+    total_deliveries = Column(Integer, default=0, nullable=False)
     rating = Column(DECIMAL(3,2), default=0.0)
+    # Running totals behind rating, copied from user service (rating_sync)
+    rating_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    location_updated_at = Column(TIMESTAMP)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(50), nullable=False)
+    target = Column(String(50), nullable=False)
+    path = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(TIMESTAMP, default=datetime.utcnow)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    delivered_at = Column(TIMESTAMP)
+    # W3C trace context of the request that wrote the event
+    traceparent = Column(String(55))
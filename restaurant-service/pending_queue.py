@@ -0,0 +1,157 @@
+import asyncio
+import time
+import zlib
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from log import get_logger
+from models import Order
+from schemas import OrderResponse
+
+log = get_logger("pending")
+
+
+class _RestaurantPending:
+    __slots__ = ("orders", "cursor", "changed", "waiters", "last_seen")
+
+    def __init__(self, orders):
+        self.orders = orders
+        self.cursor = _cursor(orders)
+        self.changed = asyncio.Event()
+        self.waiters = 0
+        self.last_seen = time.monotonic()
+
+
+def _cursor(orders):
+    """Digest of a pending set; equal on every worker that holds the same set"""
+    key = ",".join(str(order_id) for order_id in sorted(orders))
+    return f"{len(orders)}-{zlib.crc32(key.encode()):08x}"
+
+
+class PendingOrderQueue:
+    """In-memory pending orders per restaurant, for long-polling tablets.
+
+    A restaurant's set is loaded from the database the first time someone
+    waits on it, then kept current by new-order notifications and by
+    accepts/rejects handled here; waiters are woken the moment it changes.
+    Cursors are digests of the set rather than counters, so a tablet can be
+    routed to any worker. Changes handled by another worker are picked up by
+    a periodic resync of the watched restaurants, and restaurants nobody
+    has asked about for a while are dropped.
+    """
+
+    def __init__(self, resync_seconds=5.0, idle_seconds=300.0):
+        self.resync_seconds = resync_seconds
+        self.idle_seconds = idle_seconds
+        self._restaurants = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._restaurants)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def wait(self, restaurant_id, cursor, timeout):
+        """Return (cursor, pending orders) once they differ from `cursor` or the timeout expires"""
+        entry = self._restaurants.get(restaurant_id)
+        if entry is None:
+            orders = await self._load([restaurant_id])
+            entry = self._restaurants.setdefault(
+                restaurant_id, _RestaurantPending(orders.get(restaurant_id, {}))
+            )
+        entry.last_seen = time.monotonic()
+
+        if cursor != entry.cursor:
+            return entry.cursor, self._sorted(entry)
+
+        changed = entry.changed
+        entry.waiters += 1
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            entry.waiters -= 1
+            entry.last_seen = time.monotonic()
+        return entry.cursor, self._sorted(entry)
+
+    def add(self, order):
+        """Record a new pending order (anything with OrderResponse attributes)"""
+        entry = self._restaurants.get(order.restaurant_id)
+        if entry is None or order.id in entry.orders:
+            return
+        orders = dict(entry.orders)
+        orders[order.id] = OrderResponse.model_validate(order, from_attributes=True)
+        self._replace(entry, orders)
+
+    def remove(self, restaurant_id, order_id):
+        """Drop an order that is no longer pending"""
+        entry = self._restaurants.get(restaurant_id)
+        if entry is None or order_id not in entry.orders:
+            return
+        orders = dict(entry.orders)
+        del orders[order_id]
+        self._replace(entry, orders)
+
+    @staticmethod
+    def _sorted(entry):
+        return sorted(entry.orders.values(), key=lambda order: (order.created_at, order.id))
+
+    @staticmethod
+    def _replace(entry, orders):
+        entry.orders = orders
+        entry.cursor = _cursor(orders)
+        # Wake everyone waiting on the old state; later waiters get a fresh event
+        entry.changed.set()
+        entry.changed = asyncio.Event()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resync_seconds)
+            try:
+                await self.resync()
+            except Exception as e:
+                log.error("Failed to resync pending orders", error=str(e))
+
+    async def resync(self):
+        """Reload watched restaurants from the database and drop idle ones"""
+        now = time.monotonic()
+        for restaurant_id, entry in list(self._restaurants.items()):
+            if not entry.waiters and now - entry.last_seen > self.idle_seconds:
+                del self._restaurants[restaurant_id]
+
+        restaurant_ids = list(self._restaurants)
+        if not restaurant_ids:
+            return
+        loaded = await self._load(restaurant_ids)
+        for restaurant_id in restaurant_ids:
+            entry = self._restaurants.get(restaurant_id)
+            orders = loaded.get(restaurant_id, {})
+            if entry is not None and _cursor(orders) != entry.cursor:
+                self._replace(entry, orders)
+
+    async def _load(self, restaurant_ids, chunk_size=500):
+        """Pending orders of several restaurants, one query per chunk"""
+        loaded = {}
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(restaurant_ids), chunk_size):
+                orders = (await db.execute(
+                    select(Order).where(
+                        Order.restaurant_id.in_(restaurant_ids[start:start + chunk_size]),
+                        Order.status == "pending"
+                    )
+                )).scalars().all()
+                for order in orders:
+                    loaded.setdefault(order.restaurant_id, {})[order.id] = OrderResponse.model_validate(order)
+        return loaded
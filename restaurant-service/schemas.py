@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional
 from decimal import Decimal
 from datetime import datetime
@@ -8,6 +8,8 @@ class RestaurantCreate(BaseModel):
     address: Optional[str] = None
     phone: Optional[str] = None
     cuisine_type: Optional[str] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
 
 class RestaurantResponse(BaseModel):
     id: int
@@ -17,6 +19,8 @@ class RestaurantResponse(BaseModel):
     cuisine_type: Optional[str]
     is_online: bool
     rating: Optional[Decimal]
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     created_at: datetime
     
     class Config:
@@ -55,8 +59,78 @@ class MenuUpdate(BaseModel):
 class StatusUpdate(BaseModel):
     is_online: bool
 
+class OrderItemSnapshot(BaseModel):
+    menu_item_id: int
+    quantity: int
+    price: Decimal
+
+# Full copy of an order carried by hand-off events; newer versions win
+class OrderSnapshot(BaseModel):
+    id: int
+    version: int
+    user_id: int
+    restaurant_id: int
+    delivery_agent_id: Optional[int] = None
+    status: str
+    total_amount: Decimal
+    delivery_address: Optional[str] = None
+    special_instructions: Optional[str] = None
+    created_at: datetime
+    items: List[OrderItemSnapshot] = []
+
 class OrderNotification(BaseModel):
     order_id: int
+    order: OrderSnapshot
+
+# Status change made by delivery agent service; newer versions win
+class OrderStatusEvent(BaseModel):
+    order_id: int
+    version: int
+    status: str
+    delivery_agent_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+class OrderStatusBatch(BaseModel):
+    events: List[OrderStatusEvent]
+
+# Agent profile owned by delivery agent service; load and location are tracked here
+class AgentProfile(BaseModel):
+    id: int
+    name: str
+    email: str
+    phone: Optional[str] = None
+    vehicle_type: Optional[str] = None
+    capacity: int = 1
+    on_shift: Optional[bool] = None
+    is_available: bool = True
+
+    @property
+    def working(self):
+        # Profiles written before on_shift existed only carry is_available
+        return self.is_available if self.on_shift is None else self.on_shift
+
+class AgentProfileBatch(BaseModel):
+    agents: List[AgentProfile]
+
+class AgentPosition(BaseModel):
+    agent_id: int
+    latitude: float
+    longitude: float
+    recorded_at: datetime
+
+class AgentPositionBatch(BaseModel):
+    positions: List[AgentPosition]
+
+# Rating aggregates owned by user service
+class RatingAggregate(BaseModel):
+    id: int
+    rating_count: int
+    rating_sum: int
+    rating: Decimal
+
+class RatingSyncBatch(BaseModel):
+    restaurants: List[RatingAggregate] = []
+    agents: List[RatingAggregate] = []
 
 class OrderAction(BaseModel):
     action: str  # "accept" or "reject"
@@ -74,3 +148,18 @@ class OrderResponse(BaseModel):
     
     class Config:
         from_attributes = True
+
+class PendingOrders(BaseModel):
+    # Pass back as `cursor` to wait for the next change
+    cursor: str
+    orders: List[OrderResponse]
+
+class BatchAccept(BaseModel):
+    order_ids: List[int]
+
+class BatchAcceptResponse(BaseModel):
+    accepted: List[OrderResponse]
+    # Pending orders left pending because no agent could be claimed
+    unassigned: List[int]
+    # Orders that are unknown, no longer pending or being accepted elsewhere
+    skipped: List[int]
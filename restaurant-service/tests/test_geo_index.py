@@ -0,0 +1,50 @@
+import random
+
+from geo import haversine_km
+from geo_index import GridIndex
+
+
+def test_upsert_moves_and_remove_forgets():
+    index = GridIndex(cell_degrees=0.01)
+    index.upsert("a", 12.97, 77.59, data={"rating": 4})
+    index.upsert("a", 13.5, 78.0, data={"rating": 5})
+    assert len(index) == 1
+    assert index.get("a") == (13.5, 78.0, {"rating": 5})
+    assert index.nearest(12.97, 77.59, 1)[0][1] == "a"
+
+    index.remove("a")
+    index.remove("a")
+    assert "a" not in index
+    assert index.get("a") is None
+    assert index.nearest(12.97, 77.59, 1) == []
+
+
+def test_nearest_without_points_or_k():
+    index = GridIndex()
+    assert index.nearest(0, 0, 3) == []
+    index.upsert(1, 0, 0)
+    assert index.nearest(0, 0, 0) == []
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(3)
+    index = GridIndex(cell_degrees=0.02)
+    points = {}
+    for key in range(300):
+        lat, lon = 12.9 + rng.uniform(0, 0.3), 77.5 + rng.uniform(0, 0.3)
+        points[key] = (lat, lon)
+        index.upsert(key, lat, lon)
+
+    for _ in range(20):
+        lat, lon = 12.9 + rng.uniform(0, 0.3), 77.5 + rng.uniform(0, 0.3)
+        expected = sorted(haversine_km(lat, lon, *point) for point in points.values())[:5]
+        found = index.nearest(lat, lon, 5)
+        assert [round(distance, 9) for distance, _, _ in found] == [round(distance, 9) for distance in expected]
+
+
+def test_nearest_respects_max_km():
+    index = GridIndex(cell_degrees=0.01)
+    index.upsert("near", 12.971, 77.591)
+    index.upsert("far", 13.2, 77.8)
+    found = index.nearest(12.97, 77.59, 5, max_km=5)
+    assert [key for _, key, _ in found] == ["near"]
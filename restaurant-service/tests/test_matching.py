@@ -0,0 +1,71 @@
+import itertools
+import random
+
+from matching import INFEASIBLE, solve_assignment
+
+
+def _cost(cost, pairs):
+    return sum(cost[row][column] for row, column in pairs)
+
+
+def _best_cost(cost):
+    """Brute-force minimum over every way to give each row its own column"""
+    n, m = len(cost), len(cost[0])
+    return min(
+        sum(cost[row][column] for row, column in enumerate(columns))
+        for columns in itertools.permutations(range(m), n)
+    )
+
+
+def test_empty_matrix():
+    assert solve_assignment([]) == []
+    assert solve_assignment([[]]) == []
+
+
+def test_square_matrix():
+    cost = [
+        [4, 1, 3],
+        [2, 0, 5],
+        [3, 2, 2]
+    ]
+    pairs = solve_assignment(cost)
+    assert sorted(pairs) == [(0, 1), (1, 0), (2, 2)]
+    assert _cost(cost, pairs) == 5
+
+
+def test_more_columns_than_rows():
+    cost = [
+        [9, 1, 9, 9],
+        [9, 9, 9, 2]
+    ]
+    assert sorted(solve_assignment(cost)) == [(0, 1), (1, 3)]
+
+
+def test_more_rows_than_columns_assigns_every_column():
+    cost = [
+        [5, 9],
+        [1, 9],
+        [9, 2]
+    ]
+    pairs = solve_assignment(cost)
+    assert sorted(pairs) == [(1, 0), (2, 1)]
+
+
+def test_infeasible_pairs_are_left_out():
+    cost = [
+        [INFEASIBLE, INFEASIBLE],
+        [1, INFEASIBLE]
+    ]
+    assert solve_assignment(cost) == [(1, 0)]
+
+
+def test_matches_brute_force():
+    rng = random.Random(7)
+    for _ in range(50):
+        n = rng.randint(1, 5)
+        m = rng.randint(n, 6)
+        cost = [[rng.uniform(-3, 10) for _ in range(m)] for _ in range(n)]
+        pairs = solve_assignment(cost)
+        assert len(pairs) == n
+        assert len({column for _, column in pairs}) == n
+        assert abs(_cost(cost, pairs) - _best_cost(cost)) < 1e-9
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from pending_queue import PendingOrderQueue, _RestaurantPending, _cursor
+
+
+def _order(order_id, restaurant_id=1):
+    return SimpleNamespace(
+        id=order_id,
+        user_id=1,
+        restaurant_id=restaurant_id,
+        delivery_agent_id=None,
+        status="pending",
+        total_amount=Decimal("10.00"),
+        delivery_address="1 Main St",
+        special_instructions=None,
+        created_at=datetime(2026, 1, 1, 12, 0, order_id)
+    )
+
+
+def _watched(queue, restaurant_id=1):
+    """Start watching a restaurant with no pending orders, without loading from the database"""
+    entry = queue._restaurants[restaurant_id] = _RestaurantPending({})
+    return entry
+
+
+def test_cursor_depends_only_on_the_set():
+    assert _cursor({1: None, 2: None, 3: None}) == _cursor({3: None, 1: None, 2: None})
+    assert _cursor({1: None, 2: None}) != _cursor({1: None, 3: None})
+    assert _cursor({}).startswith("0-")
+    assert _cursor({5: None}).startswith("1-")
+
+
+def test_add_and_remove_move_the_cursor():
+    async def run():
+        queue = PendingOrderQueue()
+        entry = _watched(queue)
+        empty = entry.cursor
+
+        queue.add(_order(1))
+        queue.add(_order(2))
+        with_two = entry.cursor
+        assert with_two != empty
+        # A redelivered order changes nothing
+        queue.add(_order(2))
+        assert entry.cursor == with_two
+
+        queue.remove(1, 1)
+        queue.remove(1, 2)
+        assert entry.cursor == empty
+        # Unknown orders and restaurants are ignored
+        queue.remove(1, 99)
+        queue.add(_order(3, restaurant_id=2))
+        assert 2 not in queue._restaurants
+
+    asyncio.run(run())
+
+
+def test_wait_returns_at_once_for_a_stale_cursor():
+    async def run():
+        queue = PendingOrderQueue()
+        _watched(queue)
+        queue.add(_order(2))
+        queue.add(_order(1))
+        cursor, orders = await queue.wait(1, "", timeout=5)
+        assert cursor == _cursor({1: None, 2: None})
+        assert [order.id for order in orders] == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_wait_wakes_on_change_and_times_out_without_one():
+    async def run():
+        queue = PendingOrderQueue()
+        entry = _watched(queue)
+        cursor = entry.cursor
+
+        unchanged, orders = await queue.wait(1, cursor, timeout=0.01)
+        assert unchanged == cursor and orders == []
+
+        waiter = asyncio.create_task(queue.wait(1, cursor, timeout=5))
+        await asyncio.sleep(0)
+        assert entry.waiters == 1
+        queue.add(_order(1))
+        new_cursor, orders = await asyncio.wait_for(waiter, 1)
+        assert new_cursor != cursor
+        assert [order.id for order in orders] == [1]
+        assert entry.waiters == 0
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+"""Active-order accounting for delivery agents.
+
+Restaurant and delivery agent services both keep a delivery_agents table
+whose current_load counts the agent's active orders. An agent is
+available while on shift (set by the agent through /agents/status) and
+below capacity; is_available is stored so claims can test it in the
+same row lock, and every load change here keeps it in step.
+"""
+from sqlalchemy import and_, case, update
+
+from models import DeliveryAgent
+
+FINAL_STATUSES = ("delivered", "cancelled")
+
+
+def is_active(status):
+    return status is not None and status not in FINAL_STATUSES
+
+
+def load_changes(before, after):
+    """Per-agent change in active orders when orders move from `before` to `after`.
+
+    Both map order_id to (agent_id, status); orders missing from `before`
+    are new here.
+    """
+    deltas = {}
+    for order_id, (agent_id, status) in after.items():
+        old_agent_id, old_status = before.get(order_id, (None, None))
+        was = old_agent_id if is_active(old_status) else None
+        now = agent_id if is_active(status) else None
+        if was == now:
+            continue
+        if was is not None:
+            deltas[was] = deltas.get(was, 0) - 1
+        if now is not None:
+            deltas[now] = deltas.get(now, 0) + 1
+    return {agent_id: delta for agent_id, delta in deltas.items() if delta}
+
+
+async def adjust_loads(db, deltas):
+    """Apply active-order changes to agents' current_load, in id order to avoid deadlocks"""
+    for agent_id in sorted(deltas):
+        delta = deltas[agent_id]
+        new_load = case((DeliveryAgent.current_load + delta > 0, DeliveryAgent.current_load + delta), else_=0)
+        # Freeing a slot never puts an agent who went off shift back on
+        await db.execute(
+            update(DeliveryAgent)
+            .where(DeliveryAgent.id == agent_id)
+            .values(current_load=new_load, is_available=and_(DeliveryAgent.on_shift, new_load < DeliveryAgent.capacity))
+            .execution_options(synchronize_session=False)
+        )
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from config import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from database import async_engine, engine, ensure_schema
+from log import get_logger
+
+log = get_logger("startup")
+
+# Taken when the service's modules are first imported
+STARTED = time.monotonic()
+
+
+def _pool_usage(pool):
+    """Connections checked out of a pool against what it may hand out"""
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout() if hasattr(pool, "checkedout") else 0
+    return {"in_use": checked_out, "capacity": capacity, "usage": round(checked_out / capacity, 3) if capacity else 0.0}
+
+
+class ServiceHealth:
+    """Lazy database warm-up plus the liveness and readiness answers.
+
+    Startup does not wait for the database: `start()` only schedules the
+    schema check and pool warm-up, so the service is live immediately and
+    becomes ready once the warm-up is done. The time from import to ready is
+    measured against `startup_budget` and reported. Readiness also needs a
+    successful database probe, cached for `probe_seconds` so frequent health
+    checks cost at most one SELECT 1 per interval, and pools below
+    `max_pool_usage`.
+    """
+
+    def __init__(self, startup_budget=10.0, warm_connections=2, probe_seconds=5.0, probe_timeout=2.0, max_pool_usage=0.9):
+        self.startup_budget = startup_budget
+        self.warm_connections = warm_connections
+        self.probe_seconds = probe_seconds
+        self.probe_timeout = probe_timeout
+        self.max_pool_usage = max_pool_usage
+        self.warmed_up = False
+        self.serving_seconds = None
+        self.ready_seconds = None
+        self._database_ok = False
+        self._database_error = "not probed yet"
+        self._probed_at = None
+        self._task = None
+
+    def start(self):
+        self.serving_seconds = round(time.monotonic() - STARTED, 3)
+        self._task = asyncio.create_task(self._warm_up())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _warm_up(self):
+        delay = 1.0
+        while True:
+            try:
+                await asyncio.to_thread(ensure_schema)
+                connections = []
+                try:
+                    for _ in range(self.warm_connections):
+                        connection = await async_engine.connect()
+                        connections.append(connection)
+                        await connection.execute(text("SELECT 1"))
+                finally:
+                    for connection in connections:
+                        await connection.close()
+                break
+            except Exception as e:
+                self._database_ok, self._database_error = False, str(e) or type(e).__name__
+                log.warning("Database warm-up failed; retrying", retry_in_seconds=delay, error=str(e))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+        self.warmed_up = True
+        self._database_ok, self._database_error = True, None
+        self._probed_at = time.monotonic()
+        self.ready_seconds = round(self._probed_at - STARTED, 3)
+        log.info(
+            "Startup finished",
+            serving_seconds=self.serving_seconds,
+            ready_seconds=self.ready_seconds,
+            budget_seconds=self.startup_budget,
+            over_budget=self.ready_seconds > self.startup_budget
+        )
+
+    async def _probe(self):
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def _refresh(self):
+        now = time.monotonic()
+        if self._probed_at is not None and now - self._probed_at < self.probe_seconds:
+            return
+        # Concurrent checks keep using the previous answer while this one runs
+        self._probed_at = now
+        try:
+            await asyncio.wait_for(self._probe(), self.probe_timeout)
+            self._database_ok, self._database_error = True, None
+        except asyncio.TimeoutError:
+            self._database_ok, self._database_error = False, f"no answer within {self.probe_timeout}s"
+        except Exception as e:
+            self._database_ok, self._database_error = False, str(e) or type(e).__name__
+
+    def live(self):
+        return {
+            "status": "alive",
+            "uptime_seconds": round(time.monotonic() - STARTED, 1),
+            "serving_after_seconds": self.serving_seconds
+        }
+
+    async def ready(self):
+        """Return (ready, details)"""
+        if self.warmed_up:
+            await self._refresh()
+        pools = {"sync": _pool_usage(engine.pool), "async": _pool_usage(async_engine.pool)}
+        saturated = [name for name, pool in pools.items() if pool["usage"] >= self.max_pool_usage]
+
+        reasons = []
+        if not self.warmed_up:
+            reasons.append("warming up")
+        if not self._database_ok:
+            reasons.append(f"database unavailable: {self._database_error}")
+        if saturated:
+            reasons.append(f"connection pool saturated: {', '.join(saturated)}")
+
+        details = {
+            "status": "ready" if not reasons else "not_ready",
+            "reasons": reasons,
+            "database": {
+                "ok": self._database_ok,
+                "checked_seconds_ago": round(time.monotonic() - self._probed_at, 1) if self._probed_at else None
+            },
+            "pools": pools,
+            "startup": {
+                "serving_after_seconds": self.serving_seconds,
+                "ready_after_seconds": self.ready_seconds,
+                "budget_seconds": self.startup_budget
+            }
+        }
+        return not reasons, details
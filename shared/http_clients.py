@@ -0,0 +1,64 @@
+import importlib.util
+
+import httpx
+
+from config import (
+    HTTP_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP2_ENABLED
+)
+from log import get_logger
+from metrics import MetricsTransport
+from tracing import TracingTransport
+
+log = get_logger("http")
+
+# One long-lived client (and connection pool) per downstream service
+_clients = {}
+
+# HTTP/2 needs the h2 package, installed by httpx[http2] in requirements.txt
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _build_client(name):
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        http2=HTTP2_ENABLED and HTTP2_AVAILABLE
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        # Pool limits live on the transport; the wrappers record latency and carry the trace context
+        transport=TracingTransport(name, MetricsTransport(name, transport))
+    )
+
+
+def open_clients(names):
+    """Create the pooled clients for the given downstream services"""
+    if HTTP2_ENABLED and not HTTP2_AVAILABLE:
+        log.warning("HTTP/2 was requested but the h2 package is not installed; using HTTP/1.1")
+    for name in names:
+        if name not in _clients:
+            _clients[name] = _build_client(name)
+
+
+async def close_clients():
+    """Close every pooled client, releasing its connections"""
+    while _clients:
+        _, client = _clients.popitem()
+        await client.aclose()
+
+
+def get_client(name):
+    """Return the pooled client for a downstream service"""
+    client = _clients.get(name)
+    if client is None:
+        # Created lazily when the app runs without its lifespan (e.g. scripts)
+        client = _clients[name] = _build_client(name)
+    return client
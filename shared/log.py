@@ -0,0 +1,191 @@
+"""Structured logging that never blocks the request path.
+
+Records go through a bounded in-memory queue to one background thread
+that formats them (JSON lines by default) and writes to stdout. When the
+queue is full a record is dropped and counted instead of waiting; the
+count is exported as log_records_dropped_total and reported in the log
+once there is room again. High-volume messages can be sampled with
+`sample=`. Fields bound to the current request (request id, order id)
+and the trace id are added to every record logged while handling it.
+
+    log = get_logger("orders")
+    log.info("Order accepted", agent_id=agent_id, sample=LOG_HOT_PATH_SAMPLE_RATE)
+"""
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import SERVICE_NAME, LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE
+from metrics import log_dropped
+from tracing import annotate, current_trace_id
+
+# Fields bound to the request being handled; None outside requests
+_context = ContextVar("log_context", default=None)
+
+# Keyword arguments that logging itself understands; anything else is a field
+_LOGGING_KWARGS = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+
+def bind(**fields):
+    """Add fields (e.g. order_id) to every record of the current request and to its trace span"""
+    context = _context.get()
+    if context is None:
+        context = {}
+        _context.set(context)
+    context.update(fields)
+    annotate(**fields)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Logger taking fields as keyword arguments, plus `sample=` to keep only a fraction of records"""
+
+    def log(self, level, msg, *args, sample=None, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        if sample is not None and sample < 1.0:
+            if random.random() >= sample:
+                return
+            kwargs["sample_rate"] = sample
+        super().log(level, msg, *args, **kwargs)
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _LOGGING_KWARGS}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "fields": fields}
+        return msg, kwargs
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops and counts records instead of blocking when the queue is full"""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        # Only the cheap work happens on the caller's thread: render the message,
+        # capture the request context, and flatten a traceback if there is one
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        record.context = dict(_context.get() or ())
+        trace_id = current_trace_id()
+        if trace_id:
+            record.context["trace_id"] = trace_id
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self._unreported:
+                notice = logging.makeLogRecord({
+                    "name": record.name,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": "Log queue was full; records dropped",
+                    "fields": {"dropped": self._unreported},
+                    "context": {}
+                })
+                notice.message = notice.msg
+                self.queue.put_nowait(notice)
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            log_dropped.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "service": SERVICE_NAME,
+            "logger": record.name,
+            "message": record.message
+        }
+        entry.update(getattr(record, "context", None) or {})
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = {**(getattr(record, "context", None) or {}), **(getattr(record, "fields", None) or {})}
+        line = f"{record.levelname}: {record.name}: {record.message}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+_records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_handler = _DroppingQueueHandler(_records)
+_root = logging.getLogger(SERVICE_NAME)
+_root.setLevel(LOG_LEVEL)
+_root.addHandler(_handler)
+_root.propagate = False
+_listener = None
+
+
+def get_logger(name):
+    return StructuredLogger(_root.getChild(name), {})
+
+
+def start_logging():
+    """Start the thread that writes queued records to stdout"""
+    global _listener
+    if _listener is None:
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        _listener = QueueListener(_records, output)
+        _listener.start()
+
+
+def stop_logging():
+    """Write out what is queued and stop the thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """ASGI middleware giving each request a context for log fields and an X-Request-Id (kept if sent)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = _context.set({"request_id": request_id})
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _context.reset(token)
@@ -0,0 +1,265 @@
+"""In-process metrics in the Prometheus text format.
+
+Recording is a perf_counter read, a bisect and a few integer bumps under
+an uncontended lock; cumulative buckets and pool gauges are only worked
+out when /metrics is scraped. Each worker keeps its own numbers.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+import httpx
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or read from `collect()` (returning {labels: value}) at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        if self.collect:
+            values.update(self.collect())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for key, counts, total in values:
+            running = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                running += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (_number(bound),))} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {running}")
+        return lines
+
+
+_metrics = []
+
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Inbound HTTP
+http_requests = _register(Counter(
+    "http_requests_total", "Requests handled, by route template and status", ("method", "route", "status")
+))
+http_latency = _register(Histogram(
+    "http_request_duration_seconds", "Time to the end of the response body", ("method", "route")
+))
+http_in_flight = _register(Gauge(
+    "http_requests_in_progress", "Requests being handled right now", ("method",)
+))
+
+# Outbound HTTP to the other services
+client_latency = _register(Histogram(
+    "http_client_request_duration_seconds", "Calls to downstream services", ("service", "method", "status")
+))
+client_errors = _register(Counter(
+    "http_client_errors_total", "Downstream calls that failed or returned 5xx", ("service", "error")
+))
+
+# Logging
+log_dropped = _register(Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full"
+))
+
+# Outbox
+outbox_abandoned = _register(Counter(
+    "outbox_events_abandoned_total", "Hand-offs given up after OUTBOX_MAX_ATTEMPTS failed deliveries", ("target", "path")
+))
+
+# Database pools
+_pools = {}
+pool_checkout_wait = _register(Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool (includes opening one)", ("pool",),
+    buckets=POOL_WAIT_BUCKETS
+))
+
+
+def _collect_pools(read):
+    def collect():
+        return {(name,): read(pool) for name, pool in _pools.items() if hasattr(pool, "checkedout")}
+    return collect
+
+
+_register(Gauge("db_pool_size", "Connections the pool keeps open", ("pool",),
+                collect=_collect_pools(lambda pool: pool.size())))
+_register(Gauge("db_pool_checked_out", "Connections in use", ("pool",),
+                collect=_collect_pools(lambda pool: pool.checkedout())))
+# QueuePool counts overflow from -pool_size; only connections beyond the pool are reported
+_register(Gauge("db_pool_overflow", "Connections open beyond the pool size", ("pool",),
+                collect=_collect_pools(lambda pool: max(pool.overflow(), 0))))
+
+
+def instrument_engines(engines):
+    """Time connection checkouts of each {name: engine} and expose pool sizes"""
+    for name, engine in engines.items():
+        engine = getattr(engine, "sync_engine", engine)
+        pool = engine.pool
+        if name in _pools:
+            continue
+        _pools[name] = pool
+        checkout = pool.connect
+
+        def timed_checkout(checkout=checkout, name=name):
+            started = time.perf_counter()
+            try:
+                return checkout()
+            finally:
+                pool_checkout_wait.observe(time.perf_counter() - started, name)
+
+        # Engines fetch connections through pool.connect(); shadow it on this instance only
+        pool.connect = timed_checkout
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight requests per route template.
+
+    Written against raw ASGI rather than BaseHTTPMiddleware so streaming
+    responses and WebSockets pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc(method)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec(method)
+            # The router leaves the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_latency.observe(time.perf_counter() - started, method, template)
+            http_requests.inc(method, template, status)
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """httpx transport that times each call to one downstream service"""
+
+    def __init__(self, service, transport):
+        self.service = service
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception as e:
+            client_latency.observe(time.perf_counter() - started, self.service, request.method, "error")
+            client_errors.inc(self.service, type(e).__name__)
+            raise
+        client_latency.observe(time.perf_counter() - started, self.service, request.method, response.status_code)
+        if response.status_code >= 500:
+            client_errors.inc(self.service, f"status_{response.status_code}")
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,171 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from config import (
+    SERVICE_NAME,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE,
+    OUTBOX_MAX_BACKOFF,
+    TRACING_ENABLED
+)
+from database import AsyncSessionLocal
+from http_clients import get_client
+from log import get_logger
+from metrics import outbox_abandoned
+from models import OutboxEvent
+from tracing import current_traceparent, tracer
+
+log = get_logger("outbox")
+
+
+def enqueue(db, target, path, payload):
+    """Add a hand-off to the caller's transaction; it is sent after commit"""
+    db.add(OutboxEvent(
+        source=SERVICE_NAME,
+        target=target,
+        path=path,
+        payload=payload,
+        traceparent=current_traceparent()
+    ))
+
+
+class OutboxDispatcher:
+    """Background task that delivers committed outbox events at least once.
+
+    Pending events are claimed in batches with FOR UPDATE SKIP LOCKED, so
+    several workers can dispatch side by side without sending the same event
+    concurrently. Failed deliveries are retried with exponential backoff;
+    after OUTBOX_MAX_ATTEMPTS an event is left undelivered (attempts at the
+    limit, last_error kept) and logged as an error, and is sent again only
+    once its attempts are reset.
+    """
+
+    def __init__(self, base_urls):
+        # target -> (primary URL, Docker fallback URL)
+        self.base_urls = base_urls
+        # Created in start(): on Python 3.9 an Event made before the loop runs is bound to another loop
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """Wake the dispatcher after committing new events"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.dispatch_batch()
+            except Exception as e:
+                log.error("Dispatch failed", error=str(e))
+                claimed = 0
+
+            # A full batch means there is probably more waiting
+            if claimed >= OUTBOX_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            except Exception as e:
+                # Never let the wait end the dispatcher; fall back to polling
+                log.error("Waiting for new events failed", error=str(e))
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    async def dispatch_batch(self):
+        """Send one batch of due events and record the outcome"""
+        async with AsyncSessionLocal() as db:
+            events = (await db.execute(
+                select(OutboxEvent).where(
+                    OutboxEvent.source == SERVICE_NAME,
+                    OutboxEvent.delivered_at.is_(None),
+                    OutboxEvent.attempts < OUTBOX_MAX_ATTEMPTS,
+                    OutboxEvent.next_attempt_at <= datetime.utcnow()
+                ).order_by(OutboxEvent.id).limit(OUTBOX_BATCH_SIZE).with_for_update(skip_locked=True)
+            )).scalars().all()
+            if not events:
+                return 0
+
+            errors = await asyncio.gather(*(self._deliver(event) for event in events))
+
+            now = datetime.utcnow()
+            for event, error in zip(events, errors):
+                event.attempts += 1
+                if error is None:
+                    event.delivered_at = now
+                    event.last_error = None
+                else:
+                    backoff = min(OUTBOX_BACKOFF_BASE * 2 ** event.attempts, OUTBOX_MAX_BACKOFF)
+                    event.next_attempt_at = now + timedelta(seconds=backoff * random.uniform(0.5, 1.0))
+                    event.last_error = error[:1000]
+                    if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                        outbox_abandoned.inc(event.target, event.path)
+                        log.error(
+                            "Event abandoned after too many failed deliveries",
+                            event_id=event.id,
+                            target=event.target,
+                            path=event.path,
+                            attempt=event.attempts,
+                            error=error
+                        )
+                        continue
+                    log.warning(
+                        "Event delivery failed",
+                        event_id=event.id,
+                        target=event.target,
+                        path=event.path,
+                        attempt=event.attempts,
+                        error=error
+                    )
+
+            await db.commit()
+            return len(events)
+
+    async def _deliver(self, event):
+        """POST one event, falling back to the Docker URL; return an error string or None"""
+        if not TRACING_ENABLED:
+            return await self._post(event)
+        # Continues the trace of the request that enqueued the event
+        with tracer.span(f"outbox {event.target}{event.path}", "producer", traceparent=event.traceparent) as span:
+            span.attributes["outbox.event_id"] = event.id
+            span.attributes["outbox.attempt"] = event.attempts + 1
+            if isinstance(event.payload, dict) and "order_id" in event.payload:
+                span.attributes["order_id"] = event.payload["order_id"]
+            if event.created_at:
+                span.attributes["outbox.delay_ms"] = round((datetime.utcnow() - event.created_at).total_seconds() * 1000, 1)
+            error = await self._post(event)
+            span.error = error
+            return error
+
+    async def _post(self, event):
+        client = get_client(event.target)
+        error = None
+        for base_url in self.base_urls[event.target]:
+            try:
+                response = await client.post(f"{base_url}{event.path}", json=event.payload)
+            except Exception as e:
+                error = f"{base_url}: {e}"
+                continue
+            if response.status_code < 300:
+                return None
+            return f"{base_url}: HTTP {response.status_code} {response.text[:200]}"
+        return error
@@ -0,0 +1,213 @@
+"""Statistical CPU profiler for a running worker, no extra packages needed.
+
+A background thread reads every thread's stack with sys._current_frames()
+at a fixed interval and counts identical stacks. The event loop thread is
+labelled `event-loop`, so coroutine code shows up under it while it runs.
+Samples whose innermost frame is waiting (selector, lock, queue) are left
+out unless idle samples are asked for, so the profile shows where CPU
+goes. The sampler holds the GIL for one stack walk per interval, so its
+cost grows with the sampling rate and the number of threads.
+
+Profiles come out as collapsed stacks (one `thread;outer;...;inner count`
+line per stack, for flamegraph.pl or speedscope) or as a speedscope JSON
+document. RollingProfiler keeps an always-on, low-rate profile of the
+last few minutes in per-minute buckets.
+"""
+import asyncio
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from fastapi import Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+
+from config import ADMIN_TOKEN, SERVICE_NAME
+
+MAX_DEPTH = 128
+
+# Innermost frames that mean a thread is blocked rather than running
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    # Executor workers (asyncio.to_thread) block in C waiting for work
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+    ("ssl.py", "read")
+}
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Dependency for admin endpoints: 404 unless ADMIN_TOKEN is set, 403 unless it matches"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def _stack(frame):
+    """(file, function, first line) of each frame, outermost first"""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        code = frame.f_code
+        stack.append((os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def sample_once(counts, loop_thread_id, skip_thread_ids, idle=False):
+    """Add the current stack of every thread but `skip_thread_ids` to `counts`"""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id in skip_thread_ids:
+            continue
+        stack = _stack(frame)
+        if not stack or (not idle and stack[-1][:2] in _IDLE_FRAMES):
+            continue
+        label = "event-loop" if thread_id == loop_thread_id else names.get(thread_id, f"thread-{thread_id}")
+        counts[(label, stack)] += 1
+
+
+def collapsed(counts):
+    """Collapsed stacks, heaviest first"""
+    lines = []
+    for (thread, stack), count in counts.most_common():
+        frames = ";".join(f"{function} ({file}:{line})" for file, function, line in stack)
+        lines.append(f"{thread};{frames} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def speedscope(counts, interval, name):
+    """A speedscope document with one sampled profile per thread"""
+    frames, frame_index, profiles = [], {}, {}
+    for (thread, stack), count in counts.most_common():
+        indexes = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame[1], "file": frame[0], "line": frame[2]})
+            indexes.append(frame_index[frame])
+        profile = profiles.setdefault(thread, {
+            "type": "sampled",
+            "name": thread,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": 0,
+            "samples": [],
+            "weights": []
+        })
+        profile["samples"].append(indexes)
+        profile["weights"].append(count * interval)
+        profile["endValue"] += count * interval
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": SERVICE_NAME,
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": sorted(profiles.values(), key=lambda profile: -profile["endValue"])
+    }
+
+
+def render_profile(counts, interval, format, name):
+    """Response with the profile as collapsed stacks or speedscope JSON"""
+    if format == "speedscope":
+        return JSONResponse(content=speedscope(counts, interval, name))
+    return Response(content=collapsed(counts), media_type="text/plain; charset=utf-8")
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval, loop_thread_id, idle, on_sample):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.loop_thread_id = loop_thread_id
+        self.idle = idle
+        self.on_sample = on_sample
+        self.stopped = threading.Event()
+        self.samples = 0
+
+    def run(self):
+        skip = {threading.get_ident()}
+        next_at = time.perf_counter()
+        while not self.stopped.is_set():
+            self.on_sample(lambda counts: sample_once(counts, self.loop_thread_id, skip, self.idle))
+            self.samples += 1
+            # Fixed schedule, so a slow walk does not stretch the interval
+            next_at += self.interval
+            self.stopped.wait(max(next_at - time.perf_counter(), 0))
+
+
+class Profiler:
+    """On-demand profiles, one at a time per worker"""
+
+    def __init__(self, max_seconds=60.0, min_interval=0.001):
+        self.max_seconds = max_seconds
+        self.min_interval = min_interval
+        self.running = False
+
+    async def profile(self, seconds, interval, idle=False):
+        """Sample for `seconds` while the loop keeps serving; return (counts, samples, interval)"""
+        seconds = min(seconds, self.max_seconds)
+        interval = max(interval, self.min_interval)
+        counts = Counter()
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        # A plain flag: everything here runs on the loop thread, and an asyncio.Lock
+        # built at import time would be bound to the wrong loop on Python 3.9
+        self.running = True
+        try:
+            sampler = _Sampler(interval, threading.get_ident(), idle, lambda sample: sample(counts))
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stopped.set()
+                await asyncio.to_thread(sampler.join)
+        finally:
+            self.running = False
+        return counts, sampler.samples, interval
+
+
+class RollingProfiler:
+    """Always-on, low-rate profile of the last `window_seconds`, kept in per-minute buckets"""
+
+    def __init__(self, interval=0.1, window_seconds=600, idle=False):
+        self.interval = interval
+        self.idle = idle
+        self._buckets = deque(maxlen=max(int(window_seconds // 60), 1))
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self):
+        if self._sampler is None:
+            # Started from the lifespan, so this is the event loop thread
+            self._sampler = _Sampler(self.interval, threading.get_ident(), self.idle, self._record)
+            self._sampler.start()
+
+    def stop(self):
+        if self._sampler is not None:
+            self._sampler.stopped.set()
+            self._sampler.join(timeout=5)
+            self._sampler = None
+
+    def _record(self, sample):
+        minute = int(time.time() // 60)
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != minute:
+                self._buckets.append((minute, Counter()))
+            sample(self._buckets[-1][1])
+
+    def snapshot(self):
+        """Counts summed over the window; returns (counts, seconds covered)"""
+        total = Counter()
+        with self._lock:
+            buckets = list(self._buckets)
+            for _, counts in buckets:
+                total.update(counts)
+        covered = (buckets[-1][0] - buckets[0][0] + 1) * 60 if buckets else 0
+        return total, covered
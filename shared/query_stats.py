@@ -0,0 +1,116 @@
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from log import get_logger
+
+log = get_logger("queries")
+
+# Stats of the request being handled; None outside requests (background loops)
+_current = ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    __slots__ = ("queries", "seconds", "shapes")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        # Statement text -> executions; texts are already parameterized, so repeats are one shape
+        self.shapes = {}
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times, most frequent first"""
+        return sorted(
+            ((count, statement) for statement, count in self.shapes.items() if count >= threshold),
+            reverse=True
+        )
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        # Per connection, since one request may run statements on several at once
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("query_started")
+    if stats is None or not started:
+        return
+    stats.seconds += time.perf_counter() - started.pop()
+    stats.queries += 1
+    stats.shapes[statement] = stats.shapes.get(statement, 0) + 1
+
+
+def _failed(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    connection = exception_context.connection
+    started = connection.info.get("query_started") if connection is not None else None
+    if started:
+        started.pop()
+
+
+def instrument_engines(engines):
+    """Count statements and their time on each engine (sync or async) for the current request"""
+    for engine in engines:
+        engine = getattr(engine, "sync_engine", engine)
+        if not event.contains(engine, "before_cursor_execute", _before):
+            event.listen(engine, "before_cursor_execute", _before)
+            event.listen(engine, "after_cursor_execute", _after)
+            event.listen(engine, "handle_error", _failed)
+
+
+def _shorten(statement, limit=160):
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware that accounts the SQL each request runs.
+
+    Adds X-DB-Queries and X-DB-Time (milliseconds) response headers when
+    `headers` is set, logs requests that run more than `budget` statements,
+    and flags any statement repeated `repeat_threshold` times or more in one
+    request, the usual sign of a query inside a loop (N+1).
+    """
+
+    def __init__(self, app, budget=20, repeat_threshold=5, headers=True):
+        self.app = app
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_with_headers(message):
+            if self.headers and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-db-queries", str(stats.queries).encode()),
+                    (b"x-db-time", f"{stats.seconds * 1000:.1f}".encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+            self._report(scope, stats)
+
+    def _report(self, scope, stats):
+        route = getattr(scope.get("route"), "path", None) or scope["path"]
+        where = f"{scope['method']} {route}"
+        if stats.queries > self.budget:
+            log.warning("Request over its statement budget", route=where, queries=stats.queries,
+                        db_ms=round(stats.seconds * 1000, 1), budget=self.budget)
+        for count, statement in stats.repeated(self.repeat_threshold):
+            log.warning("Same statement repeated in one request, likely N+1", route=where, count=count,
+                        statement=_shorten(statement))
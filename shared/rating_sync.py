@@ -0,0 +1,68 @@
+"""Rating aggregates owned by user service and copied to the other services.
+
+User service folds each rating into the restaurant's or agent's
+rating_count, rating_sum and rating, then sends the new aggregates through
+its outbox: restaurants to restaurant service (catalog), agents to both
+restaurant service (dispatch scoring) and delivery agent service (agent
+stats and offers). Ratings are never edited, so a copy only moves forward
+in rating_count and a late or redelivered event cannot undo newer totals.
+"""
+from sqlalchemy import bindparam, update
+
+from outbox import enqueue
+
+RATINGS_SYNC_PATH = "/ratings/sync"
+
+# Aggregate kind -> outbox targets keeping a copy of it
+RATING_COPIES = {
+    "restaurants": ("restaurant",),
+    "agents": ("restaurant", "delivery"),
+}
+
+
+def aggregate_columns(model):
+    """Columns making up a sent aggregate, for RETURNING or SELECT"""
+    return (model.id, model.rating_count, model.rating_sum, model.rating)
+
+
+def _aggregate(row):
+    entity_id, count, total, rating = row
+    return {"id": entity_id, "rating_count": count, "rating_sum": total, "rating": str(rating)}
+
+
+def publish_ratings(db, restaurants=(), agents=()):
+    """Send updated aggregates, as (id, rating_count, rating_sum, rating) rows, in the caller's transaction"""
+    payloads = {}
+    for kind, rows in (("restaurants", restaurants), ("agents", agents)):
+        if not rows:
+            continue
+        aggregates = [_aggregate(row) for row in rows]
+        for target in RATING_COPIES[kind]:
+            payloads.setdefault(target, {})[kind] = aggregates
+    for target, payload in payloads.items():
+        enqueue(db, target, RATINGS_SYNC_PATH, payload)
+
+
+async def apply_ratings(db, model, aggregates):
+    """Copy aggregates sent by user service onto `model`'s rows, skipping older ones"""
+    if not aggregates:
+        return
+    table = model.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.id == bindparam("entity_id"), table.c.rating_count <= bindparam("new_count"))
+        .values(
+            rating_count=bindparam("new_count"),
+            rating_sum=bindparam("new_sum"),
+            rating=bindparam("new_rating")
+        ),
+        [
+            {
+                "entity_id": aggregate.id,
+                "new_count": aggregate.rating_count,
+                "new_sum": aggregate.rating_sum,
+                "new_rating": aggregate.rating
+            }
+            for aggregate in aggregates
+        ]
+    )
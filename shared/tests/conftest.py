@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Run from a service directory (python -m pytest tests ../shared/tests), so the
+# shared modules import that service's config, database and models
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
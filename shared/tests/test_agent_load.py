@@ -0,0 +1,24 @@
+from agent_load import is_active, load_changes
+
+
+def test_is_active():
+    assert is_active("accepted") and is_active("picked_up")
+    assert not is_active("delivered") and not is_active("cancelled") and not is_active(None)
+
+
+def test_load_changes():
+    before = {1: (7, "accepted"), 2: (7, "picked_up"), 3: (8, "accepted"), 4: (9, "delivered")}
+    after = {
+        1: (7, "delivered"),   # frees a slot on 7
+        2: (8, "picked_up"),   # moves from 7 to 8
+        3: (8, "picked_up"),   # still on 8
+        4: (9, "delivered"),   # was already finished
+        5: (9, "accepted")     # new here
+    }
+    assert load_changes(before, after) == {7: -2, 8: 1, 9: 1}
+
+
+def test_moves_that_cancel_out_are_dropped():
+    before = {1: (7, "accepted"), 2: (8, "accepted")}
+    after = {1: (8, "accepted"), 2: (7, "accepted")}
+    assert load_changes(before, after) == {}
@@ -0,0 +1,8 @@
+from geo import haversine_km
+
+
+def test_haversine():
+    assert haversine_km(12.97, 77.59, 12.97, 77.59) == 0
+    # One degree of latitude
+    assert abs(haversine_km(0, 0, 1, 0) - 111.195) < 0.01
+    assert abs(haversine_km(12.97, 77.59, 13.08, 80.27) - haversine_km(13.08, 80.27, 12.97, 77.59)) < 1e-9
@@ -0,0 +1,41 @@
+from metrics import Counter, Gauge, Histogram
+
+
+def test_counter_renders_labels_and_escapes_them():
+    counter = Counter("requests_total", "Requests", ["route", "status"])
+    counter.inc("/orders", "200")
+    counter.inc("/orders", "200", amount=2)
+    counter.inc('/a"b\\c', "500")
+    assert counter.render() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="/orders",status="200"} 3',
+        'requests_total{route="/a\\"b\\\\c",status="500"} 1'
+    ]
+
+
+def test_counter_without_labels():
+    counter = Counter("dropped_total", "Dropped")
+    counter.inc()
+    assert counter.render()[-1] == "dropped_total 1"
+
+
+def test_gauge_adds_collected_values():
+    gauge = Gauge("in_flight", "In flight", ["pool"], collect=lambda: {("async",): 4})
+    gauge.inc("sync")
+    gauge.inc("sync")
+    gauge.dec("sync")
+    assert gauge.render()[2:] == ['in_flight{pool="sync"} 1', 'in_flight{pool="async"} 4']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency", ["route"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "/orders")
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{route="/orders",le="0.1"} 2',
+        'latency_seconds_bucket{route="/orders",le="1.0"} 3',
+        'latency_seconds_bucket{route="/orders",le="+Inf"} 4',
+        'latency_seconds_sum{route="/orders"} 3.65',
+        'latency_seconds_count{route="/orders"} 4'
+    ]
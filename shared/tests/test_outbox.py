@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import outbox
+from config import OUTBOX_BACKOFF_BASE, OUTBOX_MAX_BACKOFF
+from models import OutboxEvent
+
+
+class _Result:
+    def __init__(self, events):
+        self.events = events
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.events
+
+
+class _Session:
+    """Stands in for AsyncSessionLocal(): hands out the given events and records the commit"""
+
+    def __init__(self, events):
+        self.events = events
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement):
+        return _Result(self.events)
+
+    async def commit(self):
+        self.committed = True
+
+
+def _event(event_id, attempts=0):
+    return OutboxEvent(
+        id=event_id,
+        source="user-service",
+        target="restaurant",
+        path="/orders/notify",
+        payload={"order_id": event_id},
+        attempts=attempts,
+        next_attempt_at=datetime.utcnow(),
+        created_at=datetime.utcnow()
+    )
+
+
+def _dispatch(monkeypatch, events, errors):
+    session = _Session(events)
+    monkeypatch.setattr(outbox, "AsyncSessionLocal", lambda: session)
+    dispatcher = outbox.OutboxDispatcher({"restaurant": ("http://primary", "http://fallback")})
+
+    async def post(event):
+        return errors[event.id]
+
+    monkeypatch.setattr(dispatcher, "_post", post)
+    claimed = asyncio.run(dispatcher.dispatch_batch())
+    assert session.committed == bool(events)
+    return claimed
+
+
+def test_delivered_events_are_marked(monkeypatch):
+    event = _event(1, attempts=2)
+    event.last_error = "earlier failure"
+    assert _dispatch(monkeypatch, [event], {1: None}) == 1
+    assert event.attempts == 3
+    assert event.delivered_at is not None
+    assert event.last_error is None
+
+
+def test_failed_events_back_off_exponentially(monkeypatch):
+    events = [_event(1, attempts=0), _event(2, attempts=3), _event(3, attempts=20)]
+    before = datetime.utcnow()
+    _dispatch(monkeypatch, events, {1: "boom", 2: "boom", 3: "x" * 5000})
+    after = datetime.utcnow()
+
+    for event in events:
+        assert event.delivered_at is None
+        backoff = min(OUTBOX_BACKOFF_BASE * 2 ** event.attempts, OUTBOX_MAX_BACKOFF)
+        # Jittered between half and all of the backoff
+        assert before + timedelta(seconds=backoff * 0.5) <= event.next_attempt_at
+        assert event.next_attempt_at <= after + timedelta(seconds=backoff)
+    assert [event.attempts for event in events] == [1, 4, 21]
+    assert events[0].last_error == "boom"
+    assert len(events[2].last_error) == 1000
+
+
+def test_empty_batch(monkeypatch):
+    assert _dispatch(monkeypatch, [], {}) == 0
+
+
+class _Response:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class _Client:
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.urls = []
+
+    async def post(self, url, json):
+        self.urls.append(url)
+        outcome = self.outcomes[len(self.urls) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _post(monkeypatch, outcomes):
+    client = _Client(outcomes)
+    monkeypatch.setattr(outbox, "get_client", lambda name: client)
+    dispatcher = outbox.OutboxDispatcher({"restaurant": ("http://primary", "http://fallback")})
+    return asyncio.run(dispatcher._post(_event(1))), client.urls
+
+
+def test_post_falls_back_when_the_primary_is_unreachable(monkeypatch):
+    error, urls = _post(monkeypatch, [ConnectionError("refused"), _Response(200)])
+    assert error is None
+    assert urls == ["http://primary/orders/notify", "http://fallback/orders/notify"]
+
+
+def test_post_reports_error_responses_without_falling_back(monkeypatch):
+    error, urls = _post(monkeypatch, [_Response(500, "oops")])
+    assert error == "http://primary: HTTP 500 oops"
+    assert urls == ["http://primary/orders/notify"]
+
+
+def test_post_reports_the_last_connection_error(monkeypatch):
+    error, urls = _post(monkeypatch, [ConnectionError("one"), ConnectionError("two")])
+    assert error == "http://fallback: two"
+    assert len(urls) == 2
+
+
+def test_events_out_of_attempts_are_abandoned(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    abandoned = outbox.outbox_abandoned._values.get(("restaurant", "/orders/notify"), 0)
+    events = [_event(1, attempts=1), _event(2, attempts=2)]
+    _dispatch(monkeypatch, events, {1: "boom", 2: "boom"})
+    assert [event.attempts for event in events] == [2, 3]
+    assert events[1].delivered_at is None and events[1].last_error == "boom"
+    assert outbox.outbox_abandoned._values[("restaurant", "/orders/notify")] == abandoned + 1
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from rating_sync import RATINGS_SYNC_PATH, publish_ratings
+
+
+class FakeSession:
+    def __init__(self):
+        self.added = []
+
+    def add(self, event):
+        self.added.append(event)
+
+
+def test_aggregates_go_to_the_services_that_copy_them():
+    db = FakeSession()
+    publish_ratings(db, restaurants=[(3, 4, 17, Decimal("4.25"))], agents=[(7, 1, 5, Decimal("5.00"))])
+
+    sent = {event.target: event.payload for event in db.added}
+    assert {event.path for event in db.added} == {RATINGS_SYNC_PATH}
+    assert sent["restaurant"] == {
+        "restaurants": [{"id": 3, "rating_count": 4, "rating_sum": 17, "rating": "4.25"}],
+        "agents": [{"id": 7, "rating_count": 1, "rating_sum": 5, "rating": "5.00"}]
+    }
+    assert sent["delivery"] == {"agents": [{"id": 7, "rating_count": 1, "rating_sum": 5, "rating": "5.00"}]}
+
+
+def test_restaurant_ratings_are_not_sent_to_delivery():
+    db = FakeSession()
+    publish_ratings(db, restaurants=[(3, 1, 4, Decimal("4.00"))])
+    assert [event.target for event in db.added] == ["restaurant"]
+
+
+def test_nothing_is_sent_without_aggregates():
+    db = FakeSession()
+    publish_ratings(db)
+    assert db.added == []
@@ -0,0 +1,54 @@
+from tracing import Tracer, parse_traceparent
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+
+
+def test_parse_valid_header():
+    assert parse_traceparent(f"00-{TRACE_ID}-{SPAN_ID}-01") == (TRACE_ID, SPAN_ID, True)
+    assert parse_traceparent(f"00-{TRACE_ID}-{SPAN_ID}-00") == (TRACE_ID, SPAN_ID, False)
+
+
+def test_parse_is_case_and_space_insensitive():
+    assert parse_traceparent(f"  00-{TRACE_ID.upper()}-{SPAN_ID.upper()}-01 ") == (TRACE_ID, SPAN_ID, True)
+
+
+def test_parse_accepts_later_versions_with_extra_fields():
+    assert parse_traceparent(f"01-{TRACE_ID}-{SPAN_ID}-03-extra") == (TRACE_ID, SPAN_ID, True)
+
+
+def test_parse_rejects_malformed_headers():
+    for value in (
+        None,
+        "",
+        "garbage",
+        f"ff-{TRACE_ID}-{SPAN_ID}-01",
+        f"00-{TRACE_ID[:-1]}-{SPAN_ID}-01",
+        f"00-{TRACE_ID}-{SPAN_ID}0-01",
+        f"00-{TRACE_ID}-{SPAN_ID}-1",
+        f"00-{'z' * 32}-{SPAN_ID}-01",
+        f"00-{TRACE_ID}-{SPAN_ID}-zz",
+        f"00-{'0' * 32}-{SPAN_ID}-01",
+        f"00-{TRACE_ID}-{'0' * 16}-01"
+    ):
+        assert parse_traceparent(value) is None, value
+
+
+def test_span_header_round_trips():
+    tracer = Tracer(sample_rate=1.0)
+    span = tracer.start_span("work", traceparent=f"00-{TRACE_ID}-{SPAN_ID}-01")
+    assert span.trace_id == TRACE_ID
+    assert span.parent_id == SPAN_ID
+    trace_id, parent_id, sampled = parse_traceparent(span.traceparent())
+    assert (trace_id, parent_id, sampled) == (TRACE_ID, span.span_id, True)
+
+
+def test_unsampled_spans_are_not_kept():
+    tracer = Tracer(sample_rate=1.0)
+    with tracer.span("kept", traceparent=f"00-{TRACE_ID}-{SPAN_ID}-01"):
+        pass
+    other = "a" * 32
+    with tracer.span("dropped", traceparent=f"00-{other}-{SPAN_ID}-00"):
+        pass
+    assert [span["name"] for span in tracer.trace(TRACE_ID)] == ["kept"]
+    assert tracer.trace(other) == []
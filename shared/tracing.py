@@ -0,0 +1,308 @@
+"""Distributed tracing with W3C traceparent propagation and a local exporter.
+
+Each request gets a server span (continuing the caller's trace when a
+`traceparent` header comes in), outbound httpx calls get client spans and
+carry the header on, and SQL statements become child spans. Outbox events
+store the traceparent of the request that wrote them, so deferred
+hand-offs stay in the same trace. Finished spans are kept in a ring buffer
+served on /traces and, when TRACING_FILE is set, appended as JSON lines
+by a background thread; trace_report.py at the repo root merges the files
+of all services into per-hop timings.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from sqlalchemy import event
+
+from config import (
+    SERVICE_NAME,
+    TRACING_ENABLED,
+    TRACING_SAMPLE_RATE,
+    TRACING_BUFFER_TRACES,
+    TRACING_FILE
+)
+
+_current = ContextVar("trace_span", default=None)
+
+
+def _hex_id(length):
+    return os.urandom(length // 2).hex()
+
+
+def parse_traceparent(value):
+    """Return (trace_id, parent_span_id, sampled) from a traceparent header, or None"""
+    if not value:
+        return None
+    parts = value.strip().lower().split("-")
+    if len(parts) < 4 or parts[0] == "ff" or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled", "start", "end", "attributes", "error")
+
+    def __init__(self, trace_id, parent_id, name, kind, sampled, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = _hex_id(16)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": SERVICE_NAME,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+
+class Tracer:
+    """Creates spans and keeps the finished ones of the last `buffer_traces` traces"""
+
+    def __init__(self, sample_rate=1.0, buffer_traces=500, path=None):
+        self.sample_rate = sample_rate
+        self.buffer_traces = buffer_traces
+        self.path = path
+        self.dropped = 0
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=10000)
+        self._writer = None
+
+    def start(self):
+        if self.path and self._writer is None:
+            self._writer = threading.Thread(target=self._write, name="span-writer", daemon=True)
+            self._writer.start()
+
+    def stop(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout=5)
+            self._writer = None
+
+    def start_span(self, name, kind="internal", parent=None, traceparent=None, **attributes):
+        """Child of `parent`, else of the incoming `traceparent`, else of the current span, else a new root"""
+        if parent is None and not traceparent:
+            parent = _current.get()
+        if parent is not None:
+            return Span(parent.trace_id, parent.span_id, name, kind, parent.sampled, attributes)
+        incoming = parse_traceparent(traceparent)
+        if incoming is not None:
+            trace_id, parent_id, sampled = incoming
+            return Span(trace_id, parent_id, name, kind, sampled, attributes)
+        return Span(_hex_id(32), None, name, kind, random.random() < self.sample_rate, attributes)
+
+    def finish(self, span):
+        span.end = time.time()
+        if not span.sampled:
+            return
+        record = span.to_dict()
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = []
+                if len(self._traces) > self.buffer_traces:
+                    self._traces.popitem(last=False)
+            spans.append(record)
+        # The file is written off the request path; a full queue drops spans rather than blocking
+        if self._writer is not None:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    @contextmanager
+    def span(self, name, kind="internal", traceparent=None, **attributes):
+        """Run a block as a span and make it the current one"""
+        span = self.start_span(name, kind, traceparent=traceparent, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            self.finish(span)
+
+    def trace(self, trace_id):
+        with self._lock:
+            return list(self._traces.get(trace_id, ()))
+
+    def recent(self, limit=20):
+        """Newest traces first, each summarized by its earliest span seen here"""
+        with self._lock:
+            traces = list(self._traces.items())[-limit:]
+        summaries = []
+        for trace_id, spans in reversed(traces):
+            first = min(spans, key=lambda span: span["start"])
+            summaries.append({
+                "trace_id": trace_id,
+                "name": first["name"],
+                "start": first["start"],
+                "duration_ms": first["duration_ms"],
+                "spans": len(spans)
+            })
+        return summaries
+
+    def _write(self):
+        with open(self.path, "a", buffering=1) as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+tracer = Tracer(
+    sample_rate=TRACING_SAMPLE_RATE,
+    buffer_traces=TRACING_BUFFER_TRACES,
+    path=TRACING_FILE or None
+)
+
+
+def current_traceparent():
+    """traceparent of the current span, to store with work that continues later"""
+    span = _current.get()
+    return span.traceparent() if span is not None and TRACING_ENABLED else None
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace_id if span is not None else None
+
+
+def annotate(**attributes):
+    """Attach attributes (e.g. order_id) to the current span"""
+    span = _current.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if parent is not None and parent.sampled:
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+        span = tracer.start_span(f"db {operation}", "client", parent=parent, statement=" ".join(statement.split())[:300])
+        conn.info.setdefault("trace_spans", []).append(span)
+
+
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        tracer.finish(spans.pop())
+
+
+def _failed_statement(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.error = type(exception_context.original_exception).__name__
+        tracer.finish(span)
+
+
+def instrument_engines(engines):
+    """Record a span per SQL statement run inside a sampled trace"""
+    for engine in engines:
+        engine = getattr(engine, "sync_engine", engine)
+        if not event.contains(engine, "before_cursor_execute", _before_statement):
+            event.listen(engine, "before_cursor_execute", _before_statement)
+            event.listen(engine, "after_cursor_execute", _after_statement)
+            event.listen(engine, "handle_error", _failed_statement)
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per request and continuing incoming traces"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                incoming = value.decode("latin-1")
+                break
+        span = tracer.start_span(f"{scope['method']} {scope['path']}", "server", traceparent=incoming)
+        token = _current.set(span)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", span.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                span.name = f"{scope['method']} {route}"
+            tracer.finish(span)
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """httpx transport that sends the traceparent on and records a client span per call"""
+
+    def __init__(self, service, transport):
+        self.service = service
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        if not TRACING_ENABLED or _current.get() is None:
+            return await self.transport.handle_async_request(request)
+
+        span = tracer.start_span(f"{request.method} {self.service}{request.url.path}", "client")
+        request.headers["traceparent"] = span.traceparent()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            tracer.finish(span)
+            raise
+        span.attributes["http.status_code"] = response.status_code
+        tracer.finish(span)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
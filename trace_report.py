@@ -0,0 +1,91 @@
+"""Break order latency down per hop from the span files the services write.
+
+Each service appends finished spans to TRACING_FILE as JSON lines. This
+merges those files and, for every order, walks the spans tagged with its
+order_id in time order: place_order, the outbox wait and delivery to the
+restaurant, accept_order (a separate trace, started by the restaurant),
+and the assignment delivered to the delivery agent service. Server and
+outbox spans are the hops; SQL and client spans below them are summed as
+database and downstream time.
+
+Usage: python trace_report.py user.jsonl restaurant.jsonl delivery.jsonl [--order 42] [--limit 20]
+"""
+import argparse
+import json
+from collections import defaultdict
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        # The last line may be cut short if a service stopped mid-write
+                        continue
+    return spans
+
+
+def hops_by_order(spans):
+    """order_id -> spans that start a hop (server and outbox spans), in start order"""
+    children = defaultdict(list)
+    for span in spans:
+        if span.get("parent_id"):
+            children[span["parent_id"]].append(span)
+
+    orders = defaultdict(list)
+    for span in spans:
+        order_id = span.get("attributes", {}).get("order_id")
+        if order_id is None or span["kind"] not in ("server", "producer"):
+            continue
+        db_ms = client_ms = 0.0
+        for child in children.get(span["span_id"], ()):
+            if child["name"].startswith("db "):
+                db_ms += child["duration_ms"]
+            elif child["kind"] == "client":
+                client_ms += child["duration_ms"]
+        orders[str(order_id)].append(dict(span, db_ms=db_ms, client_ms=client_ms))
+    for hops in orders.values():
+        hops.sort(key=lambda hop: hop["start"])
+    return orders
+
+
+def print_order(order_id, hops):
+    first = hops[0]["start"]
+    last = max(hop["start"] + hop["duration_ms"] / 1000 for hop in hops)
+    print(f"order {order_id}: {(last - first) * 1000:.1f}ms end to end over {len({hop['trace_id'] for hop in hops})} trace(s)")
+    for hop in hops:
+        offset = (hop["start"] - first) * 1000
+        detail = f"db {hop['db_ms']:.1f}ms, downstream {hop['client_ms']:.1f}ms"
+        delay = hop["attributes"].get("outbox.delay_ms")
+        if delay is not None:
+            detail += f", waited {delay:.1f}ms in outbox"
+        error = f"  ERROR {hop['error']}" if hop.get("error") else ""
+        print(f"  +{offset:9.1f}ms  {hop['duration_ms']:8.1f}ms  {hop['service']:<24} {hop['name']:<40} ({detail}){error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-hop latency of orders from span files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--order", help="only this order id")
+    parser.add_argument("--limit", type=int, default=20, help="most recent orders to show")
+    args = parser.parse_args()
+
+    orders = hops_by_order(load_spans(args.files))
+    if args.order:
+        if args.order not in orders:
+            raise SystemExit(f"No spans for order {args.order}")
+        print_order(args.order, orders[args.order])
+        return
+
+    recent = sorted(orders.items(), key=lambda item: item[1][0]["start"])[-args.limit:]
+    for order_id, hops in recent:
+        print_order(order_id, hops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from models import Restaurant, MenuItem
+from schemas import RestaurantWithMenuResponse
+
+
+class CatalogCache:
+    """In-memory, versioned snapshot of the online restaurant catalog.
+
+    Each restaurant is kept as a pre-rendered JSON fragment and the snapshot is
+    the fragments joined into one JSON array, so reads are served as bytes
+    without touching the database or running response validation.
+    Restaurant service tells us when a restaurant changes (through its outbox,
+    so failed calls are retried), which marks that restaurant dirty; the next
+    read patches only the dirty entries. The TTL is a safety net for
+    invalidations that reach another worker or arrive late.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entries = {}
+        self._snapshot = None
+        self._built_at = 0.0
+        self._dirty = set()
+        self._full_rebuild = True
+        # Guards _dirty/_full_rebuild; held only for a few instructions
+        self._state_lock = threading.Lock()
+        # Serializes rebuilds so a miss under load hits the database once
+        self._rebuild_lock = threading.Lock()
+
+    def invalidate(self, restaurant_id=None):
+        """Mark one restaurant (or the whole catalog) as stale"""
+        with self._state_lock:
+            if restaurant_id is None:
+                self._full_rebuild = True
+            else:
+                self._dirty.add(restaurant_id)
+
+    def _is_fresh(self):
+        return (
+            self._snapshot is not None
+            and not self._full_rebuild
+            and not self._dirty
+            and time.monotonic() - self._built_at < self.ttl_seconds
+        )
+
+    def get(self, db):
+        """Return (version, JSON body), rebuilding at most once per miss"""
+        if self._is_fresh():
+            return self.version, self._snapshot
+
+        with self._rebuild_lock:
+            # Another thread may have rebuilt while we were waiting
+            if self._is_fresh():
+                return self.version, self._snapshot
+
+            with self._state_lock:
+                expired = time.monotonic() - self._built_at >= self.ttl_seconds
+                full = self._full_rebuild or self._snapshot is None or expired
+                dirty = self._dirty
+                self._dirty = set()
+                self._full_rebuild = False
+
+            try:
+                if full:
+                    self._entries = self._load(db)
+                    self._built_at = time.monotonic()
+                else:
+                    entries = dict(self._entries)
+                    for restaurant_id in dirty:
+                        entries.pop(restaurant_id, None)
+                    entries.update(self._load(db, dirty))
+                    self._entries = entries
+            except Exception:
+                # Put the work back so the next reader retries it
+                with self._state_lock:
+                    self._full_rebuild = self._full_rebuild or full
+                    self._dirty |= dirty
+                raise
+
+            fragments = [self._entries[key] for key in sorted(self._entries)]
+            self._snapshot = b"[" + b",".join(fragments) + b"]"
+            self.version += 1
+            return self.version, self._snapshot
+
+    def _load(self, db, restaurant_ids=None):
+        """Load and render online restaurants with available menu items in two queries"""
+        query = db.query(Restaurant).filter(Restaurant.is_online == True)
+        if restaurant_ids is not None:
+            query = query.filter(Restaurant.id.in_(restaurant_ids))
+        restaurants = query.all()
+        if not restaurants:
+            return {}
+
+        entries = {}
+        for restaurant in restaurants:
+            entries[restaurant.id] = {
+                "id": restaurant.id,
+                "name": restaurant.name,
+                "address": restaurant.address,
+                "phone": restaurant.phone,
+                "cuisine_type": restaurant.cuisine_type,
+                "is_online": restaurant.is_online,
+                "rating": restaurant.rating,
+                "menu_items": []
+            }
+
+        menu_items = db.query(MenuItem).filter(
+            MenuItem.restaurant_id.in_(list(entries)),
+            MenuItem.is_available == True
+        ).order_by(MenuItem.id).all()
+
+        for item in menu_items:
+            entries[item.restaurant_id]["menu_items"].append({
+                "id": item.id,
+                "name": item.name,
+                "description": item.description,
+                "price": item.price,
+                "is_available": item.is_available,
+                "category": item.category
+            })
+
+        return {
+            restaurant_id: RestaurantWithMenuResponse.model_validate(entry).model_dump_json().encode()
+            for restaurant_id, entry in entries.items()
+        }
@@ -2,28 +2,47 @@ import os
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.schema import CreateSchema
-from config import DATABASE_URL, DB_SCHEMA
+from config import (
+    DATABASE_URL,
+    DB_SCHEMA,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING
+)
 
 # Handle special case for Heroku PostgreSQL
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
+# Engines connect lazily: nothing here touches the database at import time
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING
+}
+engine = create_engine(DATABASE_URL, **POOL_OPTIONS)
 
-# Try to create schema if it doesn't exist
-try:
-    conn = engine.connect()
-    if not conn.dialect.has_schema(conn, DB_SCHEMA):
-        conn.execute(CreateSchema(DB_SCHEMA))
-        conn.commit()
-    conn.close()
-except Exception as e:
-    print(f"Note: Schema creation handled at startup: {e}")
+# Async engine (asyncpg) for endpoints that run on the event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_OPTIONS)
+
+def ensure_schema():
+    """Create the service's schema if it doesn't exist (run from the lifespan warm-up)"""
+    with engine.connect() as conn:
+        if not conn.dialect.has_schema(conn, DB_SCHEMA):
+            conn.execute(CreateSchema(DB_SCHEMA))
+            conn.commit()
 
 # Create metadata with schema
 metadata = MetaData(schema=DB_SCHEMA)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base(metadata=metadata)
 
 def get_db():
@@ -32,3 +51,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_engines():
+    """Close pooled connections on shutdown"""
+    await async_engine.dispose()
+    engine.dispose()
@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from log import get_logger
+from models import Order
+
+log = get_logger("events")
+
+# Statuses after which an order stream has nothing more to say
+FINAL_STATUSES = ("delivered", "cancelled", "rejected")
+
+
+def order_event(order):
+    """Status event payload for an order row"""
+    return {
+        "order_id": order.id,
+        "version": order.version,
+        "status": order.status,
+        "delivery_agent_id": order.delivery_agent_id,
+        "updated_at": order.updated_at.isoformat() if order.updated_at else None
+    }
+
+
+def format_sse(event):
+    """Encode a status event as one server-sent event frame"""
+    return f"id: {event['version']}\nevent: status\ndata: {json.dumps(event)}\n\n".encode()
+
+
+class OrderEventBroker:
+    """In-process fan-out of order status changes to open event streams.
+
+    Each stream owns a small bounded queue; publishing never blocks, and a
+    slow reader loses its oldest queued events rather than holding memory
+    (the newest status is what matters). Events are deduplicated by order
+    version. Status updates arrive at whichever worker the caller hit, so a
+    background task also re-reads the versions of watched orders every few
+    seconds, in one query per chunk, and publishes anything newer; streams
+    on other workers therefore lag by at most that interval.
+    """
+
+    def __init__(self, queue_size=16, resync_seconds=5.0):
+        self.queue_size = queue_size
+        self.resync_seconds = resync_seconds
+        self._subscribers = {}
+        self._versions = {}
+        self._task = None
+
+    def __len__(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, order_id, version):
+        """Open a queue of status events for an order currently at `version`"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(order_id, set()).add(queue)
+        self._versions[order_id] = max(self._versions.get(order_id, 0), version)
+        return queue
+
+    def unsubscribe(self, order_id, queue):
+        queues = self._subscribers.get(order_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[order_id]
+            self._versions.pop(order_id, None)
+
+    def publish(self, event):
+        """Hand an event to every stream of its order; return False if it is stale"""
+        order_id = event["order_id"]
+        queues = self._subscribers.get(order_id)
+        if not queues or event["version"] <= self._versions.get(order_id, 0):
+            return False
+        self._versions[order_id] = event["version"]
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resync_seconds)
+            try:
+                await self.resync()
+            except Exception as e:
+                log.error("Failed to resync watched orders", error=str(e))
+
+    async def resync(self, chunk_size=500):
+        """Publish changes to watched orders that this worker was not told about"""
+        order_ids = list(self._subscribers)
+        if not order_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(order_ids), chunk_size):
+                chunk = order_ids[start:start + chunk_size]
+                orders = (await db.execute(
+                    select(
+                        Order.id,
+                        Order.version,
+                        Order.status,
+                        Order.delivery_agent_id,
+                        Order.updated_at
+                    ).where(Order.id.in_(chunk))
+                )).all()
+                for order in orders:
+                    self.publish(order_event(order))
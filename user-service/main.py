@@ -1,213 +1,484 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session, joinedload
+import os
+import sys
+
+# Modules shared by the three services (metrics, tracing, logging, ...) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import exists, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 from typing import List
-import httpx
 from decimal import Decimal
+from datetime import datetime
 
-from database import get_db
-from models import Restaurant, MenuItem, Order, OrderItem, OrderRating, AgentRating, User
+from catalog_cache import CatalogCache
+from config import (
+    CATALOG_CACHE_TTL_SECONDS,
+    RESTAURANT_SERVICE_URL,
+    RESTAURANT_SERVICE_DOCKER_URL,
+    DELIVERY_SERVICE_URL,
+    DELIVERY_SERVICE_DOCKER_URL,
+    ORDER_EVENTS_QUEUE_SIZE,
+    ORDER_EVENTS_RESYNC_SECONDS,
+    ORDER_EVENTS_HEARTBEAT_SECONDS,
+    RATINGS_WRITE_BEHIND,
+    RATINGS_FLUSH_SECONDS,
+    RATINGS_MAX_PENDING,
+    DB_POOL_WARM_CONNECTIONS,
+    STARTUP_BUDGET_SECONDS,
+    READINESS_PROBE_SECONDS,
+    READINESS_PROBE_TIMEOUT,
+    READINESS_MAX_POOL_USAGE,
+    METRICS_ENABLED,
+    QUERY_STATS_ENABLED,
+    QUERY_STATS_HEADERS,
+    QUERY_BUDGET,
+    QUERY_REPEAT_THRESHOLD,
+    TRACING_ENABLED,
+    TRACING_DB_SPANS,
+    PROFILER_MAX_SECONDS,
+    PROFILER_ROLLING_ENABLED,
+    PROFILER_ROLLING_INTERVAL_MS,
+    PROFILER_ROLLING_WINDOW_SECONDS
+)
+from database import get_db, get_async_db, AsyncSessionLocal, dispose_engines, engine, async_engine
+from events import OrderEventBroker, FINAL_STATUSES, format_sse, order_event
+from health import ServiceHealth
+from http_clients import open_clients, close_clients
+from log import RequestContextMiddleware, bind, start_logging, stop_logging
+from metrics import CONTENT_TYPE, MetricsMiddleware, instrument_engines, render as render_metrics
+from models import Restaurant, MenuItem, Order, OrderItem, OrderRating, AgentRating, User, DeliveryAgent
+from outbox import OutboxDispatcher, enqueue
+from profiler import Profiler, RollingProfiler, render_profile, require_admin
+from query_stats import QueryStatsMiddleware, instrument_engines as instrument_queries
+from rating_writer import DUPLICATE, QUEUED, RatingWriter
+from rating_sync import publish_ratings
+from ratings import AGENT_RATING_KEY, ORDER_RATING_KEY, add_to_rating, insert_rating, rating_exists
 from schemas import (
     RestaurantResponse, 
     RestaurantWithMenuResponse, 
+    CatalogInvalidation,
     OrderCreate, 
+    OrderItemSnapshot,
     OrderResponse, 
+    OrderSnapshot,
+    OrderStatusBatch,
     RatingCreate, 
     RatingResponse
 )
+from tracing import TracingMiddleware, instrument_engines as instrument_tracing, tracer
+
+outbox_dispatcher = OutboxDispatcher({
+    "restaurant": (RESTAURANT_SERVICE_URL, RESTAURANT_SERVICE_DOCKER_URL),
+    "delivery": (DELIVERY_SERVICE_URL, DELIVERY_SERVICE_DOCKER_URL)
+})
+order_events = OrderEventBroker(
+    queue_size=ORDER_EVENTS_QUEUE_SIZE,
+    resync_seconds=ORDER_EVENTS_RESYNC_SECONDS
+)
+
+catalog_cache = CatalogCache(ttl_seconds=CATALOG_CACHE_TTL_SECONDS)
+rating_writer = RatingWriter(
+    flush_seconds=RATINGS_FLUSH_SECONDS,
+    max_pending=RATINGS_MAX_PENDING,
+    on_restaurants_rated=catalog_cache.invalidate,
+    on_published=outbox_dispatcher.notify
+) if RATINGS_WRITE_BEHIND else None
 
-app = FastAPI(title="User Service", description="Food Delivery User Service API", version="1.0.0")
+profiler = Profiler(max_seconds=PROFILER_MAX_SECONDS)
+rolling_profiler = RollingProfiler(
+    interval=PROFILER_ROLLING_INTERVAL_MS / 1000,
+    window_seconds=PROFILER_ROLLING_WINDOW_SECONDS
+) if PROFILER_ROLLING_ENABLED else None
+
+service_health = ServiceHealth(
+    startup_budget=STARTUP_BUDGET_SECONDS,
+    warm_connections=DB_POOL_WARM_CONNECTIONS,
+    probe_seconds=READINESS_PROBE_SECONDS,
+    probe_timeout=READINESS_PROBE_TIMEOUT,
+    max_pool_usage=READINESS_MAX_POOL_USAGE
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    service_health.start()
+    tracer.start()
+    if rolling_profiler is not None:
+        rolling_profiler.start()
+    open_clients(["restaurant"])
+    outbox_dispatcher.start()
+    order_events.start()
+    if rating_writer is not None:
+        rating_writer.start()
+    yield
+    if rating_writer is not None:
+        await rating_writer.stop()
+    await order_events.stop()
+    await outbox_dispatcher.stop()
+    await close_clients()
+    await service_health.stop()
+    await dispose_engines()
+    if rolling_profiler is not None:
+        rolling_profiler.stop()
+    tracer.stop()
+    stop_logging()
+
+app = FastAPI(title="User Service", description="Food Delivery User Service API", version="1.0.0", lifespan=lifespan)
+
+if QUERY_STATS_ENABLED:
+    app.add_middleware(
+        QueryStatsMiddleware,
+        budget=QUERY_BUDGET,
+        repeat_threshold=QUERY_REPEAT_THRESHOLD,
+        headers=QUERY_STATS_HEADERS
+    )
+    instrument_queries([engine, async_engine])
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    instrument_engines({"sync": engine, "async": async_engine})
+if TRACING_ENABLED:
+    # Added last so it is outermost and every other layer runs inside the request's span
+    app.add_middleware(TracingMiddleware)
+    if TRACING_DB_SPANS:
+        instrument_tracing([engine, async_engine])
+# Outermost, so every layer below logs with the request's id
+app.add_middleware(RequestContextMiddleware)
 
 @app.get("/", tags=["Health"])
 def health_check():
     return {"status": "User Service is running"}
 
+@app.get("/health/live", tags=["Health"])
+async def liveness():
+    """Liveness: the process is up and its event loop answers"""
+    return service_health.live()
+
+@app.get("/health/ready", tags=["Health"])
+async def readiness():
+    """Readiness: warmed up, database reachable (cached probe) and pools not saturated"""
+    ready, details = await service_health.ready()
+    return JSONResponse(status_code=200 if ready else 503, content=details)
+
+@app.get("/metrics", tags=["Health"])
+def get_metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/traces", tags=["Health"])
+def get_traces(limit: int = 20):
+    """Most recent traces this worker took part in"""
+    return {"traces": tracer.recent(limit), "dropped_spans": tracer.dropped}
+
+@app.get("/traces/{trace_id}", tags=["Health"])
+def get_trace(trace_id: str):
+    """Spans this worker recorded for one trace, in start order"""
+    spans = tracer.trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "spans": sorted(spans, key=lambda span: span["start"])}
+
+@app.get("/debug/profile", tags=["Debug"], dependencies=[Depends(require_admin)])
+async def get_profile(seconds: float = 10.0, interval_ms: float = 10.0, format: str = "collapsed", idle: bool = False):
+    """Sample this worker's threads and event loop for a few seconds (admin only)"""
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    counts, samples, interval = await profiler.profile(seconds, interval_ms / 1000, idle)
+    response = render_profile(counts, interval, format, f"user-service {seconds:g}s")
+    response.headers["X-Profile-Samples"] = str(samples)
+    return response
+
+@app.get("/debug/profile/rolling", tags=["Debug"], dependencies=[Depends(require_admin)])
+def get_rolling_profile(format: str = "collapsed"):
+    """Always-on low-rate profile of the last few minutes (admin only)"""
+    if rolling_profiler is None:
+        raise HTTPException(status_code=404, detail="Rolling profile is off (PROFILER_ROLLING_ENABLED)")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    counts, covered = rolling_profiler.snapshot()
+    return render_profile(counts, rolling_profiler.interval, format, f"user-service last {covered}s")
+
 @app.get("/restaurants", response_model=List[RestaurantWithMenuResponse], tags=["Restaurants"])
 def get_online_restaurants(db: Session = Depends(get_db)):
     """Get all restaurants that are currently online with their menu items"""
-    restaurants = db.query(Restaurant).options(
-        joinedload(Restaurant.menu_items)
-    ).filter(Restaurant.is_online == True).all()
-    
-    # Convert to response format
-    result = []
-    for restaurant in restaurants:
-        menu_items = db.query(MenuItem).filter(
-            MenuItem.restaurant_id == restaurant.id,
-            MenuItem.is_available == True
-        ).all()
-        
-        restaurant_dict = {
-            "id": restaurant.id,
-            "name": restaurant.name,
-            "address": restaurant.address,
-            "phone": restaurant.phone,
-            "cuisine_type": restaurant.cuisine_type,
-            "is_online": restaurant.is_online,
-            "rating": restaurant.rating,
-            "menu_items": menu_items
-        }
-        result.append(restaurant_dict)
-    
-    return result
+    version, body = catalog_cache.get(db)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"X-Catalog-Version": str(version)}
+    )
+
+@app.post("/catalog/invalidate", tags=["Catalog"])
+def invalidate_catalog(invalidation: CatalogInvalidation):
+    """Mark cached catalog entries stale after a restaurant-side change"""
+    catalog_cache.invalidate(invalidation.restaurant_id)
+    return {"message": "Catalog invalidated", "version": catalog_cache.version}
 
 @app.post("/orders", response_model=OrderResponse, tags=["Orders"])
-async def place_order(order_data: OrderCreate, db: Session = Depends(get_db)):
+async def place_order(order_data: OrderCreate, db: AsyncSession = Depends(get_async_db)):
     """Place a new order"""
     
-    # Verify user exists
-    user = db.query(User).filter(User.id == order_data.user_id).first()
-    if not user:
+    # Verify user exists and restaurant is online in one round trip
+    user_exists, restaurant_online = (await db.execute(select(
+        exists().where(User.id == order_data.user_id),
+        exists().where(
+            Restaurant.id == order_data.restaurant_id,
+            Restaurant.is_online == True
+        )
+    ))).one()
+    if not user_exists:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Verify restaurant exists and is online
-    restaurant = db.query(Restaurant).filter(
-        Restaurant.id == order_data.restaurant_id,
-        Restaurant.is_online == True
-    ).first()
-    if not restaurant:
+    if not restaurant_online:
         raise HTTPException(status_code=404, detail="Restaurant not found or offline")
     
+    # Look up every cart item with a single IN (...) query
+    menu_item_ids = {item.menu_item_id for item in order_data.items}
+    prices = {}
+    if menu_item_ids:
+        prices = dict((await db.execute(select(MenuItem.id, MenuItem.price).where(
+            MenuItem.id.in_(menu_item_ids),
+            MenuItem.restaurant_id == order_data.restaurant_id,
+            MenuItem.is_available == True
+        ))).all())
+    
     # Calculate total amount and verify menu items
     total_amount = Decimal('0.00')
     order_items_data = []
     
     for item in order_data.items:
-        menu_item = db.query(MenuItem).filter(
-            MenuItem.id == item.menu_item_id,
-            MenuItem.restaurant_id == order_data.restaurant_id,
-            MenuItem.is_available == True
-        ).first()
-        
-        if not menu_item:
+        price = prices.get(item.menu_item_id)
+        if price is None:
             raise HTTPException(
                 status_code=404, 
                 detail=f"Menu item {item.menu_item_id} not found or unavailable"
             )
         
-        item_total = menu_item.price * item.quantity
-        total_amount += item_total
-        
+        total_amount += price * item.quantity
         order_items_data.append({
             "menu_item_id": item.menu_item_id,
             "quantity": item.quantity,
-            "price": menu_item.price
+            "price": price
         })
     
-    # Create order
-    new_order = Order(
-        user_id=order_data.user_id,
-        restaurant_id=order_data.restaurant_id,
-        total_amount=total_amount,
-        delivery_address=order_data.delivery_address,
-        special_instructions=order_data.special_instructions,
-        status="pending"
-    )
+    # Create order and its items in one transaction: INSERT ... RETURNING for
+    # the order, then one multi-row INSERT for the items
+    new_order = (await db.execute(
+        insert(Order).values(
+            user_id=order_data.user_id,
+            restaurant_id=order_data.restaurant_id,
+            total_amount=total_amount,
+            delivery_address=order_data.delivery_address,
+            special_instructions=order_data.special_instructions,
+            status="pending"
+        ).returning(Order)
+    )).scalar_one()
     
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
+    if order_items_data:
+        for item_data in order_items_data:
+            item_data["order_id"] = new_order.id
+        await db.execute(insert(OrderItem), order_items_data)
+    bind(order_id=new_order.id)
     
-    # Create order items
-    for item_data in order_items_data:
-        order_item = OrderItem(
-            order_id=new_order.id,
-            **item_data
-        )
-        db.add(order_item)
-    
-    db.commit()
+    # Notify restaurant service about new order once this transaction commits.
+    # The event carries the whole order so the restaurant never calls back.
+    snapshot = OrderSnapshot(
+        id=new_order.id,
+        version=new_order.version,
+        user_id=new_order.user_id,
+        restaurant_id=new_order.restaurant_id,
+        status=new_order.status,
+        total_amount=new_order.total_amount,
+        delivery_address=new_order.delivery_address,
+        special_instructions=new_order.special_instructions,
+        created_at=new_order.created_at,
+        items=[OrderItemSnapshot(**item_data) for item_data in order_items_data]
+    )
+    enqueue(db, "restaurant", "/orders/notify", {
+        "order_id": new_order.id,
+        "order": snapshot.model_dump(mode="json")
+    })
     
-    # Notify restaurant service about new order
-    try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                "http://restaurant-service:8000/orders/notify",
-                json={"order_id": new_order.id}
-            )
-    except Exception as e:
-        # Log error but don't fail the order creation
-        print(f"Failed to notify restaurant service: {e}")
+    await db.commit()
+    outbox_dispatcher.notify()
     
     return new_order
 
 @app.post("/orders/{order_id}/rate", response_model=RatingResponse, tags=["Ratings"])
-def rate_order(order_id: int, rating_data: RatingCreate, user_id: int, db: Session = Depends(get_db)):
+async def rate_order(order_id: int, rating_data: RatingCreate, user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Rate an order"""
     
-    # Verify order exists and belongs to user
-    order = db.query(Order).filter(
-        Order.id == order_id,
-        Order.user_id == user_id
-    ).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Check if user already rated this order
-    existing_rating = db.query(OrderRating).filter(
-        OrderRating.order_id == order_id,
-        OrderRating.user_id == user_id
-    ).first()
-    if existing_rating:
-        raise HTTPException(status_code=400, detail="Order already rated")
-    
     # Validate rating value
     if rating_data.rating < 1 or rating_data.rating > 5:
         raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
     
-    # Create rating
-    new_rating = OrderRating(
-        order_id=order_id,
-        user_id=user_id,
-        rating=rating_data.rating,
-        comment=rating_data.comment
-    )
+    # Verify order exists and belongs to user
+    restaurant_id = (await db.execute(
+        select(Order.restaurant_id).where(Order.id == order_id, Order.user_id == user_id)
+    )).scalar_one_or_none()
+    if restaurant_id is None:
+        raise HTTPException(status_code=404, detail="Order not found")
     
-    db.add(new_rating)
-    db.commit()
-    db.refresh(new_rating)
+    row = {
+        "order_id": order_id,
+        "user_id": user_id,
+        "rating": rating_data.rating,
+        "comment": rating_data.comment
+    }
+    if rating_writer is not None:
+        # Refuse duplicates before acknowledging; a queued one would only be dropped later
+        if (await db.execute(rating_exists(OrderRating, ORDER_RATING_KEY, row))).scalar():
+            raise HTTPException(status_code=400, detail="Order already rated")
+        queued = rating_writer.queue_order_rating(restaurant_id, row)
+        if queued == DUPLICATE:
+            raise HTTPException(status_code=400, detail="Order already rated")
+        if queued == QUEUED:
+            return JSONResponse(status_code=202, content={"message": "Rating queued", "order_id": order_id})
+    
+    # The unique constraint settles racing double-submits
+    new_rating = (await db.execute(insert_rating(OrderRating, ORDER_RATING_KEY, row))).first()
+    if new_rating is None:
+        raise HTTPException(status_code=400, detail="Order already rated")
+    
+    # Fold it into the restaurant's running rating in the same transaction
+    aggregate = (await db.execute(add_to_rating(Restaurant, restaurant_id, 1, rating_data.rating))).one()
+    publish_ratings(db, restaurants=[aggregate])
+    await db.commit()
+    outbox_dispatcher.notify()
+    catalog_cache.invalidate(restaurant_id)
     
     return new_rating
 
 @app.post("/agents/{agent_id}/rate", response_model=RatingResponse, tags=["Ratings"])
-def rate_delivery_agent(agent_id: int, rating_data: RatingCreate, user_id: int, order_id: int, db: Session = Depends(get_db)):
+async def rate_delivery_agent(agent_id: int, rating_data: RatingCreate, user_id: int, order_id: int, db: AsyncSession = Depends(get_async_db)):
     """Rate a delivery agent"""
     
+    # Validate rating value
+    if rating_data.rating < 1 or rating_data.rating > 5:
+        raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    
     # Verify order exists and belongs to user
-    order = db.query(Order).filter(
-        Order.id == order_id,
-        Order.user_id == user_id,
-        Order.delivery_agent_id == agent_id
-    ).first()
-    if not order:
+    assigned = (await db.execute(
+        select(exists().where(
+            Order.id == order_id,
+            Order.user_id == user_id,
+            Order.delivery_agent_id == agent_id
+        ))
+    )).scalar()
+    if not assigned:
         raise HTTPException(status_code=404, detail="Order not found or agent not assigned to this order")
     
-    # Check if user already rated this agent for this order
-    existing_rating = db.query(AgentRating).filter(
-        AgentRating.delivery_agent_id == agent_id,
-        AgentRating.user_id == user_id,
-        AgentRating.order_id == order_id
-    ).first()
-    if existing_rating:
+    row = {
+        "delivery_agent_id": agent_id,
+        "user_id": user_id,
+        "order_id": order_id,
+        "rating": rating_data.rating,
+        "comment": rating_data.comment
+    }
+    if rating_writer is not None:
+        # Refuse duplicates before acknowledging; a queued one would only be dropped later
+        if (await db.execute(rating_exists(AgentRating, AGENT_RATING_KEY, row))).scalar():
+            raise HTTPException(status_code=400, detail="Agent already rated for this order")
+        queued = rating_writer.queue_agent_rating(row)
+        if queued == DUPLICATE:
+            raise HTTPException(status_code=400, detail="Agent already rated for this order")
+        if queued == QUEUED:
+            return JSONResponse(status_code=202, content={"message": "Rating queued", "order_id": order_id})
+    
+    new_rating = (await db.execute(insert_rating(AgentRating, AGENT_RATING_KEY, row))).first()
+    if new_rating is None:
         raise HTTPException(status_code=400, detail="Agent already rated for this order")
     
-    # Validate rating value
-    if rating_data.rating < 1 or rating_data.rating > 5:
-        raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    # Fold it into the agent's running rating in the same transaction
+    aggregate = (await db.execute(add_to_rating(DeliveryAgent, agent_id, 1, rating_data.rating))).one()
+    publish_ratings(db, agents=[aggregate])
+    await db.commit()
+    outbox_dispatcher.notify()
     
-    # Create rating
-    new_rating = AgentRating(
-        delivery_agent_id=agent_id,
-        user_id=user_id,
-        order_id=order_id,
-        rating=rating_data.rating,
-        comment=rating_data.comment
-    )
+    return new_rating
+
+@app.post("/orders/status", tags=["Orders"])
+async def receive_order_status(batch: OrderStatusBatch, db: AsyncSession = Depends(get_async_db)):
+    """Receive order status changes from restaurant and delivery services"""
     
-    db.add(new_rating)
-    db.commit()
-    db.refresh(new_rating)
+    applied = 0
+    for event in batch.events:
+        # Only move forward; redelivered or reordered events are no-ops.
+        # The agent is recorded only if this service knows it (foreign key).
+        result = await db.execute(
+            update(Order)
+            .where(Order.id == event.order_id, Order.version < event.version)
+            .values(
+                status=event.status,
+                version=event.version,
+                delivery_agent_id=select(DeliveryAgent.id).where(
+                    DeliveryAgent.id == event.delivery_agent_id
+                ).scalar_subquery(),
+                updated_at=event.updated_at or datetime.utcnow()
+            )
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)
+        )
+        if result.first() is not None:
+            applied += 1
+    await db.commit()
     
-    return new_rating
+    for event in batch.events:
+        order_events.publish(event.model_dump(mode="json"))
+    
+    return {"message": f"{applied} of {len(batch.events)} status changes applied"}
+
+@app.get("/orders/{order_id}/events", tags=["Orders"])
+async def stream_order_events(order_id: int, user_id: int, request: Request):
+    """Stream status changes of an order as server-sent events"""
+    
+    # A short-lived session: the stream must not pin a pooled connection
+    async with AsyncSessionLocal() as db:
+        order = (await db.execute(
+            select(Order).where(Order.id == order_id, Order.user_id == user_id)
+        )).scalar_one_or_none()
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    current = order_event(order)
+    
+    # A reconnecting client that has already seen this version skips the replay
+    last_event_id = request.headers.get("last-event-id", "")
+    seen_version = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    async def stream():
+        # Subscribed only once the response starts streaming, so a client gone before
+        # then leaves no queue behind; changes in between are caught by the resync
+        queue = order_events.subscribe(order_id, current["version"])
+        try:
+            if current["version"] > seen_version:
+                yield format_sse(current)
+            if current["status"] in FINAL_STATUSES:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=ORDER_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield b": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+                if event["status"] in FINAL_STATUSES:
+                    return
+        finally:
+            order_events.unsubscribe(order_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/orders/{order_id}", response_model=OrderResponse, tags=["Orders"])
 def get_order(order_id: int, user_id: int, db: Session = Depends(get_db)):
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, Boolean, DECIMAL, Float, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 from datetime import datetime
@@ -23,6 +23,11 @@ class Restaurant(Base):
     cuisine_type = Column(String(100))
     is_online = Column(Boolean, default=True)
     rating = Column(DECIMAL(3,2), default=0.0)
+    # Running totals behind rating, maintained with each new rating
+    rating_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
     
     # Relationships
@@ -51,6 +56,7 @@ class Order(Base):
     restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
     delivery_agent_id = Column(Integer, ForeignKey("delivery_agents.id"))
     status = Column(String(50), default="pending")
+    version = Column(Integer, default=1, nullable=False)
     total_amount = Column(DECIMAL(10,2), nullable=False)
     delivery_address = Column(Text)
     special_instructions = Column(Text)
@@ -68,6 +74,8 @@ class OrderItem(Base):
 
 class OrderRating(Base):
     __tablename__ = "order_ratings"
+    # One rating per user per order; inserts rely on it with ON CONFLICT DO NOTHING
+    __table_args__ = (UniqueConstraint("order_id", "user_id", name="uq_order_ratings_order_user"),)
     
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"))
@@ -78,6 +86,9 @@ class OrderRating(Base):
 
 class AgentRating(Base):
     __tablename__ = "agent_ratings"
+    __table_args__ = (
+        UniqueConstraint("delivery_agent_id", "user_id", "order_id", name="uq_agent_ratings_agent_user_order"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     delivery_agent_id = Column(Integer, ForeignKey("delivery_agents.id"))
@@ -96,5 +107,32 @@ class DeliveryAgent(Base):
     phone = Column(String(20))
     vehicle_type = Column(String(50))
     is_available = Column(Boolean, default=True)
+    # Orders the agent can carry at once and how many it carries now
+    capacity = Column(Integer, default=1, nullable=False)
+    current_load = Column(Integer, default=0, nullable=False)
+    # Lifetime delivered orders, counted as each delivery completes
+    total_deliveries = Column(Integer, default=0, nullable=False)
     rating = Column(DECIMAL(3,2), default=0.0)
+    # Running totals behind rating, maintained with each new rating
+    rating_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, nullable=False)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    location_updated_at = Column(TIMESTAMP)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(50), nullable=False)
+    target = Column(String(50), nullable=False)
+    path = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(TIMESTAMP, default=datetime.utcnow)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    delivered_at = Column(TIMESTAMP)
+    # W3C trace context of the request that wrote the event
+    traceparent = Column(String(55))
@@ -0,0 +1,208 @@
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import AsyncSessionLocal
+from log import get_logger
+from models import AgentRating, DeliveryAgent, OrderRating, Restaurant
+from rating_sync import publish_ratings
+from ratings import AGENT_RATING_KEY, ORDER_RATING_KEY, add_to_rating
+
+log = get_logger("ratings")
+
+# Outcomes of queueing a rating
+QUEUED = "queued"
+DUPLICATE = "duplicate"
+FULL = "full"
+
+
+class RatingWriter:
+    """Write-behind queue for order and agent ratings.
+
+    Validated ratings are queued in memory and acknowledged straight away;
+    every `flush_seconds` the queue is written with one multi-row INSERT ...
+    ON CONFLICT DO NOTHING per table (per chunk), and each restaurant or agent
+    that received ratings gets a single aggregate UPDATE for the whole batch,
+    whose results are sent on to the other services through the outbox.
+    A second rating for a key already queued is refused, and callers check
+    the tables before queueing, so only a race between workers reaches the
+    unique constraints; those duplicates are logged and not counted. A batch
+    the database rejects (e.g. a foreign key violation) is split until the
+    rejected ratings are found; they are logged and dropped so they cannot
+    hold up the ones behind them. When the queue is full, callers should
+    fall back to writing the rating themselves.
+    """
+
+    def __init__(self, flush_seconds=0.25, max_pending=10000, chunk_size=1000, on_restaurants_rated=None,
+                 on_published=None):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.chunk_size = chunk_size
+        self.on_restaurants_rated = on_restaurants_rated
+        # Called after a batch's aggregates are committed to the outbox
+        self.on_published = on_published
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.flushed_at = None
+        # key -> (restaurant or agent id, row); the first rating for a key wins
+        self._orders = {}
+        self._agents = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._orders) + len(self._agents)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            log.error("Failed to flush ratings on shutdown", error=str(e))
+
+    def queue_order_rating(self, restaurant_id, row):
+        """Queue an order rating; returns QUEUED, DUPLICATE or FULL"""
+        return self._queue(self._orders, ORDER_RATING_KEY, restaurant_id, row)
+
+    def queue_agent_rating(self, row):
+        """Queue an agent rating; returns QUEUED, DUPLICATE or FULL"""
+        return self._queue(self._agents, AGENT_RATING_KEY, row["delivery_agent_id"], row)
+
+    def _queue(self, pending, key, entity_id, row):
+        key_values = tuple(row[column] for column in key)
+        if key_values in pending:
+            return DUPLICATE
+        if len(self) >= self.max_pending:
+            return FULL
+        row.setdefault("created_at", datetime.utcnow())
+        pending[key_values] = (entity_id, row)
+        return QUEUED
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Failed to flush ratings", error=str(e))
+
+    async def flush(self):
+        """Write queued ratings and fold them into the aggregates; return the rows inserted"""
+        orders, self._orders = self._orders, {}
+        agents, self._agents = self._agents, {}
+        if not orders and not agents:
+            return 0
+
+        rated = set()
+        try:
+            inserted = await self._write(orders, agents, rated)
+        except Exception:
+            # Not the data's fault (e.g. the database is unreachable): put the batch back;
+            # it wins over ratings queued since for the same key. Parts already written
+            # are skipped by ON CONFLICT on the next attempt.
+            for key, item in self._orders.items():
+                orders.setdefault(key, item)
+            for key, item in self._agents.items():
+                agents.setdefault(key, item)
+            self._orders, self._agents = orders, agents
+            raise
+        finally:
+            if rated and self.on_restaurants_rated:
+                for restaurant_id in rated:
+                    self.on_restaurants_rated(restaurant_id)
+
+        self.inserted += inserted
+        self.flushed_at = time.time()
+        return inserted
+
+    async def _write(self, orders, agents, rated):
+        """Write a batch, splitting it when the database rejects it; return the rows inserted"""
+        try:
+            return await self._write_batch(orders, agents, rated)
+        except (IntegrityError, DataError) as e:
+            if len(orders) + len(agents) == 1:
+                for table, pending in (("order_ratings", orders), ("agent_ratings", agents)):
+                    for key, (entity_id, row) in pending.items():
+                        log.error(
+                            "Rating rejected by the database; dropped",
+                            table=table,
+                            key=key,
+                            entity_id=entity_id,
+                            rating=row["rating"],
+                            error=str(e.orig)
+                        )
+                self.rejected += 1
+                return 0
+
+        # Halve the batch and write each half on its own
+        if orders and agents:
+            halves = [(orders, {}), ({}, agents)]
+        elif orders:
+            items = list(orders.items())
+            halves = [(dict(items[:len(items) // 2]), {}), (dict(items[len(items) // 2:]), {})]
+        else:
+            items = list(agents.items())
+            halves = [({}, dict(items[:len(items) // 2])), ({}, dict(items[len(items) // 2:]))]
+        inserted = 0
+        for half_orders, half_agents in halves:
+            inserted += await self._write(half_orders, half_agents, rated)
+        return inserted
+
+    async def _write_batch(self, orders, agents, rated):
+        async with AsyncSessionLocal() as db:
+            restaurant_totals = await self._insert(db, OrderRating, ORDER_RATING_KEY, orders)
+            agent_totals = await self._insert(db, AgentRating, AGENT_RATING_KEY, agents)
+            # Fixed order so concurrent batches on other workers lock rows alike
+            restaurants = [
+                (await db.execute(add_to_rating(Restaurant, restaurant_id, *restaurant_totals[restaurant_id]))).one()
+                for restaurant_id in sorted(restaurant_totals)
+            ]
+            agents = [
+                (await db.execute(add_to_rating(DeliveryAgent, agent_id, *agent_totals[agent_id]))).one()
+                for agent_id in sorted(agent_totals)
+            ]
+            publish_ratings(db, restaurants=restaurants, agents=agents)
+            await db.commit()
+        if (restaurants or agents) and self.on_published:
+            self.on_published()
+
+        rated.update(restaurant_totals)
+        inserted = sum(count for count, _ in restaurant_totals.values())
+        inserted += sum(count for count, _ in agent_totals.values())
+        self.duplicates += len(orders) + len(agents) - inserted
+        return inserted
+
+    async def _insert(self, db, model, key, pending):
+        """Multi-row insert skipping conflicts; return {entity id: (count, sum)} of the rows inserted"""
+        totals = {}
+        written = set()
+        items = list(pending.values())
+        key_columns = [getattr(model, column) for column in key]
+        for start in range(0, len(items), self.chunk_size):
+            rows = [row for _, row in items[start:start + self.chunk_size]]
+            inserted = await db.execute(
+                pg_insert(model)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=list(key))
+                .returning(*key_columns, model.rating)
+            )
+            for *key_values, rating in inserted:
+                written.add(tuple(key_values))
+                entity_id = pending[tuple(key_values)][0]
+                count, total = totals.get(entity_id, (0, 0))
+                totals[entity_id] = (count + 1, total + rating)
+        for key_values in pending.keys() - written:
+            log.warning("Duplicate rating dropped", table=model.__tablename__, key=key_values)
+        return totals
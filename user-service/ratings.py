@@ -0,0 +1,60 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import Numeric, cast, exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from rating_sync import aggregate_columns
+
+# Unique key of each rating table, in constraint order
+ORDER_RATING_KEY = ("order_id", "user_id")
+AGENT_RATING_KEY = ("delivery_agent_id", "user_id", "order_id")
+
+
+def insert_rating(model, key, row):
+    """INSERT of one rating that returns no row if `key` was already rated"""
+    return (
+        pg_insert(model)
+        .values(**row)
+        .on_conflict_do_nothing(index_elements=list(key))
+        .returning(model.id, model.rating, model.comment, model.created_at)
+    )
+
+
+def rating_exists(model, key, row):
+    """SELECT of whether `key` of `row` has been rated already"""
+    return select(exists().where(*(getattr(model, column) == row[column] for column in key)))
+
+
+def add_to_rating(model, entity_id, count, total):
+    """UPDATE that folds `count` new ratings summing to `total` into a row's aggregate.
+
+    SET expressions see the row as it was, so count, sum and the average
+    move together in one statement; concurrent raters serialize on the row
+    lock instead of overwriting each other. Returns the new aggregate, to be
+    passed on with rating_sync.publish_ratings.
+    """
+    new_count = model.rating_count + count
+    new_sum = model.rating_sum + total
+    return (
+        update(model)
+        .where(model.id == entity_id)
+        .values(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            rating=func.round(cast(new_sum, Numeric) / new_count, 2)
+        )
+        .returning(*aggregate_columns(model))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def average_rating(count, total):
+    """Average of `count` ratings summing to `total`, rounded like add_to_rating.
+
+    PostgreSQL's round() on numeric rounds halves away from zero, so this
+    uses ROUND_HALF_UP on exact decimals rather than round() on a float,
+    which rounds halves to even (and 2.675 is not exactly representable).
+    """
+    if not count:
+        return Decimal("0.00")
+    return (Decimal(total) / Decimal(count)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
@@ -0,0 +1,108 @@
+"""Recompute restaurant and agent rating aggregates from the rating tables.
+
+Walks restaurants and agents in primary-key order, a batch at a time
+(keyset pagination, so every batch is an index range scan). Each batch
+locks its rows, recomputes count and sum with one grouped query over the
+ratings of just those ids, writes them back and commits, so concurrent
+ratings are either counted here or applied after the batch, never lost.
+Each batch's aggregates are also put in the outbox for the services that
+keep a copy; the running service sends them at its next poll.
+
+Usage: python rebuild_ratings.py [--batch-size 500] [--only restaurants|agents]
+"""
+import argparse
+import os
+import sys
+
+# Modules shared by the three services (metrics, tracing, logging, ...) live in ../shared
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+
+from sqlalchemy import bindparam, func, select, update
+
+from database import SessionLocal
+from models import AgentRating, DeliveryAgent, Order, OrderRating, Restaurant
+from rating_sync import publish_ratings
+from ratings import average_rating
+
+
+def _totals_for_restaurants(db, restaurant_ids):
+    return db.execute(
+        select(Order.restaurant_id, func.count(OrderRating.id), func.coalesce(func.sum(OrderRating.rating), 0))
+        .join(Order, Order.id == OrderRating.order_id)
+        .where(Order.restaurant_id.in_(restaurant_ids))
+        .group_by(Order.restaurant_id)
+    ).all()
+
+
+def _totals_for_agents(db, agent_ids):
+    return db.execute(
+        select(AgentRating.delivery_agent_id, func.count(AgentRating.id), func.coalesce(func.sum(AgentRating.rating), 0))
+        .where(AgentRating.delivery_agent_id.in_(agent_ids))
+        .group_by(AgentRating.delivery_agent_id)
+    ).all()
+
+
+def rebuild(model, kind, totals_for, batch_size):
+    """Recompute one model's aggregates batch by batch; return the rows updated"""
+    table = model.__table__
+    last_id = 0
+    updated = 0
+    while True:
+        db = SessionLocal()
+        try:
+            ids = db.execute(
+                select(model.id)
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(batch_size)
+                .with_for_update()
+            ).scalars().all()
+            if not ids:
+                return updated
+
+            totals = {entity_id: (count, total) for entity_id, count, total in totals_for(db, ids)}
+            rows = []
+            for entity_id in ids:
+                count, total = totals.get(entity_id, (0, 0))
+                rows.append({
+                    "entity_id": entity_id,
+                    "new_count": count,
+                    "new_sum": total,
+                    "new_rating": average_rating(count, total)
+                })
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("entity_id"))
+                .values(
+                    rating_count=bindparam("new_count"),
+                    rating_sum=bindparam("new_sum"),
+                    rating=bindparam("new_rating")
+                ),
+                rows
+            )
+            publish_ratings(db, **{kind: [
+                (row["entity_id"], row["new_count"], row["new_sum"], row["new_rating"]) for row in rows
+            ]})
+            db.commit()
+        finally:
+            db.close()
+
+        updated += len(ids)
+        last_id = ids[-1]
+        print(f"REBUILD: {model.__tablename__} up to id {last_id} ({updated} rows)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute rating aggregates in keyset-batched passes")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--only", choices=["restaurants", "agents"])
+    args = parser.parse_args()
+
+    if args.only in (None, "restaurants"):
+        rebuild(Restaurant, "restaurants", _totals_for_restaurants, args.batch_size)
+    if args.only in (None, "agents"):
+        rebuild(DeliveryAgent, "agents", _totals_for_agents, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
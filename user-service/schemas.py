@@ -39,6 +39,9 @@ class RestaurantWithMenuResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CatalogInvalidation(BaseModel):
+    restaurant_id: Optional[int] = None  # None invalidates the whole catalog
+
 class OrderItemCreate(BaseModel):
     menu_item_id: int
     quantity: int
@@ -50,6 +53,36 @@ class OrderCreate(BaseModel):
     special_instructions: Optional[str] = None
     items: List[OrderItemCreate]
 
+class OrderItemSnapshot(BaseModel):
+    menu_item_id: int
+    quantity: int
+    price: Decimal
+
+# Full copy of an order carried by hand-off events; newer versions win
+class OrderSnapshot(BaseModel):
+    id: int
+    version: int
+    user_id: int
+    restaurant_id: int
+    delivery_agent_id: Optional[int] = None
+    status: str
+    total_amount: Decimal
+    delivery_address: Optional[str] = None
+    special_instructions: Optional[str] = None
+    created_at: datetime
+    items: List[OrderItemSnapshot] = []
+
+# Status change pushed by restaurant and delivery services
+class OrderStatusEvent(BaseModel):
+    order_id: int
+    version: int
+    status: str
+    delivery_agent_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
+
+class OrderStatusBatch(BaseModel):
+    events: List[OrderStatusEvent]
+
 class OrderResponse(BaseModel):
     id: int
     user_id: int